@@ -1,15 +1,78 @@
-from django.contrib import admin
-from .models import User, Patient, Dentist, Service, Appointment
+import json
+
+from django.contrib import admin, messages
+from django.utils import timezone
+from django.utils.html import format_html
+
+from .dedupe import MergeRefused, merge_candidate
+from .models import User, Patient, PatientClinicalRecord, Dentist, Service, Appointment, AppointmentEvent, DuplicateCandidate, SlowQuery, WaitlistEntry, WaitlistOffer
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'role', 'email', 'is_active', 'date_joined')
     list_filter  = ('role', 'is_active', 'is_staff')
 
+class PatientClinicalRecordInline(admin.StackedInline):
+    model = PatientClinicalRecord
+    can_delete = False
+
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
     list_display = ('name', 'gender', 'date_of_birth', 'phone', 'created_at')
     search_fields = ('name', 'phone')
+    inlines = [PatientClinicalRecordInline]
+
+@admin.register(DuplicateCandidate)
+class DuplicateCandidateAdmin(admin.ModelAdmin):
+    list_display = ('score', 'patient_a', 'summary_a', 'patient_b', 'summary_b', 'reasons', 'status', 'found_at')
+    list_filter = ('status',)
+    search_fields = ('patient_a__name', 'patient_b__name', 'patient_a__phone', 'patient_b__phone')
+    list_select_related = ('patient_a', 'patient_b')
+    readonly_fields = ('patient_a', 'patient_b', 'score', 'evidence', 'found_at', 'reviewed_by', 'reviewed_at')
+    actions = ['merge_selected', 'dismiss_selected']
+
+    @admin.display(description='A')
+    def summary_a(self, obj):
+        return self._summary(obj.patient_a)
+
+    @admin.display(description='B')
+    def summary_b(self, obj):
+        return self._summary(obj.patient_b)
+
+    def _summary(self, patient):
+        return f"{patient.phone} · {patient.date_of_birth:%Y-%m-%d} · {patient.email or '-'}"
+
+    @admin.display(description='evidence')
+    def reasons(self, obj):
+        return ", ".join(f"{name} {value}" for name, value in obj.evidence.items())
+
+    @admin.action(description='รวมเป็นคนเดียวกัน (เก็บแถวที่มีอีเมล/นัดมากกว่า/สร้างก่อน)')
+    def merge_selected(self, request, queryset):
+        merged = moved = 0
+        for candidate in queryset.filter(status='pending').select_related('patient_a', 'patient_b'):
+            # คู่ก่อนหน้าอาจรวมแถวของคู่นี้ไปแล้ว (คู่นี้ถูกลบตามไปด้วย)
+            if not DuplicateCandidate.objects.filter(pk=candidate.pk).exists():
+                continue
+            try:
+                _, count = merge_candidate(candidate, actor=request.user)
+            except Patient.DoesNotExist:
+                continue
+            except MergeRefused as exc:
+                self.message_user(request, str(exc), messages.WARNING)
+                continue
+            merged += 1
+            moved += count
+        self.message_user(request, f"รวมผู้ป่วย {merged} คู่ ย้ายนัดหมาย {moved} รายการ", messages.SUCCESS)
+
+    @admin.action(description='ไม่ใช่คนเดียวกัน')
+    def dismiss_selected(self, request, queryset):
+        count = queryset.filter(status='pending').update(
+            status='dismissed', reviewed_by=request.user, reviewed_at=timezone.now()
+        )
+        self.message_user(request, f"ทำเครื่องหมายแล้ว {count} คู่", messages.SUCCESS)
+
+    def has_add_permission(self, request):
+        return False
 
 @admin.register(Dentist)
 class DentistAdmin(admin.ModelAdmin):
@@ -26,3 +89,63 @@ class AppointmentAdmin(admin.ModelAdmin):
     list_display = ('appointment_date', 'start_time', 'end_time', 'patient', 'dentist', 'service', 'status')
     list_filter = ('appointment_date', 'status', 'dentist', 'service')
     search_fields = ('patient__name', 'dentist__name')
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'service', 'dentist', 'earliest_date', 'latest_date', 'status', 'created_at')
+    list_filter = ('status', 'service', 'dentist')
+    search_fields = ('patient__name',)
+
+@admin.register(WaitlistOffer)
+class WaitlistOfferAdmin(admin.ModelAdmin):
+    list_display = ('entry', 'appointment_id', 'status', 'expires_at', 'created_at')
+    list_filter = ('status',)
+
+
+@admin.register(AppointmentEvent)
+class AppointmentEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'appointment_id', 'action', 'old_status', 'new_status', 'actor')
+    list_filter = ('action', 'new_status')
+    search_fields = ('=appointment__id',)
+
+    # ประวัติเป็นแบบเพิ่มอย่างเดียว
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ('last_seen', 'count', 'max_ms', 'avg', 'view', 'frame', 'short_sql')
+    list_filter = ('view',)
+    search_fields = ('sql', 'frame')
+    fields = ('fingerprint', 'view', 'frame', 'count', 'total_ms', 'max_ms', 'first_seen', 'last_seen',
+              'sql', 'sample_params', 'plan_json')
+    readonly_fields = fields
+
+    @admin.display(description='avg ms')
+    def avg(self, obj):
+        return round(obj.avg_ms, 1)
+
+    @admin.display(description='SQL')
+    def short_sql(self, obj):
+        return obj.sql[:120]
+
+    @admin.display(description='EXPLAIN')
+    def plan_json(self, obj):
+        if obj.plan is None:
+            return '-'
+        return format_html('<pre>{}</pre>', json.dumps(obj.plan, indent=2))
+
+    # ลบได้เพื่อล้าง log แต่เพิ่ม/แก้เองไม่ได้
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
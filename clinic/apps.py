@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ClinicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'clinic'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .detail import build_schemas
+
+        build_schemas()
+
+        if getattr(settings, "CLINIC_WARMUP", False):
+            from .warmup import warm_up
+
+            warm_up()
@@ -0,0 +1,103 @@
+# clinic/assignment.py
+"""
+จองแบบ "ทันตแพทย์ท่านใดก็ได้": เลือกทันตแพทย์ที่ว่างในช่วงเวลานั้นและมีงานน้อยที่สุด
+
+ผู้สมัครทุกคนได้จาก query เดียว (ว่างหรือไม่ด้วย NOT EXISTS, จำนวนนัดของวันนั้น/สัปดาห์นั้นด้วย COUNT ที่ group แล้ว)
+แล้วล็อกแถวทันตแพทย์ที่เลือก (SELECT ... FOR UPDATE) ตรวจซ้ำและสร้างนัดใน transaction เดียว
+คำขอที่มาพร้อมกันจึงต่อคิวกันที่ทันตแพทย์คนนั้น คนที่สองเห็นนัดของคนแรกแล้วไปลองคนถัดไป
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, FilteredRelation, OuterRef, Q
+from django.db.models.functions import Coalesce
+
+from . import audit
+from .models import Appointment, Dentist
+from .occupancy import minute_of_day
+
+MAX_ATTEMPTS = 3
+
+
+def minute_span(start_time, end_time, duration_minutes):
+    begin = start_time.hour * 60 + start_time.minute
+    finish = end_time.hour * 60 + end_time.minute if end_time else begin + duration_minutes
+    return begin, finish if finish > begin else begin + duration_minutes
+
+
+def overlapping(day, begin, finish):
+    """นัดที่ยังจองเก้าอี้อยู่ในวัน day และทับช่วงนาที [begin, finish)"""
+    return (
+        Appointment.objects.filter(appointment_date=day)
+        .exclude(status="cancelled")
+        .annotate(
+            begin=minute_of_day("start_time"),
+            finish=Coalesce(minute_of_day("end_time"), minute_of_day("start_time") + F("service__duration_minutes")),
+        )
+        .filter(begin__lt=finish, finish__gt=begin)
+    )
+
+
+def free_dentists(service, day, start_time, end_time=None):
+    """ทันตแพทย์ที่เปิดใช้และว่างทั้งช่วง เรียงจากงานน้อยไปมาก (วันนั้น แล้วทั้งสัปดาห์)"""
+    begin, finish = minute_span(start_time, end_time, service.duration_minutes)
+    week_start = day - timedelta(days=day.weekday())
+    busy = overlapping(day, begin, finish).filter(dentist_id=OuterRef("pk"))
+    return (
+        Dentist.objects.filter(is_active=True)
+        .annotate(
+            # เงื่อนไขอยู่ใน JOIN จึงอ่านเฉพาะนัดของสัปดาห์นั้น (ใช้ index dentist, appointment_date)
+            week=FilteredRelation(
+                "appointments",
+                condition=Q(appointments__appointment_date__range=(week_start, week_start + timedelta(days=6)))
+                & ~Q(appointments__status="cancelled"),
+            ),
+        )
+        .annotate(
+            day_load=Count("week", filter=Q(week__appointment_date=day)),
+            week_load=Count("week"),
+        )
+        .filter(~Exists(busy))
+        .order_by("day_load", "week_load", "name")
+    )
+
+
+def book_any_dentist(patient, service, day, start_time, end_time=None, notes="", created_by=None):
+    """
+    สร้างนัดกับทันตแพทย์ที่ว่างและงานน้อยที่สุด คืนค่านัดที่สร้าง หรือ None ถ้าไม่มีใครว่าง
+    ถ้าคนที่เลือกถูกจองตัดหน้าระหว่างนั้น จะลองคนถัดไป (ไม่เกิน MAX_ATTEMPTS ครั้ง)
+    """
+    begin, finish = minute_span(start_time, end_time, service.duration_minutes)
+    tried = []
+    for _ in range(MAX_ATTEMPTS):
+        dentist_id = (
+            free_dentists(service, day, start_time, end_time)
+            .exclude(pk__in=tried)
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if dentist_id is None:
+            return None
+        tried.append(dentist_id)
+        try:
+            with transaction.atomic():
+                Dentist.objects.select_for_update().get(pk=dentist_id)
+                if overlapping(day, begin, finish).filter(dentist_id=dentist_id).exists():
+                    continue
+                appt = Appointment.objects.create(
+                    patient=patient,
+                    dentist_id=dentist_id,
+                    service=service,
+                    appointment_date=day,
+                    start_time=start_time,
+                    end_time=end_time,
+                    notes=notes,
+                    status="scheduled",
+                    created_by=created_by,
+                )
+        except IntegrityError:
+            # จองหน้าเดียวกันพร้อมกันจากทางอื่นที่ไม่ได้ล็อกทันตแพทย์ (unique_active_dentist_slot)
+            continue
+        audit.record(appt.pk, "created", new_status=appt.status)
+        return appt
+    return None
@@ -0,0 +1,95 @@
+# clinic/audit.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import AppointmentEvent
+
+# เหตุการณ์ที่รอ flush ของคำขอปัจจุบัน (None = ไม่ได้อยู่ในคำขอ เขียนทันที)
+_buffer = ContextVar("clinic_audit_buffer", default=None)
+_request = ContextVar("clinic_audit_request", default=None)
+
+
+def _current_actor():
+    request = _request.get()
+    user = getattr(request, "user", None)
+    return user if user is not None and user.is_authenticated else None
+
+
+def _jsonable(value):
+    if hasattr(value, "pk"):
+        return value.pk
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _emit(event):
+    buffer = _buffer.get()
+    if buffer is None:
+        event.save()
+    else:
+        buffer.append(event)
+
+
+def record(appointment_id, action, old_status="", new_status="", changed_fields=None, actor=None):
+    """
+    บันทึกเหตุการณ์ของนัดหมาย ถ้าอยู่ในคำขอจะรอ bulk_create ตอนตอบกลับ
+    ถ้าอยู่ใน transaction เหตุการณ์จะเข้าคิวเมื่อ commit แล้วเท่านั้น (rollback = ไม่มีเหตุการณ์)
+    """
+    event = AppointmentEvent(
+        appointment_id=appointment_id,
+        actor=actor or _current_actor(),
+        action=action,
+        old_status=old_status or "",
+        new_status=new_status or "",
+        changed_fields=changed_fields or {},
+    )
+    transaction.on_commit(lambda: _emit(event))
+
+
+def record_form_changes(form, old_status=""):
+    """บันทึกการแก้ไขจาก ModelForm ที่ save แล้ว: {field: [เดิม, ใหม่]}"""
+    if not form.has_changed():
+        return
+    changed = {
+        name: [_jsonable(form.initial.get(name)), _jsonable(form.cleaned_data.get(name))]
+        for name in form.changed_data
+    }
+    appt = form.instance
+    new_status = appt.status if "status" in changed else ""
+    record(appt.pk, "edited", old_status if new_status else "", new_status, changed)
+
+
+@contextmanager
+def buffered(request=None):
+    """
+    เก็บเหตุการณ์ทั้งหมดในบล็อกแล้วเขียนด้วย bulk_create ครั้งเดียว
+    ถ้าใช้คู่กับ transaction ให้เปิด buffered() ก่อน atomic() เหตุการณ์จะเข้า buffer ตอน commit
+    """
+    buffer_token = _buffer.set([])
+    request_token = _request.set(request)
+    try:
+        yield
+    finally:
+        events = _buffer.get()
+        _buffer.reset(buffer_token)
+        _request.reset(request_token)
+        if events:
+            AppointmentEvent.objects.bulk_create(events)
+
+
+class AuditMiddleware:
+    """เปิด buffer ต่อคำขอ ให้การ audit เพิ่ม INSERT ไม่เกินหนึ่งครั้งต่อคำขอ"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffered(request):
+            return self.get_response(request)
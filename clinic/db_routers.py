@@ -0,0 +1,117 @@
+# clinic/db_routers.py
+"""
+ส่ง query อ่านของหน้าที่ทำเครื่องหมายไว้ไปยังฐานข้อมูล replica (ถ้ามีใน settings.DATABASES)
+
+ทดสอบในเครื่องด้วย SQLite สองไฟล์ได้ เช่น
+    DATABASES = {
+        "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db.sqlite3"},
+        "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db.sqlite3",
+                    "TEST": {"MIRROR": "default"}},
+    }
+(ใช้ไฟล์แยกกันก็ได้ แต่ต้อง migrate --database=replica และคัดลอกข้อมูลเอง)
+"""
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+REPLICA_ALIAS = "replica"
+PIN_COOKIE = "clinic_db_pin"
+
+_use_replica = ContextVar("clinic_use_replica", default=False)
+# โมเดลที่ถูกเขียนระหว่างคำขอปัจจุบัน (ReplicaPinMiddleware ตั้งเป็น set ใหม่ทุกคำขอ)
+_written = ContextVar("clinic_written_models", default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # DatabaseCache (CACHE_BACKEND=db) อ่านจาก primary เสมอ ไม่อย่างนั้นจะเห็น version ที่ invalidate ไปแล้ว
+        if model._meta.app_label == "django_cache":
+            return None
+        if _use_replica.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        written = _written.get()
+        if written is not None:
+            written.add(model._meta.label_lower)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica คือสำเนาของ default จึงเชื่อมกันได้
+        return {obj1._state.db, obj2._state.db} <= {"default", REPLICA_ALIAS}
+
+
+class read_from_replica(ContextDecorator):
+    """with read_from_replica(): ... หรือใช้เป็น decorator ของฟังก์ชันที่อ่านอย่างเดียว"""
+
+    def __enter__(self):
+        self._token = _use_replica.set(True)
+        return self
+
+    def __exit__(self, *exc):
+        _use_replica.reset(self._token)
+        return False
+
+
+def is_pinned(request):
+    """เพิ่งมีการเขียน (POST ฯลฯ) จากเบราว์เซอร์นี้ -> อ่านจาก primary เพื่อให้เห็นข้อมูลที่เพิ่งเขียน"""
+    return PIN_COOKIE in request.COOKIES
+
+
+def use_replica(view_func):
+    """view decorator: GET/HEAD ที่ไม่ได้ถูก pin อ่านจาก replica"""
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or is_pinned(request):
+            return view_func(request, *args, **kwargs)
+        with read_from_replica():
+            return view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def _pins(label):
+    """การเขียนโมเดลนี้ทำให้ต้องอ่านจาก primary ต่อหรือไม่ (session/ข้อมูลภายในระบบไม่นับ)"""
+    app_label = label.partition(".")[0]
+    return (
+        app_label in getattr(settings, "CLINIC_REPLICA_PIN_APPS", ("clinic",))
+        and label not in getattr(settings, "CLINIC_REPLICA_PIN_IGNORE", ())
+    )
+
+
+@receiver(user_logged_in)
+def _ignore_last_login(sender, user, **kwargs):
+    # login บันทึก last_login ของผู้ใช้ ซึ่งหน้าที่อ่านจาก replica ไม่ได้ใช้ จึงไม่นับเป็นการเขียน
+    written = _written.get()
+    if written is not None:
+        written.discard(user._meta.label_lower)
+
+
+class ReplicaPinMiddleware:
+    """
+    หลังคำขอที่เขียนข้อมูลลง primary จริง (ดู ReplicaRouter.db_for_write)
+    ตั้ง cookie ให้อ่านจาก primary ไปอีก CLINIC_REPLICA_PIN_SECONDS วินาที
+    คำขอที่ไม่เขียนอะไร (ฟอร์มไม่ผ่าน, login/logout) ไม่ถูก pin
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _written.set(set())
+        try:
+            response = self.get_response(request)
+            written = _written.get()
+        finally:
+            _written.reset(token)
+        if any(_pins(label) for label in written):
+            response.set_cookie(
+                PIN_COOKIE, "1",
+                max_age=getattr(settings, "CLINIC_REPLICA_PIN_SECONDS", 10),
+                httponly=True, samesite="Lax",
+            )
+        return response
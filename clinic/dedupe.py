@@ -0,0 +1,346 @@
+# clinic/dedupe.py
+"""
+หาผู้ป่วยซ้ำ (คนเดียวกันแต่มีหลายแถว Patient) แบบ batch แล้วรวมแถว
+
+blocking: แต่ละแถวได้ key ไม่กี่ตัว คือเบอร์โทรที่ normalize แล้ว, รหัสเสียงของชื่อ,
+วันเกิด + รหัสเสียงของคำแรก/คำสุดท้ายของชื่อ (หลังเรียงคำ) เปรียบเทียบเฉพาะแถวที่มี key ร่วมกัน แทนการเทียบทุกคู่ (N²)
+key เก็บเป็น hash ใน ndarray แล้ว argsort ครั้งเดียวเพื่อแบ่งกลุ่ม ในหน่วยความจำจึงเหลือสตริงแค่ชื่อต่อแถว
+กลุ่มที่ใหญ่เกิน CLINIC_DEDUPE_MAX_BLOCK (เช่น เบอร์กลางของบริษัท) ข้ามไป
+
+คะแนน 0..1 จากความคล้ายของชื่อ (trigram), เบอร์โทร, วันเกิด, อีเมล และเพศ
+คู่ที่ได้ตั้งแต่ CLINIC_DEDUPE_MIN_SCORE ขึ้นไปเก็บใน DuplicateCandidate ให้เจ้าหน้าที่ตรวจใน admin
+แล้วรวมด้วย merge_patients() ซึ่งย้ายนัดหมาย/waitlist ด้วย UPDATE เดียวต่อตาราง
+"""
+import re
+import unicodedata
+from array import array
+from datetime import date
+from itertools import combinations
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import audit
+from .models import (
+    Appointment, AppointmentArchive, DuplicateCandidate, Patient, PatientClinicalRecord, WaitlistEntry,
+)
+from .signals import appointments_changed
+
+BATCH_SIZE = 2000
+# ตอนรวม: ช่องของ Patient ที่แถวที่เก็บไว้ว่างจะเอาค่าจากแถวที่ถูกรวม / ช่องประวัติที่ต่อท้ายกัน
+MERGED_FIELDS = ("email", "emergency_contact", "emergency_phone", "photo")
+CLINICAL_APPEND_FIELDS = ("allergy", "medical_history")
+
+_TITLE_RE = re.compile(
+    r"^(?:นางสาว|นาง|นาย|น\.ส\.|ด\.ช\.|ด\.ญ\.|เด็กชาย|เด็กหญิง|ทพญ\.|ทพ\.|(?:mrs|mr|ms|miss|dr)(?:\.\s*|\s+))\s*"
+)
+_PUNCT_RE = re.compile(r"[^\w\s\u0e00-\u0e7f]+")
+_SILENT_RE = re.compile(".์")  # ตัวการันต์: พยัญชนะหน้า ์ ไม่ออกเสียง
+_REPEAT_RE = re.compile(r"(.)\1+")
+
+# พยัญชนะไทยที่ออกเสียงคล้ายกันใช้รหัสเดียวกัน สระ/วรรณยุกต์/อ ถูกตัดทิ้ง
+_THAI_SOUNDS = {
+    "ก": "k", "ขฃคฅฆ": "K", "ง": "g", "จ": "c", "ฉชฌ": "C", "ซศษส": "s", "ญย": "y",
+    "ฎด": "d", "ฏต": "t", "ฐฑฒถทธ": "T", "ณน": "n", "บ": "b", "ป": "p", "ผพภ": "P",
+    "ฝฟ": "f", "ม": "m", "รลฬฤฦ": "r", "ว": "w", "หฮ": "h",
+}
+_THAI_TABLE = {
+    **{code: None for code in range(0x0E00, 0x0E80)},
+    **{ord(char): sound for chars, sound in _THAI_SOUNDS.items() for char in chars},
+}
+# Soundex: สระเป็นตัวคั่น (0) h/w ไม่นับ
+_SOUNDEX_TABLE = str.maketrans("aeiouybfpvcgjkqsxzdtlmnrhw", "00000011112222222233455600")
+
+
+def name_tokens(name):
+    """ชื่อที่ตัดคำนำหน้าและเครื่องหมายแล้ว เป็น tuple ของคำที่เรียงแล้ว (สลับชื่อ-นามสกุลได้ผลเท่ากัน)"""
+    text = unicodedata.normalize("NFKC", name or "").casefold().strip()
+    text = _PUNCT_RE.sub(" ", _TITLE_RE.sub("", text))
+    return tuple(sorted(text.split()))
+
+
+def normalize_phone(phone):
+    """ตัวเลขล้วน +66/66 นำหน้าเป็น 0 เบอร์สั้นหรือเลขซ้ำทั้งเบอร์ (เช่น 0000000000) ถือว่าไม่มี"""
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("66") and len(digits) == 11:
+        digits = "0" + digits[2:]
+    if len(digits) < 9 or len(set(digits)) == 1:
+        return ""
+    return digits
+
+
+def phonetic(token):
+    """รหัสเสียงของคำ: Soundex สำหรับอักษรละติน โครงพยัญชนะตามกลุ่มเสียงสำหรับภาษาไทย"""
+    if token[0].isascii():
+        codes = _REPEAT_RE.sub(r"\1", token.translate(_SOUNDEX_TABLE))[1:]
+        return (token[0] + codes.replace("0", "") + "000")[:4]
+    skeleton = _SILENT_RE.sub("", token).translate(_THAI_TABLE)
+    return _REPEAT_RE.sub(r"\1", skeleton)[:5]
+
+
+def blocking_keys(tokens, dob, phone):
+    """key ที่ใช้จับกลุ่ม (ขึ้นต้นด้วยชนิดของ key เพื่อไม่ให้ชนกันข้ามชนิด)"""
+    keys = []
+    if phone:
+        keys.append("p:" + phone)
+    sounds = [sound for sound in map(phonetic, tokens) if sound]
+    if sounds:
+        keys.append("n:" + " ".join(sorted(sounds)))
+        if dob:
+            keys.extend(f"d:{dob.isoformat()}:{sound}" for sound in dict.fromkeys((sounds[0], sounds[-1])))
+    return keys
+
+
+def trigrams(text):
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """ความคล้ายของชื่อแบบ pg_trgm: |trigram ร่วม| / |trigram รวม|"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Rows:
+    """ผู้ป่วยทั้งหมดในรูปที่ประหยัดหน่วยความจำ: ชื่อเป็นสตริง ที่เหลือเป็นเลข/hash ใน array"""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.names = []
+        self.dobs = array("q")
+        self.genders = array("B")
+        self.phones = array("q")
+        self.emails = array("q")
+        self.key_hashes = array("q")
+        self.key_rows = array("q")
+        # key ของแถว r อยู่ที่ key_hashes[key_start[r]:key_start[r + 1]]
+        self.key_start = array("q", [0])
+
+    def add(self, pk, name, gender, dob, phone, email):
+        tokens = name_tokens(name)
+        phone = normalize_phone(phone)
+        email = (email or "").strip().lower()
+        row = len(self.ids)
+        self.ids.append(pk)
+        self.names.append(" ".join(tokens))
+        self.dobs.append(dob.toordinal() if dob else 0)
+        self.genders.append(ord((gender or " ")[:1]))
+        self.phones.append(hash(phone) if phone else 0)
+        self.emails.append(hash(email) if email else 0)
+        for key in blocking_keys(tokens, dob, phone):
+            self.key_hashes.append(hash(key))
+            self.key_rows.append(row)
+        self.key_start.append(len(self.key_hashes))
+
+    def blocks(self, max_block):
+        """[(hash ของ key, row index ที่มี key นี้)], hash ของกลุ่มที่ใหญ่เกินและถูกข้าม"""
+        hashes = np.frombuffer(self.key_hashes, dtype=np.int64)
+        rows = np.frombuffer(self.key_rows, dtype=np.int64)
+        order = np.argsort(hashes, kind="stable")
+        ordered = hashes[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        sizes = np.diff(np.r_[starts, len(ordered)])
+        wanted = (sizes >= 2) & (sizes <= max_block)
+        groups = (
+            (int(ordered[start]), rows[order[start:start + size]])
+            for start, size in zip(starts[wanted], sizes[wanted])
+        )
+        return groups, set(ordered[starts[sizes > max_block]].tolist())
+
+    def first_shared_key(self, i, j, skipped):
+        """key ร่วมที่น้อยที่สุดของสองแถว (ไม่นับกลุ่มที่ถูกข้าม) คู่หนึ่งจึงถูกเทียบในกลุ่มเดียว"""
+        shared = set(self.key_hashes[self.key_start[i]:self.key_start[i + 1]]).intersection(
+            self.key_hashes[self.key_start[j]:self.key_start[j + 1]]
+        )
+        return min(shared - skipped)
+
+    def score(self, i, j, grams):
+        """(คะแนน 0..1, หลักฐาน) ของแถว i กับ j (grams: row -> trigram ของชื่อ)"""
+        name = similarity(grams[i], grams[j])
+        evidence = {"name": round(name, 2)}
+        total = 0.45 * name
+        if self.phones[i] and self.phones[i] == self.phones[j]:
+            evidence["phone"] = True
+            total += 0.25
+        if self.dobs[i] and self.dobs[i] == self.dobs[j]:
+            evidence["dob"] = True
+            total += 0.25
+        elif self.dobs[i] and self.dobs[j] and _swapped(self.dobs[i], self.dobs[j]):
+            evidence["dob"] = "day/month swapped"
+            total += 0.15
+        if self.emails[i] and self.emails[j]:
+            # อีเมลต่างกัน = มีบัญชีผู้ใช้แยกกัน น่าจะเป็นคนละคน
+            same = self.emails[i] == self.emails[j]
+            evidence["email"] = same
+            total += 0.15 if same else -0.2
+        if self.genders[i] != self.genders[j]:
+            evidence["gender"] = False
+            total -= 0.15
+        return min(max(total, 0.0), 1.0), evidence
+
+
+def _swapped(a, b):
+    a, b = date.fromordinal(a), date.fromordinal(b)
+    return a.year == b.year and a.month == b.day and a.day == b.month
+
+
+def find_candidates(rows, min_score=None, max_block=None, stats=None):
+    """
+    rows: iterable ของ (id, name, gender, date_of_birth, phone, email)
+    yield (id น้อย, id มาก, คะแนน, หลักฐาน) ของคู่ที่คะแนนถึงเกณฑ์ (แต่ละคู่ครั้งเดียว)
+    """
+    if min_score is None:
+        min_score = getattr(settings, "CLINIC_DEDUPE_MIN_SCORE", 0.7)
+    if max_block is None:
+        max_block = getattr(settings, "CLINIC_DEDUPE_MAX_BLOCK", 50)
+    stats = {} if stats is None else stats
+
+    table = _Rows()
+    for row in rows:
+        table.add(*row)
+    stats["patients"] = len(table.ids)
+
+    groups, skipped = table.blocks(max_block)
+    stats["skipped_blocks"] = len(skipped)
+    compared = 0
+    for key, group in groups:
+        grams = {}
+        for i, j in combinations(sorted(group.tolist()), 2):
+            if table.first_shared_key(i, j, skipped) != key:
+                continue  # เทียบไปแล้ว (หรือจะเทียบ) ในกลุ่มของ key ร่วมตัวอื่น
+            compared += 1
+            for row in (i, j):
+                if row not in grams:
+                    grams[row] = trigrams(table.names[row])
+            score, evidence = table.score(i, j, grams)
+            if score >= min_score:
+                a, b = sorted((table.ids[i], table.ids[j]))
+                yield a, b, round(score, 3), evidence
+    stats["compared"] = compared
+
+
+def find_duplicates():
+    """
+    หาคู่ผู้ป่วยซ้ำทั้งฐานข้อมูลแล้วเก็บใน DuplicateCandidate
+    คู่ที่เคย dismiss แล้วคงสถานะเดิม (อัปเดตแค่คะแนน) คู่ pending ที่ไม่ถึงเกณฑ์แล้วถูกลบ
+    """
+    started = timezone.now()
+    stats = {}
+    rows = (
+        Patient.objects.order_by()
+        .values_list("id", "name", "gender", "date_of_birth", "phone", "email")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    batch = []
+    stored = 0
+    for a, b, score, evidence in find_candidates(rows, stats=stats):
+        batch.append(DuplicateCandidate(patient_a_id=a, patient_b_id=b, score=score, evidence=evidence, found_at=started))
+        if len(batch) >= BATCH_SIZE:
+            stored += _store(batch)
+            batch = []
+    stored += _store(batch)
+    stale, _ = DuplicateCandidate.objects.filter(status="pending", found_at__lt=started).delete()
+    return {**stats, "candidates": stored, "stale": stale}
+
+
+def _store(candidates):
+    if candidates:
+        DuplicateCandidate.objects.bulk_create(
+            candidates,
+            update_conflicts=True,
+            unique_fields=["patient_a", "patient_b"],
+            update_fields=["score", "evidence", "found_at"],
+        )
+    return len(candidates)
+
+
+class MergeRefused(Exception):
+    """รวมอัตโนมัติไม่ได้ เช่น ทั้งสองแถวผูกกับบัญชีผู้ใช้คนละบัญชี (อีเมลต่างกัน)"""
+
+
+def survivor(a, b):
+    """
+    แถวที่เก็บไว้เมื่อรวมคู่ a, b: มีอีเมล (ผูกกับบัญชีผู้ใช้) ก่อน แล้วนัดหมายมากกว่า แล้วสร้างก่อน
+    คืนค่า (keep, drop)
+    """
+    counts = dict(
+        Appointment.objects.filter(patient_id__in=[a.pk, b.pk]).order_by()
+        .values_list("patient_id").annotate(n=Count("id"))
+    )
+    keep = min((a, b), key=lambda p: (not p.email, -counts.get(p.pk, 0), p.pk))
+    return (a, b) if keep is a else (b, a)
+
+
+def merge_patients(keep, drop, actor=None):
+    """
+    รวม drop เข้า keep: ย้ายนัดหมาย นัดที่ archive แล้ว และ waitlist ด้วย UPDATE เดียวต่อตาราง
+    ช่องที่ keep ว่างเอาค่าจาก drop ประวัติแพ้ยา/ประวัติการรักษาต่อท้ายกัน แล้วลบ drop
+    คืนค่าจำนวนนัดหมายที่ย้าย ถ้าทั้งสองแถวมีอีเมลและต่างกันจะ raise MergeRefused
+    """
+    if keep.pk == drop.pk:
+        raise ValueError("Cannot merge a patient into itself")
+    now = timezone.now()
+    with audit.buffered(), transaction.atomic():
+        # ล็อกทั้งสองแถว (เรียงตาม pk กัน deadlock) การจองใหม่ให้ drop จะรอจนรวมเสร็จ
+        locked = {p.pk: p for p in Patient.objects.select_for_update().filter(pk__in=[keep.pk, drop.pk]).order_by("pk")}
+        if len(locked) != 2:
+            raise Patient.DoesNotExist("Patient was already merged or deleted")
+        keep, drop = locked[keep.pk], locked[drop.pk]
+        # Patient ผูกกับบัญชีผู้ใช้ด้วยอีเมล รวมแล้วบัญชีของแถวที่ถูกลบจะไม่มีข้อมูลผู้ป่วย
+        if keep.email and drop.email and keep.email.strip().lower() != drop.email.strip().lower():
+            raise MergeRefused(
+                f"ผู้ป่วย #{keep.pk} และ #{drop.pk} มีอีเมลต่างกัน ({keep.email} / {drop.email}) "
+                "ต้องแก้อีเมลหรือบัญชีผู้ใช้ให้ตรงกันก่อนรวม"
+            )
+
+        moved = list(Appointment.objects.filter(patient_id=drop.pk).order_by().values_list("pk", flat=True))
+        Appointment.objects.filter(patient_id=drop.pk).update(
+            patient_id=keep.pk, updated_at=now, version=F("version") + 1
+        )
+        for pk in moved:
+            audit.record(pk, "edited", changed_fields={"patient": [drop.pk, keep.pk]}, actor=actor)
+        AppointmentArchive.objects.filter(patient_id=drop.pk).update(patient_id=keep.pk)
+        WaitlistEntry.objects.filter(patient_id=drop.pk).update(patient_id=keep.pk)
+
+        changes = {name: getattr(drop, name) for name in MERGED_FIELDS if not getattr(keep, name) and getattr(drop, name)}
+        Patient.objects.filter(pk=keep.pk).update(**changes, updated_at=now, version=F("version") + 1)
+        _merge_clinical(keep, drop)
+
+        Patient.objects.filter(pk=drop.pk).delete()
+        transaction.on_commit(lambda: appointments_changed.send(sender=Appointment))
+    return len(moved)
+
+
+def _merge_clinical(keep, drop):
+    records = {r.pk: r for r in PatientClinicalRecord.objects.filter(pk__in=[keep.pk, drop.pk])}
+    source = records.get(drop.pk)
+    if source is None:
+        return
+    target = records.get(keep.pk)
+    if target is None:
+        PatientClinicalRecord.objects.create(
+            patient_id=keep.pk, address=source.address,
+            allergy=source.allergy, medical_history=source.medical_history,
+        )
+        return
+    if not target.address:
+        target.address = source.address
+    for name in CLINICAL_APPEND_FIELDS:
+        ours, theirs = getattr(target, name), getattr(source, name)
+        if theirs and theirs not in ours:
+            setattr(target, name, f"{ours}\n{theirs}" if ours else theirs)
+    target.save()
+
+
+def merge_candidate(candidate, actor=None):
+    """รวมคู่ใน DuplicateCandidate ตามกติกาของ survivor() คืนค่า (keep, จำนวนนัดที่ย้าย)"""
+    keep, drop = survivor(candidate.patient_a, candidate.patient_b)
+    return keep, merge_patients(keep, drop, actor=actor)
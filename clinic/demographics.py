@@ -0,0 +1,77 @@
+# clinic/demographics.py
+from datetime import date
+
+from django.db.models import Case, CharField, Count, Value, When
+from django.db.models.functions import TruncMonth, TruncYear
+
+from .models import Patient
+
+# (อายุต่ำสุด, ชื่อช่วง) เรียงจากมากไปน้อย ช่วงสุดท้ายต้องเริ่มที่ 0
+AGE_BANDS = (
+    (65, "65+"),
+    (50, "50-64"),
+    (35, "35-49"),
+    (18, "18-34"),
+    (13, "13-17"),
+    (0, "0-12"),
+)
+COHORTS = {"year": TruncYear, "month": TruncMonth}
+
+
+def years_ago(today, years):
+    """วันสุดท้ายที่เกิดแล้วจะมีอายุครบ years ปี ณ today (ตรงกับ Patient.age)"""
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:  # 29 ก.พ. ในปีที่ไม่ใช่ปีอธิกสุรทิน
+        return date(today.year - years, 2, 28)
+
+
+def age_band(today=None):
+    """
+    expression ช่วงอายุจาก date_of_birth เทียบกับวันตัด (ไม่ต้องคำนวณอายุทีละแถว)
+    อายุ >= n ก็ต่อเมื่อ date_of_birth <= วันนี้ย้อนไป n ปี
+    """
+    today = today or date.today()
+    return Case(
+        *[
+            When(date_of_birth__lte=years_ago(today, minimum), then=Value(label))
+            for minimum, label in AGE_BANDS[:-1]
+        ],
+        default=Value(AGE_BANDS[-1][1]),
+        output_field=CharField(),
+    )
+
+
+def summary(today=None, cohort="year"):
+    """
+    สรุปผู้ป่วยตามช่วงอายุ เพศ และรุ่นที่ลงทะเบียน ด้วย GROUP BY query เดียว
+    แถวที่ได้มีไม่เกิน ช่วงอายุ x เพศ x รุ่น จึงรวมต่อใน Python ได้โดยไม่ขึ้นกับจำนวนผู้ป่วย
+    """
+    rows = (
+        Patient.objects.order_by()
+        .annotate(band=age_band(today), cohort=COHORTS[cohort]("created_at"))
+        .values("band", "gender", "cohort")
+        .annotate(count=Count("id"))
+    )
+    genders = [code for code, _ in Patient.GENDER_CHOICES]
+    bands = {label: dict.fromkeys(genders, 0) for _, label in reversed(AGE_BANDS)}
+    gender_totals = dict.fromkeys(genders, 0)
+    cohorts = {}
+    total = 0
+    for row in rows:
+        count = row["count"]
+        total += count
+        bands[row["band"]][row["gender"]] = bands[row["band"]].get(row["gender"], 0) + count
+        gender_totals[row["gender"]] = gender_totals.get(row["gender"], 0) + count
+        key = row["cohort"].date().isoformat() if row["cohort"] else None
+        cohorts[key] = cohorts.get(key, 0) + count
+
+    return {
+        "total": total,
+        "gender": gender_totals,
+        "age_bands": [
+            {"band": label, "total": sum(counts.values()), **counts}
+            for label, counts in bands.items()
+        ],
+        "cohorts": [{"cohort": key, "count": cohorts[key]} for key in sorted(cohorts, key=str)],
+    }
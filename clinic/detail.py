@@ -0,0 +1,77 @@
+# clinic/detail.py
+from django.apps import apps
+from django.db import models
+
+from .models import Dentist, Patient, Service
+
+# โมเดลที่เปิดให้ดูผ่าน object_detail ได้ (ห้ามเปิด User ฯลฯ)
+DETAIL_MODELS = ("patient", "dentist", "service", "appointment")
+
+_SCHEMAS = {}
+
+
+class DetailSchema:
+    """ข้อมูล meta ของโมเดลที่คำนวณครั้งเดียว: ฟิลด์ที่จะแสดง และ FK ที่ต้อง select_related"""
+
+    def __init__(self, model):
+        self.model = model
+        self.verbose_name = model._meta.verbose_name
+        self.fields = tuple(
+            (field.name, field.verbose_name, isinstance(field, models.ImageField))
+            for field in model._meta.fields
+        )
+        # ตารางที่แยกออกไปแบบ one-to-one (เช่น Patient -> PatientClinicalRecord) แสดงต่อท้าย
+        self.extensions = tuple(
+            (
+                rel.get_accessor_name(),
+                tuple(
+                    (field.name, field.verbose_name, isinstance(field, models.ImageField))
+                    for field in rel.related_model._meta.fields
+                    if not field.primary_key
+                ),
+            )
+            for rel in model._meta.related_objects
+            if rel.one_to_one
+        )
+        self.select_related = tuple(
+            field.name for field in model._meta.fields if field.many_to_one or field.one_to_one
+        ) + tuple(accessor for accessor, _ in self.extensions)
+
+    def get_object(self, pk):
+        return self.model.objects.select_related(*self.select_related).filter(pk=pk).first()
+
+    def field_values(self, obj):
+        values = [
+            {"label": label, "value": getattr(obj, name), "is_image": is_image}
+            for name, label, is_image in self.fields
+        ]
+        for accessor, fields in self.extensions:
+            related = getattr(obj, accessor, None)  # ยังไม่มีแถว -> ค่าว่าง
+            values += [
+                {"label": label, "value": getattr(related, name, ""), "is_image": is_image}
+                for name, label, is_image in fields
+            ]
+        return values
+
+
+def can_view(user, obj):
+    """
+    ผู้ดูแลเห็นทุกรายการ ผู้ป่วยเห็นทันตแพทย์/บริการ และเฉพาะประวัติกับนัดของตัวเอง (จับคู่ด้วยอีเมล)
+    ใช้ FK ที่ select_related มาแล้ว จึงไม่มี query เพิ่ม
+    """
+    if user.role == "admin" or user.is_staff:
+        return True
+    if isinstance(obj, (Dentist, Service)):
+        return True
+    patient = obj if isinstance(obj, Patient) else getattr(obj, "patient", None)
+    return bool(user.email) and patient is not None and patient.email == user.email
+
+
+def build_schemas():
+    """เรียกตอน ClinicConfig.ready()"""
+    for name in DETAIL_MODELS:
+        _SCHEMAS[name] = DetailSchema(apps.get_model("clinic", name))
+
+
+def get_schema(model_name):
+    return _SCHEMAS.get(model_name.lower())
@@ -1,15 +1,153 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
-from .models import User, Patient, Dentist, Service, Appointment
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.forms.models import ModelChoiceIterator
+from . import refdata
+from .assignment import free_dentists
+from .models import User, Patient, PatientClinicalRecord, Dentist, Service, Appointment, WaitlistEntry
+from .series import FREQUENCY_CHOICES, MAX_OCCURRENCES, occurrences
+from .status import allowed_targets
+
+TW_INPUT_CLASS = "w-full border px-3 py-2 rounded focus:ring-indigo-500 focus:border-indigo-500"
+
+# widget ที่ใช้ร่วมกัน (Field จะ deepcopy widget ไปเองจึงแชร์ instance ได้)
+DATE_INPUT = forms.DateInput(attrs={"type": "date"})  # ✅ HTML5 date picker
+TIME_INPUT = forms.TimeInput(attrs={"type": "time"})  # ✅ HTML5 time picker
+NOTES_INPUT = forms.Textarea(attrs={"rows": 3, "placeholder": "หมายเหตุเพิ่มเติม (ถ้ามี)..."})
+APPOINTMENT_WIDGETS = {
+    "appointment_date": DATE_INPUT,
+    "start_time": TIME_INPUT,
+    "end_time": TIME_INPUT,
+    "notes": NOTES_INPUT,
+}
+
+
+class ActiveChoiceIterator(ModelChoiceIterator):
+    """ตัวเลือกจาก refdata (ไม่ query ทุกครั้งที่ render) ส่วนการ validate ยังใช้ queryset ของ field"""
+    def __init__(self, field, load_rows):
+        super().__init__(field)
+        self.load_rows = load_rows
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self.load_rows():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.load_rows()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.load_rows())
+
+
+ACTIVE_CHOICES = {
+    "dentist": (Dentist, refdata.active_dentists),
+    "service": (Service, refdata.active_services),
+}
+
 
 class BaseTWForm(forms.ModelForm):
     """ฐานสำหรับใส่ class Tailwind ให้ทุก field"""
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         for f in self.fields.values():
-            f.widget.attrs.update({
-                "class": "w-full border px-3 py-2 rounded focus:ring-indigo-500 focus:border-indigo-500"
-            })
+            f.widget.attrs["class"] = TW_INPUT_CLASS
+
+    def limit_to_active(self):
+        """dentist/service เลือกได้เฉพาะที่เปิดใช้อยู่"""
+        for name, (model, load_rows) in ACTIVE_CHOICES.items():
+            field = self.fields.get(name)
+            if field is None:
+                continue
+            field.queryset = model.objects.filter(is_active=True).order_by("name")
+            field.widget.choices = ActiveChoiceIterator(field, load_rows)
+
+
+class VersionConflict(Exception):
+    """มีคนบันทึกแถวนี้ไปก่อน (version ไม่ตรง) ข้อความ error ถูกใส่ในฟอร์มแล้ว"""
+
+
+class VersionedForm(BaseTWForm):
+    """
+    optimistic locking: ฟอร์มถือ version ที่ผู้ใช้เห็นไว้ใน hidden field
+    ตอนบันทึกใช้ UPDATE ... WHERE version = ที่เห็น เขียนเฉพาะ field ที่แก้ แล้ว version + 1
+    ถ้าชนจะแสดงว่าค่าในระบบตอนนี้ต่างจากที่กรอกตรงไหน และฟอร์มที่ render ใหม่ถือ version ล่าสุด
+    (กดบันทึกซ้ำ = ยืนยันทับ)
+    """
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields["version"].initial = self.instance.version
+
+    def clean(self):
+        cleaned_data = super().clean()
+        version = cleaned_data.get("version")
+        # ตรวจก่อนเขียน (instance ยังเป็นค่าในฐานข้อมูล เพราะ clean() รันก่อน construct_instance)
+        if self.instance.pk and version is not None and version != self.instance.version:
+            raise self._conflict_error(self.instance)
+        return cleaned_data
+
+    def _conflict_error(self, current):
+        self.data = self.data.copy()
+        self.data[self.add_prefix("version")] = current.version
+        lines = []
+        for name, field in self.fields.items():
+            if name == "version" or name not in self.cleaned_data:
+                continue
+            yours = self.cleaned_data[name]
+            theirs = self._current_value(current, name)
+            if getattr(yours, "pk", yours) != getattr(theirs, "pk", theirs):
+                lines.append(f"{field.label}: ในระบบตอนนี้ = {theirs or '-'} / ที่คุณกรอก = {yours or '-'}")
+        return ValidationError(
+            ["ข้อมูลนี้ถูกแก้ไขโดยผู้อื่นหลังจากที่คุณเปิดฟอร์ม ตรวจสอบแล้วกดบันทึกอีกครั้งเพื่อยืนยัน"] + lines
+        )
+
+    def _current_value(self, current, name):
+        return getattr(current, name, None)
+
+    def _changed_model_fields(self):
+        opts = self.instance._meta
+        names = {f.name for f in opts.concrete_fields if f.editable}
+        changed = [opts.get_field(name) for name in self.changed_data if name in names]
+        # auto_now (updated_at) ต้องเขียนทุกครั้งที่มีการแก้
+        changed += [f for f in opts.concrete_fields if getattr(f, "auto_now", False) and f not in changed]
+        return changed
+
+    def save(self, commit=True):
+        if self.instance._state.adding or not commit:
+            return super().save(commit)
+        expected = self.cleaned_data.get("version") or self.instance.version
+        fields = self._changed_model_fields()
+        # แก้เฉพาะ field นอกโมเดล (เช่นข้อมูล one-to-one) ก็นับเป็นการแก้ไข: version + 1
+        if self.has_changed():
+            # pre_save ใส่ค่า auto_now และบันทึกไฟล์อัปโหลดลง storage
+            values = {f.attname: f.pre_save(self.instance, False) for f in fields}
+            model = type(self.instance)
+            if not model.objects.filter(pk=self.instance.pk, version=expected).update(
+                version=F("version") + 1, **values
+            ):
+                current = model.objects.filter(pk=self.instance.pk).first()
+                if current is None:
+                    self.add_error(None, "ไม่พบข้อมูลนี้แล้ว อาจถูกลบไปก่อน")
+                else:
+                    self.add_error(None, self._conflict_error(current))
+                raise VersionConflict()
+            self.instance.version = expected + 1
+            # UPDATE ตรงไม่ยิง post_save เอง แต่ cache ของนัด/ข้อมูลอ้างอิงรอ signal นี้อยู่
+            post_save.send(
+                sender=model, instance=self.instance, created=False,
+                update_fields=frozenset(f.name for f in fields), raw=False, using=self.instance._state.db,
+            )
+        self._save_m2m()
+        return self.instance
+
 
 class UserRegisterForm(UserCreationForm):
     class Meta:
@@ -17,12 +155,53 @@ class UserRegisterForm(UserCreationForm):
         fields = ["username", "email", "first_name", "last_name", "phone", "password1", "password2"]
 
    
-class PatientForm(BaseTWForm):
+def _clinical_field(name):
+    return PatientClinicalRecord._meta.get_field(name).formfield()
+
+
+class PatientBaseForm(VersionedForm):
+    """ฟอร์ม Patient ที่มีฟิลด์ของ PatientClinicalRecord ด้วย บันทึกทั้งสองตารางใน transaction เดียว"""
+    address = _clinical_field("address")
+    allergy = _clinical_field("allergy")
+    medical_history = _clinical_field("medical_history")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        record = getattr(self.instance, "clinical", None) if self.instance.pk else None
+        for name in self._clinical_names():
+            self.fields[name].initial = getattr(record, name, "")
+
+    def _clinical_names(self):
+        return [f.name for f in PatientClinicalRecord._meta.fields if f.name in self.fields]
+
+    def _current_value(self, current, name):
+        if name in self._clinical_names():
+            return getattr(getattr(current, "clinical", None), name, "")
+        return super()._current_value(current, name)
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        names = self._clinical_names()
+        if self.instance._state.adding or any(name in self.changed_data for name in names) or not hasattr(self.instance, "clinical"):
+            PatientClinicalRecord.objects.update_or_create(
+                patient=self.instance, defaults={name: self.cleaned_data[name] for name in names}
+            )
+
+    def save(self, commit=True):
+        with transaction.atomic():
+            return super().save(commit)
+
+
+class PatientForm(PatientBaseForm):
     class Meta:
         model = Patient
         fields = "__all__"
 
-class PatientProfileForm(BaseTWForm):
+class PatientProfileForm(PatientBaseForm):
+    # หน้าโปรไฟล์แก้ได้แค่ที่อยู่ ประวัติการรักษาแก้โดยคลินิก
+    allergy = None
+    medical_history = None
+
     class Meta:
         model = Patient
         fields = ["name", "gender", "phone", "email", "address", "photo", "date_of_birth"]
@@ -38,95 +217,54 @@ class ServiceForm(BaseTWForm):
         fields = "__all__"
 
 
-class AppointmentForm(BaseTWForm):
+class AppointmentForm(VersionedForm):
     class Meta:
         model = Appointment
         fields = "__all__"
-        widgets = {
-            "appointment_date": forms.DateInput(
-                attrs={
-                    "type": "date",   # ✅ HTML5 date picker
-                    "class": "w-full rounded-lg border-gray-300 focus:ring-indigo-500 focus:border-indigo-500",
-                }
-            ),
-            "start_time": forms.TimeInput(
-                attrs={
-                    "type": "time",   # ✅ HTML5 time picker
-                    "class": "w-full rounded-lg border-gray-300 focus:ring-indigo-500 focus:border-indigo-500",
-                }
-            ),
-            "end_time": forms.TimeInput(
-                attrs={
-                    "type": "time",   # ✅ HTML5 time picker
-                    "class": "w-full rounded-lg border-gray-300 focus:ring-indigo-500 focus:border-indigo-500",
-                }
-            ),
-            "notes": forms.Textarea(
-                attrs={
-                    "rows": 3,
-                    "class": "w-full rounded-lg border-gray-300 focus:ring-indigo-500 focus:border-indigo-500",
-                    "placeholder": "หมายเหตุเพิ่มเติม (ถ้ามี)...",
-                }
-            ),
-        }
+        widgets = APPOINTMENT_WIDGETS
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields["dentist"].queryset = Dentist.objects.filter(is_active=True).order_by("name")
-        self.fields["service"].queryset = Service.objects.filter(is_active=True).order_by("name")
-
+        self.limit_to_active()
+        # เปลี่ยนสถานะได้ตาม ALLOWED_TRANSITIONS เท่านั้น (เช่น cancelled -> completed ไม่ได้)
+        # สถานะที่ตรวจคือค่าในฐานข้อมูลตอนเปิดฟอร์ม ถ้ามีคนเปลี่ยนก่อน version จะไม่ตรงและบันทึกไม่ผ่าน
+        allowed = allowed_targets(self.instance.status if self.instance.pk else None)
+        field = self.fields["status"]
+        field.choices = [(value, label) for value, label in field.choices if value in allowed]
 
 
-
-from django import forms
-from django.core.exceptions import ValidationError
-from .models import Appointment, Dentist, Service
-
-class PatientAppointmentForm(BaseTWForm):
+class PatientAppointmentForm(VersionedForm):
     class Meta:
         model = Appointment
         exclude = ["patient", "created_by", "status", "created_at", "updated_at"] 
-        widgets = {
-            "appointment_date": forms.DateInput(
-                attrs={
-                    "type": "date",
-                    "class": "w-full rounded-lg border-gray-300 focus:ring-indigo-500 focus:border-indigo-500",
-                }
-            ),
-            "start_time": forms.TimeInput(
-                attrs={
-                    "type": "time",
-                    "class": "w-full rounded-lg border-gray-300 focus:ring-indigo-500 focus:border-indigo-500",
-                }
-            ),
-            "notes": forms.Textarea(
-                attrs={
-                    "rows": 3,
-                    "class": "w-full rounded-lg border-gray-300 focus:ring-indigo-500 focus:border-indigo-500",
-                    "placeholder": "หมายเหตุเพิ่มเติม (ถ้ามี)...",
-                }
-            ),
-        }
+        widgets = APPOINTMENT_WIDGETS
 
     def __init__(self, *args, **kwargs):
         self.patient = kwargs.pop("patient", None)  # 👈 ดึง patient จาก view
         super().__init__(*args, **kwargs)
-        self.fields["dentist"].queryset = Dentist.objects.filter(is_active=True).order_by("name")
-        self.fields["service"].queryset = Service.objects.filter(is_active=True).order_by("name")
+        self.limit_to_active()
+        if not self.instance.pk:
+            # จองใหม่ไม่เลือกทันตแพทย์ได้ ระบบเลือกคนที่ว่างและงานน้อยที่สุดให้ (ดู assignment.py)
+            self.fields["dentist"].required = False
+            self.fields["dentist"].empty_label = "ทันตแพทย์ท่านใดก็ได้ (ระบบเลือกให้)"
 
     def clean(self):    
         cleaned_data = super().clean()
         dentist = cleaned_data.get("dentist")
+        service = cleaned_data.get("service")
         appointment_date = cleaned_data.get("appointment_date")
         start_time = cleaned_data.get("start_time")
 
-        # 1. หมอว่างมั้ย
+        # 1. หมอว่างมั้ย (ไม่เลือกหมอ = มีใครว่างบ้าง ส่วนการเลือกจริงทำตอนบันทึก)
+        if not dentist and service and appointment_date and start_time:
+            if not free_dentists(service, appointment_date, start_time, cleaned_data.get("end_time")).exists():
+                raise ValidationError("ไม่มีทันตแพทย์ว่างในเวลานี้ กรุณาเลือกเวลาอื่น")
         if dentist and appointment_date and start_time:
             if Appointment.objects.filter(
                 dentist=dentist,
                 appointment_date=appointment_date,
                 start_time=start_time
-            ).exists():
+            ).exclude(status="cancelled").exclude(pk=self.instance.pk).exists():
                 raise ValidationError("ทันตแพทย์ท่านนี้มีนัดในเวลานี้แล้ว กรุณาเลือกเวลาอื่น")
 
         # 2. คนไข้ซ้ำมั้ย
@@ -135,13 +273,68 @@ class PatientAppointmentForm(BaseTWForm):
                 patient=self.patient,
                 appointment_date=appointment_date,
                 start_time=start_time
-            ).exists():
+            ).exclude(status="cancelled").exclude(pk=self.instance.pk).exists():
                 raise ValidationError("คุณมีนัดในเวลานี้อยู่แล้ว กรุณาเลือกเวลาอื่น")
 
         return cleaned_data
 
 
+class AppointmentSeriesForm(BaseTWForm):
+    """จองนัดเป็นชุด: นัดแรก + กฎการเกิดซ้ำ (ทุกกี่วัน/สัปดาห์/เดือน, จำนวนครั้งหรือถึงวันที่)"""
+    frequency = forms.ChoiceField(label="ความถี่", choices=FREQUENCY_CHOICES, initial="weekly")
+    interval = forms.IntegerField(label="ทุก ๆ (รอบ)", min_value=1, max_value=12, initial=1)
+    count = forms.IntegerField(label="จำนวนครั้ง", min_value=1, max_value=MAX_OCCURRENCES, required=False)
+    until = forms.DateField(label="ถึงวันที่", required=False, widget=DATE_INPUT)
 
+    class Meta:
+        model = Appointment
+        fields = ["patient", "dentist", "service", "appointment_date", "start_time", "end_time", "notes"]
+        widgets = APPOINTMENT_WIDGETS
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limit_to_active()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get("count") and not cleaned_data.get("until"):
+            raise ValidationError("กรุณาระบุจำนวนครั้งหรือวันที่สิ้นสุด")
+        first_date, frequency = cleaned_data.get("appointment_date"), cleaned_data.get("frequency")
+        if first_date and frequency and cleaned_data.get("interval") and not cleaned_data.get("count"):
+            dates = occurrences(
+                first_date, frequency, cleaned_data["interval"], until=cleaned_data["until"],
+                limit=MAX_OCCURRENCES + 1,
+            )
+            if len(dates) > MAX_OCCURRENCES:
+                raise ValidationError(
+                    f"ช่วงวันที่นี้มีนัดเกิน {MAX_OCCURRENCES} ครั้ง กรุณาเลื่อนวันที่สิ้นสุดหรือเพิ่มระยะห่าง"
+                )
+        return cleaned_data
+
+    def validate_unique(self):
+        # การชนของแต่ละวันตรวจรวมทีเดียวใน book_series
+        pass
+
+
+class WaitlistEntryForm(BaseTWForm):
+    """ลงชื่อรอคิวว่าง (ไม่เลือกทันตแพทย์ = ท่านใดก็ได้)"""
+    class Meta:
+        model = WaitlistEntry
+        fields = ["service", "dentist", "earliest_date", "latest_date"]
+        widgets = {
+            "earliest_date": DATE_INPUT,
+            "latest_date": DATE_INPUT,
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limit_to_active()
+        self.fields["dentist"].empty_label = "ทันตแพทย์ท่านใดก็ได้"
 
+    def clean(self):
+        cleaned_data = super().clean()
+        earliest, latest = cleaned_data.get("earliest_date"), cleaned_data.get("latest_date")
+        if earliest and latest and earliest > latest:
+            raise ValidationError("วันที่เริ่มต้องไม่เกินวันที่สิ้นสุด")
+        return cleaned_data
 
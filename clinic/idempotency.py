@@ -0,0 +1,165 @@
+# clinic/idempotency.py
+"""
+Idempotency-Key สำหรับ POST ที่เขียนข้อมูล (กดซ้ำ / เบราว์เซอร์ส่งซ้ำตอนเน็ตหลุด)
+
+ผู้ส่งแนบ key มากับคำขอ ทาง header Idempotency-Key หรือ hidden field จาก {% idempotency_field %}
+คำขอแรกของ key จะจองแถว IdempotencyKey ก่อนเรียก view แล้วเก็บ response ไว้ CLINIC_IDEMPOTENCY_TTL วินาที
+คำขอซ้ำได้ response เดิมกลับไปโดยไม่เรียก view (ไม่แตะตารางนัดหมาย)
+ถ้าคำขอแรกยังไม่เสร็จ รอได้ไม่เกิน CLINIC_IDEMPOTENCY_WAIT วินาที แล้วตอบ 409
+key เดิมแต่ข้อมูลต่างกันตอบ 422 คำขอที่ไม่มี key ทำงานแบบเดิม
+
+การจองใช้ INSERT ที่ชน unique constraint ของ slot ในฐานข้อมูล จึงมีคำขอเดียวที่ได้ทำงาน
+แม้คำขอจะมาพร้อมกันจากคนละ process/host (cache ของโปรเจกต์เป็น FileBasedCache ซึ่ง add() ไม่ atomic)
+แถวที่หมดอายุถูกลบโดยงานประจำ purge_idempotency_keys
+"""
+import hashlib
+import re
+import time
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from . import metrics
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+FIELD = "idempotency_key"
+IGNORED_FIELDS = (FIELD, "csrfmiddlewaretoken")
+REPLAYED_HEADER = "Idempotent-Replayed"
+REPLAYED_HEADERS = ("Content-Type", "Location")
+MAX_CONTENT = 256 * 1024
+# รอคำขอแรก: เริ่มที่ 50 ms แล้วเพิ่มเท่าตัว ไม่เกิน 500 ms ต่อรอบ
+FIRST_BACKOFF = 0.05
+MAX_BACKOFF = 0.5
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9_.:-]{8,100}$")
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def _slot(request, key):
+    user = request.user.pk if request.user.is_authenticated else request.session.session_key
+    raw = f"{user}:{request.path}:{key}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _fingerprint(request):
+    """key เดียวกันต้องมาพร้อมข้อมูลเดิม (ไม่นับ token ที่เปลี่ยนทุกครั้งที่ render)"""
+    if request.content_type in ("application/x-www-form-urlencoded", "multipart/form-data"):
+        items = sorted((name, request.POST.getlist(name)) for name in request.POST if name not in IGNORED_FIELDS)
+        payload = repr(items).encode()
+    else:
+        payload = request.body
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _store(slot, response):
+    IdempotencyKey.objects.filter(slot=slot).update(
+        status=response.status_code,
+        content=response.content,
+        headers={name: response[name] for name in REPLAYED_HEADERS if name in response},
+    )
+
+
+def _replay(stored):
+    response = HttpResponse(bytes(stored.content), status=stored.status)
+    for name, value in stored.headers.items():
+        response[name] = value
+    response[REPLAYED_HEADER] = "true"
+    return response
+
+
+def _reserve(slot, fingerprint, ttl):
+    """
+    จอง slot คืนค่า (True, None) ถ้าได้จอง ไม่งั้น (False, แถวของคำขอก่อนหน้า หรือ None ถ้าเพิ่งถูกลบ)
+    แถวที่เก่ากว่า ttl ถือว่าไม่มี ลบแล้วจองใหม่
+    """
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(slot=slot, fingerprint=fingerprint)
+        return True, None
+    except IntegrityError:
+        pass
+    existing = IdempotencyKey.objects.filter(slot=slot).first()
+    if existing is not None and existing.created_at < timezone.now() - timedelta(seconds=ttl):
+        IdempotencyKey.objects.filter(pk=existing.pk, created_at=existing.created_at).delete()
+        return _reserve(slot, fingerprint, ttl)
+    return False, existing
+
+
+def _storable(response):
+    return (
+        response.status_code < 500
+        and not response.streaming
+        and len(response.content) <= MAX_CONTENT
+    )
+
+
+def idempotent(view_func):
+    """view decorator (ใส่ใต้ login_required): POST ที่มี key ทำงานครั้งเดียวต่อผู้ใช้ ต่อ URL ต่อ key"""
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.method != "POST":
+            return view_func(request, *args, **kwargs)
+        key = request.headers.get(HEADER) or request.POST.get(FIELD)
+        if not key:
+            return view_func(request, *args, **kwargs)
+        if not _KEY_RE.match(key):
+            return JsonResponse({"success": False, "error": "Invalid Idempotency-Key"}, status=400)
+
+        ttl = getattr(settings, "CLINIC_IDEMPOTENCY_TTL", 600)
+        wait = getattr(settings, "CLINIC_IDEMPOTENCY_WAIT", 5)
+        view = request.resolver_match.view_name if request.resolver_match else request.path
+        slot = _slot(request, key)
+        fingerprint = _fingerprint(request)
+        deadline = time.monotonic() + wait
+        backoff = FIRST_BACKOFF
+
+        while True:
+            reserved, stored = _reserve(slot, fingerprint, ttl)
+            if reserved:
+                break
+            if stored is not None and stored.fingerprint != fingerprint:
+                metrics.idempotency(view, "mismatch")
+                return JsonResponse(
+                    {"success": False, "error": "Idempotency-Key was already used with different data"},
+                    status=422,
+                )
+            if stored is not None and stored.status is not None:
+                metrics.idempotency(view, "replayed")
+                return _replay(stored)
+            if time.monotonic() + backoff > deadline:
+                metrics.idempotency(view, "in_progress")
+                response = JsonResponse({"success": False, "error": "Request is still being processed"}, status=409)
+                response["Retry-After"] = "1"
+                return response
+            # คำขอแรกยังทำอยู่ (หรือเพิ่งล้มเหลวแล้วลบแถวไป รอบหน้าจะจองได้เอง)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except BaseException:
+            IdempotencyKey.objects.filter(slot=slot).delete()
+            raise
+        if _storable(response):
+            _store(slot, response)
+        else:
+            # ผิดพลาดฝั่ง server: ปล่อยให้ส่งซ้ำด้วย key เดิมได้
+            IdempotencyKey.objects.filter(slot=slot).delete()
+        return response
+    return _wrapped_view
+
+
+def purge_expired():
+    """ลบแถวที่หมดอายุแล้ว คืนจำนวนแถว"""
+    ttl = getattr(settings, "CLINIC_IDEMPOTENCY_TTL", 600)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+    return deleted
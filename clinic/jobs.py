@@ -0,0 +1,63 @@
+# clinic/jobs.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .dedupe import find_duplicates
+from .idempotency import purge_expired
+from .partitions import ensure_partitions, is_partitioned
+from .reminders import send_appointment_reminders
+from .scheduler import periodic_job
+from .status import mark_past_due_no_show
+from .waitlist import expire_offers, offer_freed_slots, take_queued
+
+
+@periodic_job("mark_no_shows", every=timedelta(minutes=15))
+def mark_no_shows():
+    """นัดที่เลยเวลาเริ่มเกินช่วงผ่อนผันแล้วยังไม่ปิด -> no_show"""
+    grace = getattr(settings, "CLINIC_NO_SHOW_GRACE_MINUTES", 60)
+    cutoff = timezone.localtime() - timedelta(minutes=grace)
+    return mark_past_due_no_show(cutoff, batch_size=getattr(settings, "CLINIC_JOB_BATCH_SIZE", 500))
+
+
+@periodic_job("send_reminders", every=timedelta(hours=1))
+def send_reminders():
+    """อีเมลเตือนนัดวันพรุ่งนี้ (นัดที่ส่งแล้วจะถูกข้าม)"""
+    return send_appointment_reminders()
+
+
+@periodic_job("waitlist_backfill", every=timedelta(minutes=1))
+def waitlist_backfill():
+    """
+    ปิดข้อเสนอที่หมดเวลา แล้วเสนอช่องเหล่านั้นกับช่องในคิว FreedSlot (ยกเลิก/ปฏิเสธ) ให้คนใน waitlist
+    """
+    expired = expire_offers()
+    slots = set(expired) | set(take_queued())
+    return {"expired": len(expired), "offered": offer_freed_slots(pk__in=slots) if slots else 0}
+
+
+@periodic_job("waitlist_sweep", every=timedelta(hours=1))
+def waitlist_sweep():
+    """ตรวจทุกช่องว่างที่ยังไม่ถึงเวลาอีกรอบ (ช่องที่ยังไม่มีคนรอ หรือยกเลิกจากทางอื่นที่ไม่ได้เข้าคิว)"""
+    return offer_freed_slots()
+
+
+@periodic_job("appointment_partitions", every=timedelta(days=1))
+def appointment_partitions():
+    """เตรียม partition ของนัดหมายล่วงหน้า (การ archive ของเก่าสั่งเองผ่าน appointment_partitions)"""
+    if not is_partitioned():
+        return []
+    return ensure_partitions(ahead=getattr(settings, "CLINIC_PARTITION_MONTHS_AHEAD", 3))
+
+
+@periodic_job("purge_idempotency_keys", every=timedelta(hours=1))
+def purge_idempotency_keys():
+    """ลบผลของ Idempotency-Key ที่หมดอายุ (CLINIC_IDEMPOTENCY_TTL)"""
+    return purge_expired()
+
+
+@periodic_job("find_duplicate_patients", every=timedelta(days=1))
+def find_duplicate_patients():
+    """หาคู่ผู้ป่วยที่น่าจะซ้ำ ให้เจ้าหน้าที่ตรวจและรวมใน admin (Duplicate candidates)"""
+    return find_duplicates()
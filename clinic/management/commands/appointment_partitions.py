@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from clinic.partitions import add_months, archive_before, ensure_partitions, is_partitioned, month_start
+
+
+class Command(BaseCommand):
+    help = "สร้าง partition รายเดือนล่วงหน้าของนัดหมาย และย้าย partition เก่าเข้าตาราง archive (PostgreSQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=3, help="สร้าง partition ล่วงหน้ากี่เดือน")
+        parser.add_argument(
+            "--archive-before", type=int, metavar="MONTHS",
+            help="archive partition ที่เก่ากว่าเดือนปัจจุบันตั้งแต่ MONTHS เดือนขึ้นไป",
+        )
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("clinic_appointment is not a partitioned PostgreSQL table.")
+
+        for name in ensure_partitions(ahead=options["ahead"]):
+            self.stdout.write(f"Created {name}")
+
+        months = options["archive_before"]
+        if months is not None:
+            if months < 1:
+                raise CommandError("--archive-before must be at least 1.")
+            cutoff = add_months(month_start(timezone.localdate()), -months)
+            for name, rows in archive_before(cutoff).items():
+                self.stdout.write(f"Archived {name} ({rows} rows)")
+        self.stdout.write(self.style.SUCCESS("Done."))
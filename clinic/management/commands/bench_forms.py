@@ -0,0 +1,36 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from clinic.forms import AppointmentForm
+
+
+class Command(BaseCommand):
+    help = "วัดเวลาสร้าง AppointmentForm และ render appointment_form.html"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", "--iterations", type=int, default=500)
+
+    def _measure(self, label, func, iterations):
+        func()  # warm-up (โหลด template / query ครั้งแรก)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        per_call = (time.perf_counter() - start) / iterations * 1e6
+        self.stdout.write(f"{label:<32} {per_call:10.1f} µs/op")
+
+    def handle(self, *args, **options):
+        n = options["iterations"]
+        request = RequestFactory().get("/appointments/add/")
+        request.user = AnonymousUser()
+
+        self.stdout.write(f"{n} iterations")
+        self._measure("construct AppointmentForm", AppointmentForm, n)
+        self._measure(
+            "render appointment_form.html",
+            lambda: render_to_string("dental_clinic/appointment_form.html", {"form": AppointmentForm()}, request),
+            n,
+        )
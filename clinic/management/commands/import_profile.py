@@ -0,0 +1,55 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# import time:       self [us] |  cumulative | imported package
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+STARTUP_CODE = (
+    "import django; django.setup(); "
+    "from django.core.wsgi import get_wsgi_application; get_wsgi_application(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+
+
+class Command(BaseCommand):
+    help = "วัดเวลา import ตอนเริ่ม process (python -X importtime) แล้วสรุป module ที่ช้าที่สุด"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=25, help="จำนวน module ที่แสดง")
+        parser.add_argument("--sort", choices=("cumulative", "self"), default="cumulative")
+        parser.add_argument("--package", help="แสดงเฉพาะ module ที่ขึ้นต้นด้วยชื่อนี้ เช่น clinic")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE)}
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+            capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+        )
+        if result.returncode:
+            raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+
+        rows = []
+        for line in result.stderr.splitlines():
+            match = LINE_RE.match(line)
+            if match:
+                self_us, cumulative_us, indent, module = match.groups()
+                rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+
+        # module ระดับบนสุด (ไม่ได้ถูก import ซ้อน) รวมกันเป็นเวลาทั้งหมด
+        total_us = sum(cumulative for _, _, cumulative, depth in rows if depth == 0)
+        if options["package"]:
+            prefix = options["package"]
+            rows = [row for row in rows if row[0] == prefix or row[0].startswith(prefix + ".")]
+
+        key = 2 if options["sort"] == "cumulative" else 1
+        rows.sort(key=lambda row: row[key], reverse=True)
+
+        self.stdout.write(f"{'module':<60} {'self ms':>9} {'cumul. ms':>10}")
+        for module, self_us, cumulative_us, _ in rows[:options["top"]]:
+            self.stdout.write(f"{module:<60} {self_us / 1000:9.1f} {cumulative_us / 1000:10.1f}")
+        self.stdout.write(f"Total import time: {total_us / 1000:.1f} ms ({len(rows)} modules listed)")
@@ -0,0 +1,232 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from datetime import time as dtime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from clinic.models import Appointment, Dentist, Patient, Service, User
+
+PASSWORD = "load-test-password"
+
+
+def is_scratch_database():
+    """
+    สร้างข้อมูลทดสอบได้เฉพาะเครื่องพัฒนา (DEBUG) ฐานข้อมูลทดสอบ (test_... หรือ SQLite ในหน่วยความจำ) หรือที่ระบุใน CLINIC_SCRATCH_DATABASES
+    ทั้งสองโหมดเขียนลง DATABASES["default"] (โหมด --url server ต้องใช้ฐานข้อมูลเดียวกัน)
+    """
+    connection = connections["default"]
+    name = str(connection.settings_dict["NAME"])
+    return (
+        settings.DEBUG
+        or name.startswith("test_")
+        or (connection.vendor == "sqlite" and connection.is_in_memory_db())
+        or name in getattr(settings, "CLINIC_SCRATCH_DATABASES", ())
+    )
+
+
+class ClientSession:
+    """คำขอผ่าน django.test.Client ใน process นี้ (ไม่ต้องเปิด server)"""
+
+    def __init__(self, user, base_url=None):
+        self.client = Client(raise_request_exception=False)
+        self.client.force_login(user)
+
+    def book(self, path, data):
+        response = self.client.post(path, data)
+        return response.status_code, response.content.decode(errors="replace")
+
+
+class HttpSession:
+    """คำขอผ่าน HTTP ไปยัง server ที่รันอยู่ (เช่น gunicorn ที่ตั้งค่าเหมือน production)"""
+
+    def __init__(self, user, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        login_url = self.base_url + reverse("login")
+        self.session.get(login_url)
+        self.session.post(
+            login_url,
+            data={"username": user.username, "password": PASSWORD,
+                  "csrfmiddlewaretoken": self.session.cookies.get("csrftoken", "")},
+            headers={"Referer": login_url},
+        )
+
+    def book(self, path, data):
+        url = self.base_url + path
+        response = self.session.post(
+            url,
+            data={**data, "csrfmiddlewaretoken": self.session.cookies.get("csrftoken", "")},
+            headers={"Referer": url},
+            allow_redirects=False,
+        )
+        return response.status_code, response.text
+
+
+class Command(BaseCommand):
+    help = (
+        "จำลองคนไข้ N คนแย่งจองช่องเวลาเดียวกันผ่าน patient_appointments "
+        "แล้วสรุป throughput, p95, อัตราชน และการจองซ้อนที่หลุดเข้าฐานข้อมูล"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=20, help="จำนวนคนไข้ (thread) ที่แย่งกัน")
+        parser.add_argument("--slots", type=int, default=5, help="จำนวนช่องเวลาที่ทุกคนพยายามจอง")
+        parser.add_argument("--url", help="ยิงไปที่ server นี้แทน test client เช่น http://127.0.0.1:8000")
+        parser.add_argument("--seed", type=int, help="random seed ของลำดับช่องเวลา")
+        parser.add_argument("--keep", action="store_true", help="ไม่ลบข้อมูลทดสอบหลังจบ")
+        parser.add_argument(
+            "--any-dentist", type=int, default=0, metavar="N",
+            help="สร้างทันตแพทย์ N คนแล้วจองแบบไม่เลือกทันตแพทย์ (ระบบเลือกคนที่งานน้อยที่สุด)",
+        )
+
+    def handle(self, *args, **options):
+        if options["patients"] < 2 or options["slots"] < 1:
+            raise CommandError("Need at least 2 patients and 1 slot.")
+        if not is_scratch_database():
+            raise CommandError(
+                f"Refusing to create load-test data in database {connections['default'].settings_dict['NAME']!r}. "
+                "Run with DEBUG, against a test_ database, or list it in CLINIC_SCRATCH_DATABASES."
+            )
+        rng = random.Random(options["seed"])
+        tag = f"loadtest-{uuid.uuid4().hex[:8]}"
+
+        if not options["url"]:
+            setup_test_environment()
+        try:
+            fixture = self._create_fixture(tag, options["patients"], options["slots"], options["any_dentist"])
+            try:
+                results, elapsed = self._race(fixture, options["url"], rng)
+                self._report(fixture, results, elapsed)
+            finally:
+                if not options["keep"]:
+                    self._cleanup(fixture)
+        finally:
+            if not options["url"]:
+                teardown_test_environment()
+
+    def _create_fixture(self, tag, patients, slots, any_dentist=0):
+        dentists = [
+            Dentist.objects.create(
+                name=f"{tag}-{i}" if i else tag, specialization="load test", phone="0800000000",
+                email=f"{tag}-{i}@example.invalid", license_number=f"{tag}-{i}" if i else tag,
+            )
+            for i in range(max(any_dentist, 1))
+        ]
+        service = Service.objects.create(name=tag, price=0, duration_minutes=30)
+        users = []
+        for i in range(patients):
+            email = f"{tag}-{i}@example.invalid"
+            user = User.objects.create_user(f"{tag}-{i}", email, PASSWORD, role="patient")
+            Patient.objects.create(
+                name=f"{tag}-{i}", gender="M", date_of_birth=timezone.localdate() - timedelta(days=365 * 30),
+                phone="0800000000", email=email,
+            )
+            users.append(user)
+        # วันในอนาคตไกล ๆ ไม่ชนกับนัดจริง
+        day = timezone.localdate() + timedelta(days=400)
+        times = [dtime(8 + i // 2, 30 * (i % 2)) for i in range(slots)]
+        return {
+            "tag": tag, "dentists": dentists, "any_dentist": bool(any_dentist),
+            "service": service, "users": users, "day": day, "times": times,
+        }
+
+    def _race(self, fixture, base_url, rng):
+        session_class = HttpSession if base_url else ClientSession
+        sessions = [session_class(user, base_url) for user in fixture["users"]]
+        path = reverse("appointments_patient")
+        orders = [rng.sample(fixture["times"], len(fixture["times"])) for _ in sessions]
+        barrier = threading.Barrier(len(sessions))
+        results = []
+        lock = threading.Lock()
+
+        def worker(session, order):
+            try:
+                barrier.wait()  # ปล่อยทุก thread พร้อมกัน
+                for start in order:
+                    data = {
+                        "dentist": "" if fixture["any_dentist"] else fixture["dentists"][0].pk,
+                        "service": fixture["service"].pk,
+                        "appointment_date": fixture["day"].isoformat(),
+                        "start_time": start.strftime("%H:%M"),
+                        "notes": "",
+                    }
+                    began = time.perf_counter()
+                    try:
+                        status, body = session.book(path, data)
+                        outcome = "success" if status == 302 else "conflict" if status == 200 else "error"
+                    except Exception as exc:  # noqa: BLE001 นับเป็น error แล้วไปต่อ
+                        status, outcome = type(exc).__name__, "error"
+                    with lock:
+                        results.append((outcome, status, time.perf_counter() - began))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=pair) for pair in zip(sessions, orders)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def _report(self, fixture, results, elapsed):
+        latencies = sorted(latency for _, _, latency in results)
+        outcomes = {name: sum(1 for outcome, _, _ in results if outcome == name) for name in ("success", "conflict", "error")}
+        error_statuses = sorted({str(status) for outcome, status, _ in results if outcome == "error"})
+
+        booked = Appointment.objects.filter(dentist__in=fixture["dentists"]).exclude(status="cancelled")
+        double_booked = (
+            booked.values("dentist_id", "appointment_date", "start_time").annotate(n=Count("id")).filter(n__gt=1).count()
+        )
+        rows = booked.count()
+        capacity = len(fixture["times"]) * len(fixture["dentists"])
+        violations = []
+        if double_booked:
+            violations.append(f"{double_booked} slot(s) booked more than once")
+        if rows != outcomes["success"]:
+            violations.append(f"{rows} rows stored but {outcomes['success']} successful responses")
+        if rows > capacity:
+            violations.append(f"{rows} rows for {capacity} dentist slots")
+
+        total = len(results)
+        p95 = latencies[min(int(total * 0.95), total - 1)] if total else 0
+        self.stdout.write(
+            f"requests     {total} from {len(fixture['users'])} patients over {len(fixture['times'])} slots"
+            f" x {len(fixture['dentists'])} dentist(s)"
+        )
+        self.stdout.write(f"elapsed      {elapsed:.2f} s ({total / elapsed:.1f} req/s)" if elapsed else "elapsed      0 s")
+        if total:
+            self.stdout.write(f"latency      p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+        self.stdout.write(f"success      {outcomes['success']}")
+        self.stdout.write(f"conflict     {outcomes['conflict']} ({outcomes['conflict'] / total:.1%})" if total else "conflict     0")
+        self.stdout.write(f"error        {outcomes['error']} {', '.join(error_statuses)}".rstrip())
+        if fixture["any_dentist"]:
+            loads = booked.values("dentist_id").annotate(n=Count("id")).order_by("dentist_id")
+            self.stdout.write(f"per dentist  {', '.join(str(row['n']) for row in loads)}")
+        if violations:
+            for violation in violations:
+                self.stdout.write(self.style.ERROR(f"VIOLATION    {violation}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("invariants   OK (at most one active booking per slot)"))
+
+    def _cleanup(self, fixture):
+        tag = fixture["tag"]
+        # ประวัติ AppointmentEvent เพิ่มอย่างเดียว ไม่ลบตามนัด (ดูได้ว่านัดทดสอบถูกสร้าง/ลบเมื่อไร)
+        Appointment.objects.filter(dentist__in=fixture["dentists"]).delete()
+        Patient.objects.filter(name__startswith=f"{tag}-").delete()
+        User.objects.filter(username__startswith=f"{tag}-").delete()
+        for dentist in fixture["dentists"]:
+            dentist.delete()
+        fixture["service"].delete()
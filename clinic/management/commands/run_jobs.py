@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.scheduler import discover_jobs, leader_lock, run_due_jobs
+
+
+class Command(BaseCommand):
+    help = "รันงานประจำของคลินิก (มีเพียง host เดียวที่ได้เป็น leader ผ่าน advisory lock)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="รันทุกงานหนึ่งรอบแล้วจบ")
+        parser.add_argument("--job", action="append", dest="jobs", help="รันเฉพาะงานนี้ (ระบุซ้ำได้)")
+        parser.add_argument("--tick", type=float, default=30, help="ช่วงตรวจงานที่ถึงรอบ (วินาที)")
+
+    def handle(self, *args, **options):
+        jobs = discover_jobs()
+        names = options["jobs"]
+        unknown = set(names or []) - set(jobs)
+        if unknown:
+            raise CommandError(f"Unknown job(s): {', '.join(sorted(unknown))}")
+
+        while True:
+            with leader_lock() as leadership:
+                if leadership and self._lead(leadership, names, options):
+                    return
+            if options["once"]:
+                self.stdout.write("Another host holds the scheduler lock; skipping.")
+                return
+            # standby: รอแล้วลองชิง lock ใหม่
+            time.sleep(options["tick"])
+
+    def _lead(self, leadership, names, options):
+        """รันงานขณะเป็น leader คืนค่า False ถ้าเสีย lock ระหว่างทาง (กลับไป standby)"""
+        if options["once"]:
+            self._report(run_due_jobs(names, force=True, still_leader=leadership.still_leader))
+            return True
+        self.stdout.write("Acquired scheduler lock; running periodic jobs.")
+        while True:
+            self._report(run_due_jobs(names, still_leader=leadership.still_leader))
+            if not leadership.still_leader():
+                self.stdout.write("Lost scheduler lock; standing by.")
+                return False
+            time.sleep(options["tick"])
+
+    def _report(self, results):
+        for name, result in results.items():
+            self.stdout.write(f"{name}: {result}")
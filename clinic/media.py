@@ -0,0 +1,130 @@
+# clinic/media.py
+"""
+ไฟล์อัปโหลด (MEDIA_ROOT) ผ่าน view ที่ตรวจสิทธิ์: ผู้ดูแล หรือผู้ป่วยเจ้าของรูป
+
+ตรวจสิทธิ์ใน Django แล้วให้ front server ส่งไฟล์เอง worker จึงไม่ต้องส่งข้อมูลรูปทีละ chunk
+    CLINIC_MEDIA_SENDFILE = "nginx"   -> X-Accel-Redirect: CLINIC_MEDIA_ACCEL_PREFIX + path
+        location /protected-media/ { internal; alias /srv/clinic/media/; }
+    CLINIC_MEDIA_SENDFILE = "apache"  -> X-Sendfile: path เต็มบนดิสก์ (mod_xsendfile / lighttpd)
+    CLINIC_MEDIA_SENDFILE = ""        -> Django ส่งเอง (รองรับ Range ช่วงเดียว) ใช้ตอนพัฒนา
+ห้ามให้ front server เสิร์ฟ /media/ ตรง ๆ ไม่งั้นข้ามการตรวจสิทธิ์
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .models import Patient
+
+CHUNK_SIZE = 64 * 1024
+CACHE_CONTROL = "private, max-age=3600"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def can_view(user, name):
+    """ผู้ดูแลเห็นทุกไฟล์ ผู้ป่วยเห็นเฉพาะรูปของตัวเอง"""
+    if not user.is_authenticated:
+        return False
+    if user.role == "admin" or user.is_staff:
+        return True
+    return bool(user.email) and Patient.objects.filter(email=user.email, photo=name).exists()
+
+
+def byte_range(header, size):
+    """
+    Range: bytes=a-b / a- / -n -> (start, end) รวมปลาย
+    None = ไม่ได้ขอเป็นช่วงหรือขอหลายช่วง (ส่งทั้งไฟล์), ValueError = ช่วงอยู่นอกไฟล์ (416)
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _read(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _offloaded(name, path, content_type):
+    mode = getattr(settings, "CLINIC_MEDIA_SENDFILE", "")
+    if mode == "nginx":
+        prefix = getattr(settings, "CLINIC_MEDIA_ACCEL_PREFIX", "/protected-media/")
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = prefix + quote(name)
+        return response
+    if mode == "apache":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+        return response
+    return None
+
+
+def serve(request, name):
+    """response ของไฟล์ name (ตรวจสิทธิ์แล้ว) ไฟล์ไม่มีหรือ path ออกนอก MEDIA_ROOT -> 404"""
+    try:
+        path = default_storage.path(name)
+    except SuspiciousFileOperation:
+        raise Http404("Not found")
+    if not os.path.isfile(path):
+        raise Http404("Not found")
+
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    response = _offloaded(name, path, content_type)
+    if response is None:
+        response = _from_disk(request, path, content_type)
+    response["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def _from_disk(request, path, content_type):
+    stat = os.stat(path)
+    last_modified = http_date(stat.st_mtime)
+    if not was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    requested = request.headers.get("Range", "")
+    # If-Range ไม่ตรง = ไฟล์เปลี่ยนไปแล้ว ส่งทั้งไฟล์ใหม่
+    if requested and request.headers.get("If-Range", last_modified) != last_modified:
+        requested = ""
+    try:
+        span = byte_range(requested, stat.st_size) if requested else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+        return response
+
+    if span is None:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    else:
+        start, end = span
+        response = StreamingHttpResponse(_read(path, start, end - start + 1), status=206, content_type=content_type)
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    response["Accept-Ranges"] = "bytes"
+    response["Last-Modified"] = last_modified
+    return response
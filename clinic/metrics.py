@@ -0,0 +1,112 @@
+# clinic/metrics.py
+"""
+metric แบบ Prometheus ที่รวมค่าจากทุก worker
+
+ตั้ง env PROMETHEUS_MULTIPROC_DIR เป็นโฟลเดอร์ว่างที่ทุก worker เขียนได้ ก่อนเริ่ม process
+แต่ละ process จะเขียนค่าลงไฟล์ mmap ของตัวเอง แล้ว /metrics/ รวมทุกไฟล์ตอนถูกอ่าน
+(ล้างโฟลเดอร์ทุกครั้งที่ deploy และใน gunicorn.conf.py ให้แจ้งเมื่อ worker จบ)
+    from prometheus_client import multiprocess
+    def child_exit(server, worker):
+        multiprocess.mark_process_dead(worker.pid)
+ถ้าไม่ตั้ง env จะใช้ registry ของ process เดียว (เช่นตอน runserver)
+"""
+import os
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from . import slowlog
+
+REQUESTS = Counter(
+    "clinic_http_requests_total", "HTTP requests by view", ["view", "method", "status"],
+)
+# method มาจาก client ได้ทุกค่า จึงจำกัดเป็นชุดคงที่ ไม่ให้จำนวน label โตไม่สิ้นสุด
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+LATENCY = Histogram(
+    "clinic_http_request_duration_seconds", "Request latency by view", ["view"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+# นับ query ของ view และ middleware ที่อยู่ด้านใน (รวม INSERT ของ audit ที่คำขอนั้นสร้าง)
+# ยกเว้นการเขียน log ของ slowlog ซึ่งเป็นงานของระบบวัดผลเอง
+DB_QUERIES = Histogram(
+    "clinic_http_db_queries", "Database queries per request by view (excluding slow query logging)", ["view"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+BOOKINGS = Counter(
+    "clinic_bookings_total", "Booking attempts by source and outcome (success/conflict)", ["source", "outcome"],
+)
+OTP_SENT = Counter("clinic_otp_sent_total", "Password reset OTP emails sent")
+IDEMPOTENCY = Counter(
+    "clinic_idempotency_total", "Repeated Idempotency-Key requests by view and result", ["view", "result"],
+)
+
+
+def booking(source, outcome, amount=1):
+    if amount:
+        BOOKINGS.labels(source, outcome).inc(amount)
+
+
+def idempotency(view, result):
+    IDEMPOTENCY.labels(view, result).inc()
+
+
+class EmailQueueCollector:
+    """อ่านจากฐานข้อมูลตอน scrape จึงได้ค่าเดียวกันไม่ว่า worker ไหนตอบ"""
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        from .reminders import pending_reminders
+
+        gauge = GaugeMetricFamily("clinic_email_queue_depth", "Reminder emails due tomorrow and not sent yet")
+        gauge.add_metric([], pending_reminders().count())
+        yield gauge
+
+
+def render():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    queue = CollectorRegistry()
+    queue.register(EmailQueueCollector())
+    return generate_latest(registry) + generate_latest(queue)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not slowlog.is_writing():
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """นับคำขอ เวลา และจำนวน query ต่อ view (ใช้ชื่อ URL เป็น label)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = _QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        method = request.method if request.method in METHODS else "other"
+        REQUESTS.labels(view, method, response.status_code).inc()
+        LATENCY.labels(view).observe(elapsed)
+        DB_QUERIES.labels(view).observe(queries.count)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0007_alter_patient_date_of_birth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reminder_sent_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0008_appointment_reminder_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['appointment_date', 'status'], name='appt_date_status_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0009_appointment_date_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('created', 'Created'), ('status', 'Status changed'), ('edited', 'Edited'), ('deleted', 'Deleted')], max_length=10)),
+                ('old_status', models.CharField(blank=True, max_length=15)),
+                ('new_status', models.CharField(blank=True, max_length=15)),
+                ('changed_fields', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('appointment', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='clinic.appointment')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['appointment', 'created_at'], name='appt_event_history_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0010_appointmentevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='series_id',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0011_appointment_series_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('earliest_date', models.DateField()),
+                ('latest_date', models.DateField()),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('offered', 'Offered'), ('booked', 'Booked'), ('withdrawn', 'Withdrawn')], default='waiting', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WaitlistOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('held', 'Held'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('expired', 'Expired')], default='held', max_length=10)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='appointment',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'cancelled'), _negated=True), fields=('dentist', 'appointment_date', 'start_time'), name='unique_active_dentist_slot'),
+        ),
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='dentist',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entries', to='clinic.dentist'),
+        ),
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='clinic.patient'),
+        ),
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='service',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='clinic.service'),
+        ),
+        migrations.AddField(
+            model_name='waitlistoffer',
+            name='appointment',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='waitlist_offers', to='clinic.appointment'),
+        ),
+        migrations.AddField(
+            model_name='waitlistoffer',
+            name='entry',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='clinic.waitlistentry'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['service', 'earliest_date', 'latest_date'], name='waitlist_match_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistoffer',
+            index=models.Index(fields=['status', 'expires_at'], name='waitlist_offer_status_idx'),
+        ),
+    ]
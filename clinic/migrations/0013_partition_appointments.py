@@ -0,0 +1,140 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:21
+
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.migrations.exceptions import IrreversibleError
+
+TABLE = 'clinic_appointment'
+# เดือนย้อนหลังสูงสุดที่แยก partition ให้ตอนย้ายข้อมูลครั้งแรก ที่เก่ากว่านั้นอยู่ใน default
+MAX_BACKFILL_MONTHS = 120
+MONTHS_AHEAD = 3
+
+REPORTING_VIEW_SQL = """
+CREATE VIEW clinic_appointment_reporting AS
+    SELECT id, patient_id, dentist_id, service_id, appointment_date, start_time, end_time, status
+    FROM clinic_appointment
+    UNION ALL
+    SELECT id, patient_id, dentist_id, service_id, appointment_date, start_time, end_time, status
+    FROM clinic_appointmentarchive
+"""
+
+
+def _month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def _month_start(index):
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_appointments(apps, schema_editor):
+    """
+    PostgreSQL: แปลง clinic_appointment เป็นตาราง partition ตามเดือนของ appointment_date
+    primary key เปลี่ยนเป็น (id, appointment_date) เพราะ PG บังคับให้ key ครอบคอลัมน์ partition
+    แต่ id ยังไม่ซ้ำเพราะมาจาก sequence เดียว ฝั่ง Django จึงใช้ id เป็น pk ได้เหมือนเดิม
+    index / foreign key อื่นสร้างใหม่ด้วยชื่อเดิม migration ถัดไปจึงอ้างอิงได้ตามปกติ
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() "
+            "AND tablename = %s AND indexname <> %s",
+            [TABLE, f'{TABLE}_pkey'],
+        )
+        index_defs = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT min(appointment_date) FROM {TABLE}")
+        oldest = cursor.fetchone()[0]
+
+        current = _month_index(date.today())
+        first = current if oldest is None else max(_month_index(oldest), current - MAX_BACKFILL_MONTHS)
+
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_old")
+        cursor.execute(f"CREATE SEQUENCE {TABLE}_pid_seq")
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {TABLE}_old INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (appointment_date)"
+        )
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_pid_seq')")
+        cursor.execute(f"ALTER SEQUENCE {TABLE}_pid_seq OWNED BY {TABLE}.id")
+        cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+        for index in range(first, current + MONTHS_AHEAD + 1):
+            lower, upper = _month_start(index), _month_start(index + 1)
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_p{lower:%Y%m} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [lower, upper],
+            )
+        cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {TABLE}_old")
+        cursor.execute(
+            f"SELECT setval('{TABLE}_pid_seq', COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)"
+        )
+        cursor.execute(f"DROP TABLE {TABLE}_old")
+        cursor.execute(f"ALTER SEQUENCE {TABLE}_pid_seq RENAME TO {TABLE}_id_seq")
+
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, appointment_date)")
+        for index_def in index_defs:
+            cursor.execute(index_def)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+
+
+def unpartition_appointments(apps, schema_editor):
+    """ข้อมูลย้ายไป partition ด้วย SQL ตรงแล้ว ย้อนกลับอัตโนมัติไม่ได้ (ฐานข้อมูลอื่นไม่ได้แปลงจึงย้อนได้)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    raise IrreversibleError(
+        f"{TABLE} is partitioned by appointment_date and cannot be converted back automatically; "
+        f"restore a backup taken before 0013_partition_appointments instead"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0012_waitlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportingAppointment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('appointment_date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('confirmed', 'Confirmed'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('no_show', 'No Show')], max_length=15)),
+            ],
+            options={
+                'db_table': 'clinic_appointment_reporting',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AppointmentArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('appointment_date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('confirmed', 'Confirmed'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('no_show', 'No Show')], max_length=15)),
+                ('created_at', models.DateTimeField()),
+                ('dentist', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='clinic.dentist')),
+                ('patient', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='clinic.patient')),
+                ('service', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='clinic.service')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['appointment_date', 'status'], name='appt_archive_date_status_idx')],
+            },
+        ),
+        migrations.RunPython(partition_appointments, unpartition_appointments),
+        migrations.RunSQL(REPORTING_VIEW_SQL, 'DROP VIEW clinic_appointment_reporting'),
+    ]
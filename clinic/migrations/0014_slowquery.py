@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0013_partition_appointments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('sql', models.TextField()),
+                ('sample_params', models.TextField(blank=True)),
+                ('view', models.CharField(blank=True, max_length=200)),
+                ('frame', models.CharField(blank=True, max_length=300)),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('plan', models.JSONField(blank=True, null=True)),
+                ('first_seen', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_seen', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-last_seen'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:33
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# SQLite เพิ่มคอลัมน์ด้วยการสร้างตารางใหม่แล้วลบตารางเดิม ซึ่งทำไม่ได้ถ้ามี view อ้างถึงอยู่
+REPORTING_VIEW_SQL = import_module("clinic.migrations.0013_partition_appointments").REPORTING_VIEW_SQL
+DROP_REPORTING_VIEW_SQL = "DROP VIEW clinic_appointment_reporting"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0014_slowquery'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DROP_REPORTING_VIEW_SQL, REPORTING_VIEW_SQL),
+        migrations.AddField(
+            model_name='appointment',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunSQL(REPORTING_VIEW_SQL, DROP_REPORTING_VIEW_SQL),
+    ]
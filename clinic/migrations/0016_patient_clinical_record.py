@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# คัดลอกด้วย INSERT ... SELECT คำสั่งเดียว (ใช้ได้ทั้ง SQLite และ PostgreSQL)
+COPY_SQL = """
+INSERT INTO clinic_patientclinicalrecord (patient_id, address, allergy, medical_history, updated_at)
+SELECT id, address, allergy, medical_history, updated_at FROM clinic_patient
+"""
+COPY_BACK_SQL = [
+    f"UPDATE clinic_patient SET {column} = COALESCE(("
+    f"SELECT r.{column} FROM clinic_patientclinicalrecord r WHERE r.patient_id = clinic_patient.id), '')"
+    for column in ("address", "allergy", "medical_history")
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0015_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientClinicalRecord',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='clinical', serialize=False, to='clinic.patient')),
+                ('address', models.TextField()),
+                ('allergy', models.TextField(blank=True)),
+                ('medical_history', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunSQL(COPY_SQL, COPY_BACK_SQL),
+        # ค่า default ให้ย้อน migration ได้ (เพิ่มคอลัมน์ NOT NULL กลับในตารางที่มีข้อมูล)
+        migrations.AlterField(
+            model_name='patient',
+            name='address',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='patient',
+            name='address',
+        ),
+        migrations.RemoveField(
+            model_name='patient',
+            name='allergy',
+        ),
+        migrations.RemoveField(
+            model_name='patient',
+            name='medical_history',
+        ),
+    ]
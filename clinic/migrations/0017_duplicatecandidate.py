@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0016_patient_clinical_record'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('evidence', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending review'), ('dismissed', 'Not a duplicate')], default='pending', max_length=10)),
+                ('found_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('patient_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='clinic.patient')),
+                ('patient_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='clinic.patient')),
+                ('reviewed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['status', 'score'], name='dup_candidate_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient_a', 'patient_b'), name='unique_duplicate_pair')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0018_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FreedSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='clinic.appointment')),
+            ],
+        ),
+    ]
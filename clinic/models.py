@@ -2,6 +2,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
+from django.utils import timezone
 from datetime import datetime, time
 
 class User(AbstractUser):
@@ -47,6 +48,8 @@ class Patient(models.Model):
         ('M', 'Male'),
         ('F', 'Female'),
     ]
+    # คอลัมน์ที่หน้ารายการและการค้นหาผู้ป่วยใช้: Patient.objects.only(*Patient.SUMMARY_FIELDS)
+    SUMMARY_FIELDS = ("id", "name", "gender", "date_of_birth", "phone", "email", "photo")
     
     name = models.CharField(max_length=100)
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES)
@@ -54,14 +57,14 @@ class Patient(models.Model):
     phone_regex = RegexValidator(regex=r'^\+?1?\d{9,15}$')
     phone = models.CharField(validators=[phone_regex], max_length=17)
     email = models.EmailField(blank=True)
-    address = models.TextField()
-    allergy = models.TextField(blank=True)
-    medical_history = models.TextField(blank=True)
+    # ที่อยู่/ประวัติการรักษาอยู่ใน PatientClinicalRecord (patient.clinical)
     emergency_contact = models.CharField(max_length=100, blank=True)
     emergency_phone = models.CharField(max_length=17, blank=True)
     photo = models.ImageField(upload_to="patients/", null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # optimistic locking: +1 ทุกครั้งที่บันทึกการแก้ไข (ดู VersionedForm)
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     def __str__(self):
         return self.name
@@ -75,6 +78,22 @@ class Patient(models.Model):
     class Meta:
         ordering = ['name']
 
+
+class PatientClinicalRecord(models.Model):
+    """
+    ข้อความยาวของผู้ป่วย แยกออกจาก Patient (one-to-one)
+    หน้ารายการ การค้นหาด้วยอีเมล และ FK จาก Appointment จึงอ่านแค่แถว Patient ที่เล็ก
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='clinical')
+    address = models.TextField()
+    allergy = models.TextField(blank=True)
+    medical_history = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.patient)
+
+
 class Appointment(models.Model):
     STATUS_CHOICES = [
         ('scheduled', 'Scheduled'),
@@ -93,15 +112,253 @@ class Appointment(models.Model):
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='scheduled')
     notes = models.TextField(blank=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # นัดที่จองเป็นชุด (เช่น จัดฟันทุกสัปดาห์) ใช้ series_id เดียวกัน
+    series_id = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # optimistic locking: +1 ทุกครั้งที่บันทึกการแก้ไข (ดู VersionedForm)
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     def __str__(self):
         return f"{self.patient.name} - {self.appointment_date} {self.start_time}"
 
     class Meta:
+        """
+        บน PostgreSQL ตารางนี้ partition ตามเดือนของ appointment_date (migration 0013)
+        primary key จริงในฐานข้อมูลคือ (id, appointment_date) ไม่ใช่ id อย่างเดียว
+        - id ไม่ซ้ำเพราะมาจาก sequence clinic_appointment_id_seq เท่านั้น ฐานข้อมูลไม่ได้บังคับ
+          ห้ามใส่ id เองตอน insert (เช่น loaddata / ย้ายจาก archive) โดยไม่ setval ตาม
+        - ตารางอื่นสร้าง FOREIGN KEY มาที่ id ไม่ได้ (PG ต้องอ้าง unique ทั้งก้อน)
+          ForeignKey ที่ชี้มา Appointment จึงต้องใช้ db_constraint=False และ on_delete=DO_NOTHING
+          ความถูกต้องของการอ้างอิงเป็นหน้าที่ของโค้ด
+        - unique constraint ทุกตัวต้องมี appointment_date อยู่ด้วย
+        """
         ordering = ['appointment_date', 'start_time']
-        unique_together = ['dentist', 'appointment_date', 'start_time']
+        constraints = [
+            # นัดที่ยกเลิกแล้วไม่จองช่วงเวลา ให้จองช่วงนั้นใหม่ได้ (เช่น จาก waitlist)
+            models.UniqueConstraint(
+                fields=['dentist', 'appointment_date', 'start_time'],
+                condition=~models.Q(status='cancelled'),
+                name='unique_active_dentist_slot',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['appointment_date', 'status'], name='appt_date_status_idx'),
+        ]
+
+
+class DuplicateCandidate(models.Model):
+    """คู่ผู้ป่วยที่น่าจะเป็นคนเดียวกัน จากงาน find_duplicate_patients (ดู clinic/dedupe.py)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending review'),
+        ('dismissed', 'Not a duplicate'),
+    ]
+
+    # patient_a_id < patient_b_id เสมอ คู่ที่รวมแล้วหายไปพร้อมแถวที่ถูกลบ
+    patient_a = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    patient_b = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    evidence = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    found_at = models.DateTimeField(default=timezone.now)
+    reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.patient_a_id} ~ {self.patient_b_id} ({self.score:.2f})"
+
+    class Meta:
+        ordering = ['-score']
+        constraints = [
+            models.UniqueConstraint(fields=['patient_a', 'patient_b'], name='unique_duplicate_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'score'], name='dup_candidate_status_idx'),
+        ]
+
+
+class AppointmentArchive(models.Model):
+    """นัดเก่าที่ย้ายออกจาก partition ของ clinic_appointment (เก็บเฉพาะคอลัมน์ที่รายงานใช้)"""
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    dentist = models.ForeignKey(Dentist, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    service = models.ForeignKey(Service, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    appointment_date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField(null=True, blank=True)
+    status = models.CharField(max_length=15, choices=Appointment.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['appointment_date', 'status'], name='appt_archive_date_status_idx'),
+        ]
+
+
+class ReportingAppointment(models.Model):
+    """
+    view clinic_appointment_reporting = นัดปัจจุบัน UNION ALL นัดที่ archive แล้ว
+    ใช้อ่านอย่างเดียวสำหรับรายงาน
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    dentist = models.ForeignKey(Dentist, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    service = models.ForeignKey(Service, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    appointment_date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField(null=True, blank=True)
+    status = models.CharField(max_length=15, choices=Appointment.STATUS_CHOICES)
+
+    class Meta:
+        managed = False
+        db_table = 'clinic_appointment_reporting'
+
+
+class WaitlistEntry(models.Model):
+    """คนไข้ที่รอคิวว่าง (บริการ, ทันตแพทย์ที่ต้องการ, ช่วงวันที่สะดวก)"""
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('offered', 'Offered'),
+        ('booked', 'Booked'),
+        ('withdrawn', 'Withdrawn'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='waitlist_entries')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='waitlist_entries')
+    dentist = models.ForeignKey(
+        Dentist, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_entries'
+    )
+    earliest_date = models.DateField()
+    latest_date = models.DateField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.patient.name} - {self.service.name} ({self.earliest_date} - {self.latest_date})"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # ใช้จับคู่ช่องว่าง: เฉพาะรายการที่ยังรออยู่
+            models.Index(
+                fields=['service', 'earliest_date', 'latest_date'],
+                condition=models.Q(status='waiting'),
+                name='waitlist_match_idx',
+            ),
+        ]
+
+
+class WaitlistOffer(models.Model):
+    """ช่องว่างจากนัดที่ถูกยกเลิก ที่เสนอให้คนไข้ใน waitlist พร้อมเวลาหมดอายุ"""
+    STATUS_CHOICES = [
+        ('held', 'Held'),
+        ('accepted', 'Accepted'),
+        ('declined', 'Declined'),
+        ('expired', 'Expired'),
+    ]
+
+    entry = models.ForeignKey(WaitlistEntry, on_delete=models.CASCADE, related_name='offers')
+    # นัดที่ถูกยกเลิก (ต้นทางของช่องว่าง)
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.DO_NOTHING, db_constraint=False, related_name='waitlist_offers'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Offer #{self.appointment_id} -> {self.entry.patient.name} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='waitlist_offer_status_idx'),
+        ]
+
+
+class FreedSlot(models.Model):
+    """
+    คิวของนัดที่เพิ่งว่าง (ยกเลิก/ปฏิเสธข้อเสนอ) รอให้ waitlist_backfill จับคู่กับ waitlist นอก request
+    """
+    appointment = models.OneToOneField(
+        Appointment, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    queued_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Freed slot #{self.appointment_id}"
+
+
+class AppointmentEvent(models.Model):
+    """ประวัติการเปลี่ยนแปลงนัดหมาย (เพิ่มอย่างเดียว ไม่แก้ไข/ลบ)"""
+    ACTION_CHOICES = [
+        ('created', 'Created'),
+        ('status', 'Status changed'),
+        ('edited', 'Edited'),
+        ('deleted', 'Deleted'),
+    ]
+
+    # ไม่ใช้ FK constraint และไม่ cascade เพื่อให้ประวัติยังอยู่แม้นัดถูกลบ
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+        related_name='events',
+    )
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    old_status = models.CharField(max_length=15, blank=True)
+    new_status = models.CharField(max_length=15, blank=True)
+    changed_fields = models.JSONField(default=dict, blank=True)
+    # ใช้เวลาที่เกิดเหตุการณ์ ไม่ใช่เวลาที่ flush ลงฐานข้อมูล
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    def __str__(self):
+        return f"#{self.appointment_id} {self.action} {self.old_status}->{self.new_status}"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['appointment', 'created_at'], name='appt_event_history_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """คำขอ POST ที่มี Idempotency-Key (ดู clinic/idempotency.py) status ว่าง = คำขอแรกยังทำอยู่"""
+    # unique ในฐานข้อมูลคือตัวจอง: คำขอพร้อมกันด้วย key เดียวกัน INSERT ผ่านได้แถวเดียว
+    slot = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    content = models.BinaryField(blank=True, default=b'')
+    headers = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.slot[:8]} {self.status or 'pending'}"
+
+
+class SlowQuery(models.Model):
+    """query ที่ช้ากว่าเกณฑ์ รวมเป็นแถวเดียวต่อ fingerprint (ดู clinic/slowlog.py)"""
+    fingerprint = models.CharField(max_length=40, unique=True)
+    sql = models.TextField()
+    sample_params = models.TextField(blank=True)
+    view = models.CharField(max_length=200, blank=True)
+    frame = models.CharField(max_length=300, blank=True)
+    count = models.PositiveIntegerField(default=1)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    plan = models.JSONField(null=True, blank=True)
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.fingerprint[:8]} x{self.count} max {self.max_ms:.0f} ms"
+
+    @property
+    def avg_ms(self):
+        return self.total_ms / self.count if self.count else 0
+
+    class Meta:
+        ordering = ['-last_seen']
 
 
 
@@ -0,0 +1,132 @@
+# clinic/occupancy.py
+"""
+ความหนาแน่นของตารางทันตแพทย์ราย ชั่วโมงของสัปดาห์ (168 ช่อง: จันทร์ 00:00 ... อาทิตย์ 23:00)
+
+ดึงช่วงเวลานัดเป็นเลขนาทีจากฐานข้อมูลด้วย values_list แล้วรวมด้วย NumPy ทั้งก้อน:
++1 ที่นาทีเริ่ม -1 ที่นาทีจบ (difference array) ต่อทันตแพทย์ -> cumsum = จำนวนนัดที่ซ้อนกันในแต่ละนาที
+-> reshape (ทันตแพทย์, 168, 60) รวมเป็นนาทีที่ถูกจองต่อชั่วโมง
+occupancy = นาทีที่จอง / นาทีทั้งหมดของชั่วโมงนั้นในช่วงวันที่ (> 1 = จองซ้อน)
+"""
+from datetime import date
+
+import numpy as np
+from django.db.models.functions import Coalesce, ExtractHour, ExtractIsoWeekDay, ExtractMinute
+
+from .models import Dentist, ReportingAppointment
+from .reports import BOOKED
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+HOURS_PER_WEEK = 7 * 24
+WEEKDAY_LABELS = ("จ.", "อ.", "พ.", "พฤ.", "ศ.", "ส.", "อา.")
+
+
+def minute_of_day(field):
+    """นาทีนับจากเที่ยงคืนของ TimeField (เทียบช่วงเวลาในฐานข้อมูลได้ทั้ง SQLite และ PostgreSQL)"""
+    return ExtractHour(field) * 60 + ExtractMinute(field)
+
+
+def intervals(start, end):
+    """ndarray (n, 5): dentist_id, วันในสัปดาห์ (จันทร์ = 1), นาทีเริ่ม, นาทีจบ (อาจเป็น -1), ระยะบริการ"""
+    rows = (
+        ReportingAppointment.objects.filter(BOOKED, appointment_date__range=(start, end))
+        .order_by()
+        .annotate(
+            weekday=ExtractIsoWeekDay("appointment_date"),
+            start_minute=minute_of_day("start_time"),
+            end_minute=Coalesce(minute_of_day("end_time"), -1),
+        )
+        .values_list("dentist_id", "weekday", "start_minute", "end_minute", "service__duration_minutes")
+    )
+    return np.array(list(rows), dtype=np.int64).reshape(-1, 5)
+
+
+def weekday_counts(start, end):
+    """จำนวนวันจันทร์..อาทิตย์ในช่วง start..end"""
+    days = max((end - start).days + 1, 0)
+    return np.bincount((np.arange(days) + start.weekday()) % 7, minlength=7)
+
+
+def bin_intervals(rows):
+    """
+    rows จาก intervals() -> (dentist_ids, booked, overlap)
+    booked/overlap เป็น (ทันตแพทย์, 168) นาทีที่ถูกจอง / นาทีที่มีนัดซ้อนเกินหนึ่งนัด
+    """
+    dentist_ids, index = np.unique(rows[:, 0], return_inverse=True)
+    begin = rows[:, 2]
+    # ไม่มีเวลาจบ (หรือจบก่อนเริ่ม) ใช้ระยะเวลาของบริการ และตัดที่เที่ยงคืน
+    finish = np.where(rows[:, 3] > begin, rows[:, 3], begin + rows[:, 4])
+    finish = np.clip(finish, begin, MINUTES_PER_DAY)
+
+    width = MINUTES_PER_WEEK + 1  # ช่องสุดท้ายรับ -1 ของนัดที่จบตอนเที่ยงคืนวันอาทิตย์
+    base = index * width + (rows[:, 1] - 1) * MINUTES_PER_DAY
+    size = len(dentist_ids) * width
+    diff = np.bincount(base + begin, minlength=size) - np.bincount(base + finish, minlength=size)
+    concurrent = diff.reshape(len(dentist_ids), width).cumsum(axis=1)[:, :MINUTES_PER_WEEK]
+
+    hourly = (len(dentist_ids), HOURS_PER_WEEK, 60)
+    booked = concurrent.reshape(hourly).sum(axis=2)
+    overlap = np.maximum(concurrent - 1, 0).reshape(hourly).sum(axis=2)
+    return dentist_ids, booked, overlap
+
+
+def occupancy(start, end):
+    """
+    {"dentists": [{"id", "name"}], "booked", "overlap", "occupancy": ndarray (ทันตแพทย์, 168),
+     "available": ndarray (168,) นาทีทั้งหมดของแต่ละชั่วโมงในช่วงวันที่}
+    """
+    dentist_ids, booked, overlap = bin_intervals(intervals(start, end))
+    names = dict(Dentist.objects.filter(pk__in=dentist_ids.tolist()).values_list("pk", "name"))
+    available = np.repeat(weekday_counts(start, end), 24) * 60
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(available > 0, booked / available, 0.0)
+
+    order = sorted(range(len(dentist_ids)), key=lambda i: names.get(int(dentist_ids[i]), ""))
+    return {
+        "dentists": [{"id": int(dentist_ids[i]), "name": names.get(int(dentist_ids[i]), "")} for i in order],
+        "booked": booked[order],
+        "overlap": overlap[order],
+        "occupancy": ratio[order],
+        "available": available,
+    }
+
+
+def heatmap_rows(result, dentist_id=None, hours=(0, 24)):
+    """
+    ตาราง วัน x ชั่วโมง สำหรับแสดงผล ของทันตแพทย์คนเดียว หรือทั้งคลินิก (รวมทุกคนเทียบกับเก้าอี้ทุกตัว)
+    [{"weekday": "จ.", "cells": [{"hour": 8, "value": 0.75}, ...]}, ...]
+    """
+    ids = [d["id"] for d in result["dentists"]]
+    if dentist_id in ids:
+        booked = result["booked"][ids.index(dentist_id)]
+        capacity = result["available"]
+    else:
+        booked = result["booked"].sum(axis=0) if ids else np.zeros(HOURS_PER_WEEK)
+        capacity = result["available"] * max(len(ids), 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(capacity > 0, booked / capacity, 0.0).reshape(7, 24)
+    first, last = hours
+    return [
+        {
+            "weekday": label,
+            "cells": [{"hour": hour, "value": round(float(values[day, hour]), 3)} for hour in range(first, last)],
+        }
+        for day, label in enumerate(WEEKDAY_LABELS)
+    ]
+
+
+def csv_rows(result):
+    """แถวละชั่วโมงของสัปดาห์ คอลัมน์ละทันตแพทย์ (ค่า occupancy)"""
+    header = ["hour_of_week", "weekday", "hour"] + [d["name"] for d in result["dentists"]]
+    yield header
+    matrix = result["occupancy"]
+    for hour in range(HOURS_PER_WEEK):
+        yield [hour, WEEKDAY_LABELS[hour // 24], f"{hour % 24:02d}:00"] + [
+            f"{value:.3f}" for value in matrix[:, hour]
+        ]
+
+
+def month_range(year, month):
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1)
+    return start, date.fromordinal(end.toordinal() - 1)
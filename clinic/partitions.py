@@ -0,0 +1,115 @@
+# clinic/partitions.py
+"""
+ดูแล partition รายเดือนของ clinic_appointment (PostgreSQL เท่านั้น ดู migration 0013)
+partition ชื่อ clinic_appointment_pYYYYMM และมี clinic_appointment_default รับวันที่นอกช่วง
+"""
+from datetime import date
+
+from django.db import connection, transaction
+
+TABLE = "clinic_appointment"
+DEFAULT_PARTITION = f"{TABLE}_default"
+ARCHIVE_TABLE = "clinic_appointmentarchive"
+ARCHIVE_COLUMNS = (
+    "id", "patient_id", "dentist_id", "service_id",
+    "appointment_date", "start_time", "end_time", "status", "created_at",
+)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def monthly_partitions():
+    """[(เดือน, ชื่อ partition)] เรียงจากเก่าไปใหม่"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f"{TABLE}_p"
+    months = []
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            months.append((date(int(suffix[:4]), int(suffix[4:]), 1), name))
+    return sorted(months)
+
+
+def create_partition(month):
+    """
+    สร้าง partition ของเดือน ถ้ามีแถวของเดือนนี้ค้างใน default ให้ย้ายมาก่อน ATTACH
+    (PG ไม่ยอม attach ถ้า default ยังมีแถวที่อยู่ในช่วงของ partition ใหม่)
+    คืนค่า False ถ้ามีอยู่แล้ว
+    """
+    name = partition_name(month)
+    lower, upper = month, add_months(month, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0] is not None:
+            return False
+        # CHECK ของตารางแม่ (เช่น version >= 0) ต้องมีใน partition ด้วย ไม่งั้น ATTACH ไม่ผ่าน
+        cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE appointment_date >= %s AND appointment_date < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            [lower, upper],
+        )
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+            [lower, upper],
+        )
+    return True
+
+
+def ensure_partitions(ahead=3, today=None):
+    """สร้าง partition ตั้งแต่เดือนนี้ไปอีก ahead เดือน คืนรายชื่อที่สร้างใหม่"""
+    current = month_start(today or date.today())
+    created = []
+    for offset in range(ahead + 1):
+        month = add_months(current, offset)
+        if create_partition(month):
+            created.append(partition_name(month))
+    return created
+
+
+def archive_partition(name):
+    """DETACH partition แล้วย้ายแถวเข้าตาราง archive แบบย่อ จากนั้น DROP คืนจำนวนแถว"""
+    columns = ", ".join(ARCHIVE_COLUMNS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+        cursor.execute(
+            f"INSERT INTO {ARCHIVE_TABLE} ({columns}) SELECT {columns} FROM {name} "
+            f"ON CONFLICT (id) DO NOTHING"
+        )
+        moved = cursor.rowcount
+        cursor.execute(f"DROP TABLE {name}")
+    return moved
+
+
+def archive_before(cutoff):
+    """archive ทุก partition ที่ทั้งเดือนอยู่ก่อน cutoff คืน {ชื่อ partition: จำนวนแถว}"""
+    cutoff = month_start(cutoff)
+    return {name: archive_partition(name) for month, name in monthly_partitions() if month < cutoff}
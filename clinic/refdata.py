@@ -0,0 +1,42 @@
+# clinic/refdata.py
+"""
+ข้อมูลอ้างอิงที่เปลี่ยนน้อย (ทันตแพทย์/บริการที่เปิดใช้) เก็บไว้ในหน่วยความจำของ process
+เวอร์ชันอยู่ใน cache กลาง ถ้ามีการแก้ไขจาก worker ใดก็ตาม ทุก worker จะโหลดใหม่
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import Dentist, Service
+
+_VERSION_KEY = "clinic:refdata:version"
+_loaded = {}
+
+
+def _version():
+    return cache.get_or_set(_VERSION_KEY, time.time_ns, None)
+
+
+def invalidate():
+    cache.set(_VERSION_KEY, time.time_ns(), None)
+
+
+def _load(name, queryset):
+    version = _version()
+    hit = _loaded.get(name)
+    if hit is None or hit[0] != version:
+        hit = _loaded[name] = (version, list(queryset))
+    return hit[1]
+
+
+def active_dentists():
+    return _load("dentists", Dentist.objects.filter(is_active=True).order_by("name"))
+
+
+def active_services():
+    return _load("services", Service.objects.filter(is_active=True).order_by("name"))
+
+
+def warm():
+    active_dentists()
+    active_services()
@@ -0,0 +1,66 @@
+# clinic/reminders.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import Appointment
+
+REMINDER_STATUSES = ("scheduled", "confirmed")
+
+
+def _reminder_subject(appt):
+    return f"แจ้งเตือนนัดหมายวันที่ {appt.appointment_date:%d/%m/%Y} เวลา {appt.start_time:%H:%M} น."
+
+
+def _reminder_body(appt):
+    return (
+        f"สวัสดี คุณ{appt.patient.name}\n\n"
+        f"ขอแจ้งเตือนนัดหมาย {appt.service.name} กับ {appt.dentist}\n"
+        f"วันที่ {appt.appointment_date:%d/%m/%Y} เวลา {appt.start_time:%H:%M} น.\n\n"
+        f"หากไม่สามารถมาตามนัดได้ กรุณายกเลิกผ่านระบบหรือติดต่อคลินิก"
+    )
+
+
+def pending_reminders(day=None):
+    """นัดของวันพรุ่งนี้ (หรือ day) ที่ยังไม่ได้ส่งอีเมลเตือน"""
+    day = day or timezone.localdate() + timedelta(days=1)
+    return Appointment.objects.filter(
+        appointment_date=day,
+        status__in=REMINDER_STATUSES,
+        reminder_sent_at__isnull=True,
+    ).exclude(patient__email="")
+
+
+def send_appointment_reminders(day=None, batch_size=None):
+    """
+    ส่งอีเมลเตือนนัดของวันพรุ่งนี้ (หรือ day) ทั้งหมดผ่าน connection เดียว
+    ดึงข้อมูลด้วย query เดียว ส่งทีละ batch แล้วประทับ reminder_sent_at
+    รันซ้ำได้ นัดที่ส่งแล้วจะไม่ถูกส่งอีก คืนค่าจำนวนอีเมลที่ส่ง
+    """
+    batch_size = batch_size or getattr(settings, "CLINIC_REMINDER_BATCH_SIZE", 100)
+    from_email = getattr(settings, "DEFAULT_FROM_EMAIL", settings.EMAIL_HOST_USER)
+
+    appointments = list(
+        pending_reminders(day)
+        .select_related("patient", "dentist", "service")
+        .order_by("start_time", "pk")
+    )
+    if not appointments:
+        return 0
+
+    sent = 0
+    with get_connection(fail_silently=False) as connection:
+        for i in range(0, len(appointments), batch_size):
+            batch = appointments[i:i + batch_size]
+            connection.send_messages([
+                EmailMessage(_reminder_subject(appt), _reminder_body(appt), from_email, [appt.patient.email])
+                for appt in batch
+            ])
+            # ประทับหลังส่งแต่ละ batch สำเร็จ ถ้าล้มกลางทาง รอบถัดไปจะส่งเฉพาะที่เหลือ
+            Appointment.objects.filter(pk__in=[appt.pk for appt in batch]).update(
+                reminder_sent_at=timezone.now()
+            )
+            sent += len(batch)
+    return sent
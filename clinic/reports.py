@@ -0,0 +1,174 @@
+# clinic/reports.py
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, Func, IntegerField, Q, Sum, Value, Window
+from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
+
+from .models import ReportingAppointment
+
+REPORT_KINDS = ("dentists", "services", "periods")
+PERIODS = {"week": TruncWeek, "month": TruncMonth}
+
+COMPLETED = Q(status="completed")
+# นัดที่จองเก้าอี้ไว้จริง (ไม่นับยกเลิก)
+BOOKED = Q(status__in=("scheduled", "confirmed", "completed", "no_show"))
+
+# คอลัมน์ของแต่ละรายงาน (ลำดับเดียวกับ dict ที่คืน) ใช้เป็นหัว CSV แม้ไม่มีข้อมูล
+COLUMNS = {
+    "dentists": (
+        "dentist_id", "dentist", "visits", "revenue", "revenue_share", "booked_minutes", "available_minutes",
+        "utilization", "appointments", "cancelled", "no_show", "cancellation_rate", "no_show_rate",
+    ),
+    "services": ("service_id", "service", "visits", "revenue", "revenue_share"),
+    "periods": (
+        "period", "appointments", "visits", "revenue", "cancelled", "no_show", "cumulative_revenue",
+        "cancellation_rate", "no_show_rate",
+    ),
+}
+
+_VERSION_KEY = "clinic:reports:version"
+
+
+class WindowSum(Func):
+    """SUM(...) OVER (...) ครอบผลรวมที่ group แล้ว (Django ไม่ยอมให้ Sum ซ้อน Sum)"""
+    function = "SUM"
+    window_compatible = True
+    output_field = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _money(expression):
+    return Coalesce(expression, Value(Decimal("0")), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else 0.0
+
+
+def working_days(start, end):
+    weekdays = getattr(settings, "CLINIC_WORKING_WEEKDAYS", (0, 1, 2, 3, 4, 5))
+    days = (end - start).days + 1
+    return sum(1 for i in range(max(days, 0)) if (start + timedelta(days=i)).weekday() in weekdays)
+
+
+def _in_range(start, end):
+    # อ่านผ่าน view ที่รวมนัดที่ archive แล้ว รายงานย้อนหลังจึงไม่หายหลังย้าย partition เก่าออก
+    return ReportingAppointment.objects.filter(appointment_date__range=(start, end)).order_by()
+
+
+def dentist_report(start, end):
+    """รายได้ เวลาเก้าอี้ อัตรายกเลิก/ไม่มา ต่อทันตแพทย์ (query เดียว)"""
+    rows = (
+        _in_range(start, end)
+        .values("dentist_id", "dentist__name")
+        .annotate(
+            total=Count("id"),
+            visits=Count("id", filter=COMPLETED),
+            revenue=_money(Sum("service__price", filter=COMPLETED)),
+            booked_minutes=Coalesce(Sum("service__duration_minutes", filter=BOOKED), 0, output_field=IntegerField()),
+            cancelled=Count("id", filter=Q(status="cancelled")),
+            no_show=Count("id", filter=Q(status="no_show")),
+        )
+        .annotate(revenue_total=Window(WindowSum("revenue")))
+        .order_by("-revenue", "dentist__name")
+    )
+    available = working_days(start, end) * getattr(settings, "CLINIC_CHAIR_MINUTES_PER_DAY", 480)
+    return [
+        {
+            "dentist_id": row["dentist_id"],
+            "dentist": row["dentist__name"],
+            "visits": row["visits"],
+            "revenue": row["revenue"],
+            "revenue_share": _rate(row["revenue"], row["revenue_total"]),
+            "booked_minutes": row["booked_minutes"],
+            "available_minutes": available,
+            "utilization": _rate(row["booked_minutes"], available),
+            "appointments": row["total"],
+            "cancelled": row["cancelled"],
+            "no_show": row["no_show"],
+            "cancellation_rate": _rate(row["cancelled"], row["total"]),
+            "no_show_rate": _rate(row["no_show"], row["total"]),
+        }
+        for row in rows
+    ]
+
+
+def service_report(start, end):
+    """รายได้และจำนวนครั้งต่อบริการ"""
+    rows = (
+        _in_range(start, end)
+        .filter(COMPLETED)
+        .values("service_id", "service__name")
+        .annotate(visits=Count("id"), revenue=_money(Sum("service__price")))
+        .annotate(revenue_total=Window(WindowSum("revenue")))
+        .order_by("-revenue", "service__name")
+    )
+    return [
+        {
+            "service_id": row["service_id"],
+            "service": row["service__name"],
+            "visits": row["visits"],
+            "revenue": row["revenue"],
+            "revenue_share": _rate(row["revenue"], row["revenue_total"]),
+        }
+        for row in rows
+    ]
+
+
+def period_report(start, end, period="month"):
+    """รายได้ต่อสัปดาห์/เดือน พร้อมยอดสะสม"""
+    trunc = PERIODS[period]
+    rows = (
+        _in_range(start, end)
+        .annotate(period=trunc("appointment_date"))
+        .values("period")
+        .annotate(
+            appointments=Count("id"),
+            visits=Count("id", filter=COMPLETED),
+            revenue=_money(Sum("service__price", filter=COMPLETED)),
+            cancelled=Count("id", filter=Q(status="cancelled")),
+            no_show=Count("id", filter=Q(status="no_show")),
+        )
+        .annotate(cumulative_revenue=Window(WindowSum("revenue"), order_by=F("period").asc()))
+        .order_by("period")
+    )
+    return [
+        {
+            **row,
+            "cancellation_rate": _rate(row["cancelled"], row["appointments"]),
+            "no_show_rate": _rate(row["no_show"], row["appointments"]),
+        }
+        for row in rows
+    ]
+
+
+def _version():
+    return cache.get_or_set(_VERSION_KEY, time.time_ns(), None)
+
+
+def invalidate():
+    """ทำให้รายงานที่ cache ไว้ทั้งหมดหมดอายุ (เปลี่ยน version ของ key)"""
+    cache.set(_VERSION_KEY, time.time_ns(), None)
+
+
+def get_report(kind, start, end, period="month"):
+    """คืนรายงานตาม kind โดย cache ต่อชุดพารามิเตอร์"""
+    if kind not in REPORT_KINDS:
+        raise ValueError(f"Unknown report: {kind}")
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+
+    key = f"clinic:reports:{_version()}:{kind}:{start.isoformat()}:{end.isoformat()}:{period}"
+    rows = cache.get(key)
+    if rows is None:
+        if kind == "dentists":
+            rows = dentist_report(start, end)
+        elif kind == "services":
+            rows = service_report(start, end)
+        else:
+            rows = period_report(start, end, period)
+        cache.set(key, rows, getattr(settings, "CLINIC_REPORT_CACHE_SECONDS", 600))
+    return rows
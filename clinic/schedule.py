@@ -0,0 +1,64 @@
+# clinic/schedule.py
+from datetime import timedelta
+
+from django.conf import settings
+
+from .models import Appointment
+
+
+def week_start(day):
+    """วันจันทร์ของสัปดาห์ที่ day อยู่"""
+    return day - timedelta(days=day.weekday())
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def build_calendar(start, days=7, dentist_id=None):
+    """
+    สร้างข้อมูลปฏิทินจาก range query เดียว แล้ว group ต่อทันตแพทย์เป็นช่วงเวลา
+    slots: [day_index, start_min, end_min, appointment_id, patient, service, status]
+    (ถ้าไม่มี end_time ใช้ระยะเวลาของบริการแทน)
+    """
+    end = start + timedelta(days=days - 1)
+    appointments = (
+        Appointment.objects.filter(appointment_date__range=(start, end))
+        .exclude(status="cancelled")
+        .select_related("patient", "dentist", "service")
+        .order_by("dentist__name", "appointment_date", "start_time")
+    )
+    if dentist_id:
+        appointments = appointments.filter(dentist_id=dentist_id)
+
+    dentists = {}
+    for appt in appointments:
+        entry = dentists.get(appt.dentist_id)
+        if entry is None:
+            entry = dentists[appt.dentist_id] = {"id": appt.dentist_id, "name": str(appt.dentist), "slots": []}
+        begin = _minutes(appt.start_time)
+        finish = _minutes(appt.end_time) if appt.end_time else begin + appt.service.duration_minutes
+        entry["slots"].append([
+            (appt.appointment_date - start).days,
+            begin,
+            max(finish, begin),
+            appt.pk,
+            appt.patient.name,
+            appt.service.name,
+            appt.status,
+        ])
+
+    day_start, day_end = getattr(settings, "CLINIC_CALENDAR_HOURS", (8, 20))
+    day_start, day_end = day_start * 60, day_end * 60
+    # นัดที่อยู่นอกเวลาทำการขยายกรอบเป็นชั่วโมงเต็ม ไม่ให้หลุดจากตาราง
+    slots = [slot for entry in dentists.values() for slot in entry["slots"]]
+    if slots:
+        day_start = min(day_start, min(slot[1] for slot in slots) // 60 * 60)
+        day_end = max(day_end, -(-max(slot[2] for slot in slots) // 60) * 60)
+    return {
+        "start": start.isoformat(),
+        "days": [(start + timedelta(days=i)).isoformat() for i in range(days)],
+        "day_start": day_start,
+        "day_end": day_end,
+        "dentists": list(dentists.values()),
+    }
@@ -0,0 +1,148 @@
+# clinic/scheduler.py
+import logging
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import DatabaseError, connection
+from django.utils.module_loading import autodiscover_modules
+
+logger = logging.getLogger(__name__)
+
+# งานประจำที่ลงทะเบียนไว้: name -> Job
+JOBS = {}
+
+# key ของ advisory lock (คงที่ต่อโปรเจกต์)
+LEADER_LOCK_KEY = zlib.crc32(b"clinic.scheduler.leader")
+
+
+class Job:
+    def __init__(self, name, func, every):
+        self.name = name
+        self.func = func
+        self.every = every.total_seconds() if isinstance(every, timedelta) else float(every)
+        self.last_run = None
+
+    def is_due(self, now):
+        return self.last_run is None or now - self.last_run >= self.every
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            result = self.func()
+        except Exception:
+            logger.exception("Periodic job %s failed", self.name)
+            result = None
+        self.last_run = time.monotonic()
+        logger.info("Periodic job %s finished in %.2fs: %s", self.name, self.last_run - started, result)
+        return result
+
+
+def periodic_job(name, every):
+    """ลงทะเบียนฟังก์ชันเป็นงานประจำ ทำซ้ำทุก ๆ every (วินาทีหรือ timedelta)"""
+    def decorator(func):
+        JOBS[name] = Job(name, func, every)
+        return func
+    return decorator
+
+
+def discover_jobs():
+    """import โมดูล <app>.jobs ของทุกแอป เพื่อให้ @periodic_job ลงทะเบียนงาน"""
+    autodiscover_modules("jobs")
+    return JOBS
+
+
+class Leadership:
+    """ผลของ leader_lock: bool(...) บอกว่าได้เป็น leader ตอนเริ่ม, still_leader() ตรวจซ้ำแต่ละรอบ"""
+
+    def __init__(self, acquired):
+        self.acquired = acquired
+
+    def __bool__(self):
+        return self.acquired
+
+    def still_leader(self):
+        """
+        ตรวจว่า session นี้ยังถือ lock อยู่ ถ้า connection หลุดแล้วต่อใหม่ lock จะหายไปกับ session เดิม
+        จึงลองชิงคืน ถ้า host อื่นได้ไปแล้วคืนค่า False และ leader นี้ต้องหยุดรันงาน
+        """
+        if connection.vendor != "postgresql" or not self.acquired:
+            return self.acquired
+        try:
+            self.acquired = _hold_lock()
+        except DatabaseError:
+            # connection เสีย: ปิดแล้วลองใหม่บน connection ใหม่ (session ใหม่ ไม่มี lock เดิมแล้ว)
+            logger.warning("Scheduler lock check failed; reconnecting", exc_info=True)
+            connection.close()
+            try:
+                self.acquired = _hold_lock()
+            except DatabaseError:
+                logger.exception("Scheduler lock check failed after reconnect")
+                self.acquired = False
+        if not self.acquired:
+            logger.warning("Scheduler lock lost to another host; stepping down")
+        return self.acquired
+
+
+def _hold_lock():
+    """ยังถือ lock ใน session นี้หรือไม่ ถ้าไม่ถือลองชิงใหม่ (ไม่เพิ่มจำนวนชั้นของ lock ที่ถืออยู่แล้ว)"""
+    with connection.cursor() as cursor:
+        # key ไม่เกิน 32 บิต: classid = 0, objid = key, objsubid = 1 (รูปแบบ bigint เดียว)
+        cursor.execute(
+            "SELECT CASE WHEN EXISTS ("
+            "  SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()"
+            "  AND classid = 0 AND objid = %s AND objsubid = 1 AND granted"
+            ") THEN true ELSE pg_try_advisory_lock(%s) END",
+            [LEADER_LOCK_KEY, LEADER_LOCK_KEY],
+        )
+        return cursor.fetchone()[0]
+
+
+@contextmanager
+def leader_lock():
+    """
+    เลือก leader ด้วย PostgreSQL advisory lock ระดับ session
+    ล็อกอยู่กับ connection นี้จนกว่าจะปลดหรือ session จบ ผู้เรียกต้องตรวจ still_leader() ทุกรอบ
+    เพราะถ้า connection หลุด lock หายและ host อื่นอาจเป็น leader แทน ฐานข้อมูลอื่นถือว่าเป็น leader เสมอ
+    """
+    if connection.vendor != "postgresql":
+        yield Leadership(True)
+        return
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [LEADER_LOCK_KEY])
+            leadership = Leadership(cursor.fetchone()[0])
+    except DatabaseError:
+        # ฐานข้อมูลหลุด: ปิด connection ให้รอบ standby ถัดไปต่อใหม่
+        logger.warning("Could not take scheduler lock", exc_info=True)
+        connection.close()
+        leadership = Leadership(False)
+    try:
+        yield leadership
+    finally:
+        if leadership.acquired:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [LEADER_LOCK_KEY])
+            except DatabaseError:
+                # session หลุดไปแล้ว lock ถูกปล่อยพร้อม session
+                logger.warning("Could not release scheduler lock", exc_info=True)
+
+
+def run_due_jobs(names=None, force=False, still_leader=None):
+    """
+    รันงานที่ถึงรอบแล้ว (หรือทุกงานถ้า force) คืนค่า dict name -> ผลลัพธ์
+    still_leader (callable) ถูกเรียกก่อนแต่ละงาน ถ้าคืนค่า False หยุดทันที
+    """
+    now = time.monotonic()
+    results = {}
+    for name, job in JOBS.items():
+        if names and name not in names:
+            continue
+        if force or job.is_due(now):
+            if still_leader is not None and not still_leader():
+                break
+            results[name] = job.run()
+    return results
@@ -0,0 +1,126 @@
+# clinic/series.py
+import calendar
+import uuid
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from . import audit
+from .models import Appointment
+from .signals import appointments_changed
+
+FREQUENCY_CHOICES = [
+    ("daily", "ทุกวัน"),
+    ("weekly", "ทุกสัปดาห์"),
+    ("monthly", "ทุกเดือน"),
+]
+MAX_OCCURRENCES = 52
+
+
+def _add_months(day, months):
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def occurrences(first_date, frequency, interval=1, count=None, until=None, limit=MAX_OCCURRENCES):
+    """
+    วันที่ของนัดทั้งชุดตามกฎแบบ RRULE (FREQ/INTERVAL/COUNT/UNTIL) ไม่เกิน limit วัน
+    AppointmentSeriesForm ตรวจแล้วว่าชุดที่ใช้ until ไม่เกิน MAX_OCCURRENCES จึงไม่ถูกตัดเงียบ ๆ
+    """
+    limit = min(count or limit, limit)
+    dates = []
+    for i in range(limit):
+        if frequency == "daily":
+            day = first_date + timedelta(days=i * interval)
+        elif frequency == "weekly":
+            day = first_date + timedelta(weeks=i * interval)
+        elif frequency == "monthly":
+            day = _add_months(first_date, i * interval)
+        else:
+            raise ValueError(f"Unknown frequency: {frequency}")
+        if until and day > until:
+            break
+        dates.append(day)
+    return dates
+
+
+def _span(day, start_time, end_time, duration_minutes):
+    start = datetime.combine(day, start_time)
+    end = datetime.combine(day, end_time) if end_time else start + timedelta(minutes=duration_minutes)
+    return start, max(end, start)
+
+
+def find_conflicts(template, dates):
+    """
+    ตรวจทุกวันในชุดกับนัดเดิมของทันตแพทย์และคนไข้ด้วย query เดียว
+    คืนค่า dict {date: เหตุผล}
+    """
+    existing = (
+        Appointment.objects.filter(
+            Q(dentist=template.dentist) | Q(patient=template.patient),
+            appointment_date__in=dates,
+        )
+        .exclude(status="cancelled")
+        .order_by()
+        .values_list(
+            "dentist_id", "patient_id", "appointment_date", "start_time",
+            "end_time", "service__duration_minutes",
+        )
+    )
+    by_date = {}
+    for row in existing:
+        by_date.setdefault(row[2], []).append(row)
+
+    duration = template.service.duration_minutes
+    conflicts = {}
+    for day in dates:
+        start, end = _span(day, template.start_time, template.end_time, duration)
+        for dentist_id, patient_id, _, other_start, other_end, other_duration in by_date.get(day, ()):
+            other_begin, other_finish = _span(day, other_start, other_end, other_duration)
+            if start < other_finish and other_begin < end:
+                conflicts[day] = "ทันตแพทย์มีนัดแล้ว" if dentist_id == template.dentist_id else "คนไข้มีนัดแล้ว"
+                break
+    return conflicts
+
+
+def book_series(template, dates, created_by=None):
+    """
+    สร้างนัดทุกวันที่ไม่ชนด้วย bulk_create ใน transaction เดียว
+    คืนค่า (นัดที่สร้าง, {date: เหตุผลที่ชน})
+    """
+    conflicts = find_conflicts(template, dates)
+    series_id = uuid.uuid4()
+    appointments = [
+        Appointment(
+            patient=template.patient,
+            dentist=template.dentist,
+            service=template.service,
+            appointment_date=day,
+            start_time=template.start_time,
+            end_time=template.end_time,
+            notes=template.notes,
+            status="scheduled",
+            created_by=created_by,
+            series_id=series_id,
+        )
+        for day in dates
+        if day not in conflicts
+    ]
+    if not appointments:
+        return [], conflicts
+
+    try:
+        with transaction.atomic():
+            created = Appointment.objects.bulk_create(appointments)
+    except IntegrityError:
+        # มีคนจองช่วงเดียวกันแทรกเข้ามาระหว่างตรวจ -> ไม่สร้างเลยทั้งชุด แล้วตรวจใหม่เพื่อบอกเฉพาะวันที่ชนจริง
+        conflicts = find_conflicts(template, dates)
+        return [], conflicts or {day: "ช่วงเวลาถูกจองระหว่างบันทึก กรุณาลองใหม่" for day in dates}
+
+    for appt in created:
+        if appt.pk:
+            audit.record(appt.pk, "created", new_status=appt.status)
+    appointments_changed.send(sender=Appointment)
+    return created, conflicts
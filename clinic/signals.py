@@ -0,0 +1,30 @@
+# clinic/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from . import refdata, reports
+from .models import Appointment, Dentist, Service
+
+# ส่งทุกครั้งที่ข้อมูลนัดหมายเปลี่ยน รวมถึง QuerySet.update() ที่ไม่ยิง post_save
+appointments_changed = Signal()
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def _relay_model_change(sender, **kwargs):
+    appointments_changed.send(sender=sender)
+
+
+@receiver(appointments_changed)
+def _invalidate_reports(sender, **kwargs):
+    reports.invalidate()
+
+
+@receiver(post_save, sender=Dentist)
+@receiver(post_delete, sender=Dentist)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def _invalidate_refdata(sender, **kwargs):
+    refdata.invalidate()
@@ -0,0 +1,175 @@
+# clinic/slowlog.py
+"""
+บันทึก query ที่ช้ากว่า CLINIC_SLOW_QUERY_MS ลงตาราง SlowQuery (ดูได้ในหน้า admin)
+
+ระหว่างคำขอแค่จดไว้ในหน่วยความจำ แล้วเขียนหลังได้ response
+จึงไม่ไปปนกับ transaction ของ view และไม่หายไปถ้า view rollback
+บน PostgreSQL จะเก็บ EXPLAIN (FORMAT JSON) ของครั้งแรกที่เจอ fingerprint นั้น
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+import traceback
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+CLINIC_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+# ไฟล์ที่ห่อ execute อยู่ (ไม่ใช่ผู้สั่ง query)
+WRAPPER_FILES = ("slowlog.py", "metrics.py")
+
+# True ระหว่างเขียน log เอง เพื่อไม่ให้ query ของ log ถูกจับซ้ำ
+_writing = ContextVar("clinic_slowlog_writing", default=False)
+
+_PLACEHOLDER_LIST_RE = re.compile(r"\bIN\s*\(\s*%s(?:\s*,\s*%s)*\s*\)", re.IGNORECASE)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def is_writing():
+    """กำลังเขียน SlowQuery อยู่หรือไม่ (metrics ไม่นับ query เหล่านี้)"""
+    return _writing.get()
+
+
+def fingerprint(sql):
+    """SQL ที่ต่างกันแค่ค่าคงที่หรือจำนวนค่าใน IN (...) ได้ fingerprint เดียวกัน"""
+    normalized = _PLACEHOLDER_LIST_RE.sub("IN (...)", sql)
+    normalized = _STRING_RE.sub("?", normalized)
+    normalized = _NUMBER_RE.sub("?", normalized)
+    normalized = _SPACE_RE.sub(" ", normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def _calling_frame():
+    """frame ล่าสุดในโค้ดของ clinic ที่สั่ง query นี้"""
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(CLINIC_DIR) and os.path.basename(frame.filename) not in WRAPPER_FILES:
+            return f"clinic/{frame.filename[len(CLINIC_DIR):]}:{frame.lineno} in {frame.name}"
+    return ""
+
+
+class SlowQueryRecorder:
+    """execute_wrapper: จับเวลาทุก query แล้วจดเฉพาะที่เกินเกณฑ์"""
+
+    def __init__(self, threshold_ms):
+        self.threshold_ms = threshold_ms
+        self.entries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if _writing.get():
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= self.threshold_ms:
+                self.entries.append({
+                    "alias": context["connection"].alias,
+                    "sql": sql,
+                    "params": None if many else params,
+                    "ms": elapsed_ms,
+                    "frame": _calling_frame(),
+                })
+
+
+def _explain(alias, sql, params):
+    connection = connections[alias]
+    if connection.vendor != "postgresql" or params is None:
+        return None
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        # EXPLAIN เฉย ๆ ไม่ได้รันคำสั่งจริง savepoint กันกรณี query เดิมใช้ซ้ำไม่ได้
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            return cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning("Could not EXPLAIN slow query", exc_info=True)
+        return None
+
+
+def _prune():
+    limit = getattr(settings, "CLINIC_SLOW_QUERY_MAX_ROWS", 500)
+    stale = SlowQuery.objects.order_by("-last_seen").values_list("pk", flat=True)[limit:]
+    SlowQuery.objects.filter(pk__in=list(stale)).delete()
+
+
+def _bump(fp, entry, view, now):
+    return SlowQuery.objects.filter(fingerprint=fp).update(
+        count=F("count") + 1,
+        total_ms=F("total_ms") + entry["ms"],
+        max_ms=Greatest("max_ms", entry["ms"]),
+        last_seen=now,
+        view=view,
+        frame=entry["frame"],
+    )
+
+
+def save(entries, view=""):
+    token = _writing.set(True)
+    try:
+        now = timezone.now()
+        for entry in entries:
+            fp = fingerprint(entry["sql"])
+            logger.warning("Slow query %.0f ms in %s (%s): %s", entry["ms"], view, entry["frame"], entry["sql"][:500])
+            if _bump(fp, entry, view, now):
+                continue
+            try:
+                with transaction.atomic():
+                    SlowQuery.objects.create(
+                        fingerprint=fp,
+                        sql=entry["sql"],
+                        sample_params=repr(entry["params"])[:1000],
+                        view=view,
+                        frame=entry["frame"],
+                        total_ms=entry["ms"],
+                        max_ms=entry["ms"],
+                        plan=_explain(entry["alias"], entry["sql"], entry["params"]),
+                        first_seen=now,
+                        last_seen=now,
+                    )
+            except IntegrityError:
+                # อีก worker สร้าง fingerprint นี้ไปพร้อมกัน นับรวมเข้าแถวของเขา
+                _bump(fp, entry, view, now)
+                continue
+            _prune()
+    except DatabaseError:
+        logger.exception("Could not save slow query log")
+    finally:
+        _writing.reset(token)
+
+
+class SlowQueryMiddleware:
+    """เปิด recorder ต่อคำขอ ปิดได้ด้วย CLINIC_SLOW_QUERY_MS = None"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = getattr(settings, "CLINIC_SLOW_QUERY_MS", None)
+        if threshold is None:
+            return self.get_response(request)
+
+        recorder = SlowQueryRecorder(threshold)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        if recorder.entries:
+            match = request.resolver_match
+            save(recorder.entries, match.view_name if match else request.path)
+        return response
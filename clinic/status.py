@@ -0,0 +1,152 @@
+# clinic/status.py
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import audit, waitlist
+from .models import Appointment
+from .signals import appointments_changed
+
+STATUS_VALUES = dict(Appointment.STATUS_CHOICES)
+
+# สถานะปลายทาง -> สถานะต้นทางที่อนุญาต
+# (no_show -> completed ไว้แก้กรณีคนไข้มาสายหลังระบบปิดนัดไปแล้ว)
+ALLOWED_TRANSITIONS = {
+    "scheduled": (),
+    "confirmed": ("scheduled",),
+    "completed": ("scheduled", "confirmed", "no_show"),
+    "cancelled": ("scheduled", "confirmed"),
+    "no_show": ("scheduled", "confirmed"),
+}
+
+
+# สถานะที่นัดใหม่เริ่มได้ (ตอนสร้างจากฟอร์มของคลินิก)
+INITIAL_STATUSES = ("scheduled", "confirmed")
+
+
+def allowed_targets(old_status):
+    """สถานะที่เลือกได้เมื่อสถานะปัจจุบันเป็น old_status (รวมตัวเอง) None = นัดใหม่"""
+    if old_status is None:
+        return INITIAL_STATUSES
+    return (old_status,) + tuple(
+        status for status, sources in ALLOWED_TRANSITIONS.items() if old_status in sources
+    )
+
+
+def allowed_sources(new_status):
+    if new_status not in STATUS_VALUES:
+        raise ValueError(f"Unknown status: {new_status}")
+    return ALLOWED_TRANSITIONS[new_status]
+
+
+def can_transition(old_status, new_status):
+    return old_status in allowed_sources(new_status)
+
+
+def transition(pk, new_status, condition=None):
+    """
+    เปลี่ยนสถานะนัดหมายด้วย UPDATE ... WHERE id=%s AND status IN (...) (ดู _conditional_update)
+    สถานะเดิมที่บันทึกใน audit มาจากแถวที่ถูกเปลี่ยนจริง
+    condition (Q) ใช้เพิ่มเงื่อนไข เช่น เจ้าของนัด
+    คืนค่า True ถ้ามีแถวถูกเปลี่ยนจริง
+    """
+    sources = allowed_sources(new_status)
+    qs = Appointment.objects.filter(pk=pk, status__in=sources)
+    if condition is not None:
+        qs = qs.filter(condition)
+    with transaction.atomic():
+        updated = _conditional_update(qs, new_status)
+        if updated:
+            audit.record(pk, "status", updated[pk], new_status)
+            transaction.on_commit(lambda: appointments_changed.send(sender=Appointment))
+            if new_status == "cancelled":
+                waitlist.enqueue(updated)
+    return bool(updated)
+
+
+def _conditional_update(queryset, new_status):
+    """
+    เปลี่ยนสถานะแถวใน queryset (ที่กรองสถานะต้นทางไว้แล้ว) คืนค่า {id: สถานะเดิม} ของแถวที่เปลี่ยนจริง
+    PostgreSQL: คำสั่งเดียว CTE ล็อกแถว (FOR UPDATE ตรวจเงื่อนไขซ้ำกับแถวล่าสุด) แล้ว UPDATE ... RETURNING สถานะเดิม
+    ฐานข้อมูลอื่น: SELECT แล้ว UPDATE ใน transaction เดียวกัน
+    ต้องเรียกภายใน transaction.atomic()
+    """
+    now = timezone.now()
+    if connection.vendor != "postgresql":
+        old = dict(queryset.order_by().values_list("pk", "status"))
+        if old:
+            Appointment.objects.filter(pk__in=old).update(
+                status=new_status, updated_at=now, version=F("version") + 1
+            )
+        return old
+
+    table = connection.ops.quote_name(Appointment._meta.db_table)
+    locked = queryset.order_by().select_for_update(of=("self",)).values_list("pk", "status")
+    select_sql, params = locked.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH old (id, status) AS ({select_sql}) "
+            f"UPDATE {table} SET status = %s, updated_at = %s, version = {table}.version + 1 "
+            f"FROM old WHERE {table}.id = old.id RETURNING {table}.id, old.status",
+            (*params, new_status, now),
+        )
+        return dict(cursor.fetchall())
+
+
+def bulk_set_status(ids, new_status):
+    """
+    เปลี่ยนสถานะนัดหมายหลายรายการด้วย UPDATE เดียว (เงื่อนไขสถานะต้นทางอยู่ใน WHERE)
+    คืนค่า dict {id: "updated" | "unchanged" | "not_allowed" | "not_found"}
+    """
+    sources = allowed_sources(new_status)
+
+    ids = {int(pk) for pk in ids}
+    with transaction.atomic():
+        updated = _conditional_update(Appointment.objects.filter(pk__in=ids, status__in=sources), new_status)
+        for pk, old_status in updated.items():
+            audit.record(pk, "status", old_status, new_status)
+        if updated:
+            transaction.on_commit(lambda: appointments_changed.send(sender=Appointment))
+        if new_status == "cancelled":
+            waitlist.enqueue(updated)
+
+    # แถวที่ไม่เปลี่ยน: อ่านสถานะปัจจุบันเพื่อบอกเหตุผล (เฉพาะเมื่อมี)
+    rest = ids - updated.keys()
+    current = dict(Appointment.objects.filter(pk__in=rest).order_by().values_list("pk", "status")) if rest else {}
+    outcomes = {}
+    for pk in sorted(ids):
+        if pk in updated:
+            outcomes[pk] = "updated"
+        elif pk not in current:
+            outcomes[pk] = "not_found"
+        elif current[pk] == new_status:
+            outcomes[pk] = "unchanged"
+        else:
+            outcomes[pk] = "not_allowed"
+    return outcomes
+
+
+def mark_past_due_no_show(cutoff, batch_size=500):
+    """
+    ปิดนัดที่เลยเวลา cutoff แล้วยังเป็น scheduled/confirmed ให้เป็น no_show
+    ทำทีละ batch_size แถว เพื่อไม่ให้ UPDATE ใหญ่ล็อกตารางนาน
+    """
+    sources = allowed_sources("no_show")
+    past_due = Appointment.objects.filter(status__in=sources).filter(
+        Q(appointment_date__lt=cutoff.date())
+        | Q(appointment_date=cutoff.date(), start_time__lt=cutoff.time())
+    ).order_by()
+
+    total = 0
+    while True:
+        ids = list(past_due.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            if total:
+                appointments_changed.send(sender=Appointment)
+            return total
+        with audit.buffered(), transaction.atomic():
+            # แถวที่ถูกเปลี่ยนสถานะไปก่อนระหว่างนั้นไม่ถูกแก้และไม่มีเหตุการณ์
+            updated = _conditional_update(Appointment.objects.filter(pk__in=ids, status__in=sources), "no_show")
+            for pk, old_status in updated.items():
+                audit.record(pk, "status", old_status, "no_show")
+        total += len(updated)
@@ -0,0 +1,13 @@
+# clinic/templatetags/idempotency.py
+from django import template
+from django.utils.html import format_html
+
+from clinic.idempotency import FIELD, new_key
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_field():
+    """hidden input ที่มี key ใหม่ทุกครั้งที่ render ฟอร์ม (ส่งซ้ำจากหน้าเดิม = key เดิม)"""
+    return format_html('<input type="hidden" name="{}" value="{}">', FIELD, new_key())
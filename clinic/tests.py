@@ -1,3 +1,1318 @@
-from django.test import TestCase
+import subprocess
+import tempfile
+from contextlib import ExitStack
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core import mail
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+
+from .assignment import book_any_dentist
+from .db_routers import PIN_COOKIE, REPLICA_ALIAS, ReplicaRouter, read_from_replica
+from .management.commands.load_booking import Command as LoadBookingCommand
+from . import audit
+from .dedupe import MergeRefused, find_duplicates, merge_candidate
+from .demographics import summary
+from .views import SLOT_TAKEN, object_detail
+from .forms import (
+    TW_INPUT_CLASS, AppointmentForm, AppointmentSeriesForm, DentistForm, PatientAppointmentForm, PatientForm,
+    VersionConflict, WaitlistEntryForm,
+)
+from .idempotency import _fingerprint, _slot, new_key
+from .jobs import waitlist_backfill
+from .occupancy import occupancy
+from .partitions import ensure_partitions, monthly_partitions, partition_name
+from .models import (
+    Appointment, AppointmentEvent, Dentist, DuplicateCandidate, FreedSlot, IdempotencyKey, Patient,
+    PatientClinicalRecord, Service, SlowQuery, User, WaitlistEntry, WaitlistOffer,
+)
+from . import reports, slowlog, warmup
+from prometheus_client import REGISTRY
+from .reminders import send_appointment_reminders
+from .schedule import build_calendar
+from .series import MAX_OCCURRENCES, book_series, find_conflicts, occurrences
+from .scheduler import JOBS, LEADER_LOCK_KEY, Job, leader_lock, run_due_jobs
+from .status import allowed_targets, bulk_set_status, mark_past_due_no_show, transition
+from .waitlist import PatientBusy, accept_offer, offer_freed_slots
+
+
+@override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+class AppointmentReminderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        cls.dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        cls.service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        cls.patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222", email="malee@example.com",
+        )
+
+    def _appointment(self, start, **kwargs):
+        kwargs.setdefault("appointment_date", self.tomorrow)
+        return Appointment.objects.create(
+            patient=self.patient, dentist=self.dentist, service=self.service,
+            start_time=start, **kwargs
+        )
+
+    def test_sends_tomorrows_reminders_over_one_connection(self):
+        self._appointment(time(9, 0))
+        self._appointment(time(10, 0), status="confirmed")
+        self._appointment(time(11, 0), status="cancelled")
+        self._appointment(time(9, 0), appointment_date=self.tomorrow + timedelta(days=1))
+
+        with mock.patch("clinic.reminders.get_connection", wraps=mail.get_connection) as get_connection:
+            sent = send_appointment_reminders(batch_size=1)
+
+        self.assertEqual(sent, 2)
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ["malee@example.com"])
+        self.assertIn("Malee", mail.outbox[0].body)
+        self.assertIn("09:00", mail.outbox[0].subject)
+
+    def test_rerun_is_idempotent(self):
+        appt = self._appointment(time(9, 0))
+
+        self.assertEqual(send_appointment_reminders(), 1)
+        self.assertEqual(send_appointment_reminders(), 0)
+
+        self.assertEqual(len(mail.outbox), 1)
+        appt.refresh_from_db()
+        self.assertIsNotNone(appt.reminder_sent_at)
+
+    def test_skips_patients_without_email(self):
+        self.patient.email = ""
+        self.patient.save()
+        self._appointment(time(9, 0))
+
+        self.assertEqual(send_appointment_reminders(), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+class DemographicsTests(TestCase):
+    def test_age_bands_use_birthday_cutoffs_in_one_query(self):
+        today = date(2024, 2, 29)
+        births = [
+            date(2006, 2, 28), date(2006, 3, 1),  # วันเกิดอายุ 18 พอดี / ขาดไปหนึ่งวัน
+            date(1959, 2, 28), date(1959, 3, 1),  # 65 ปี ในปีที่ไม่มี 29 ก.พ.
+            date(2020, 1, 1),
+        ]
+        for i, born in enumerate(births):
+            Patient.objects.create(
+                name=f"P{i}", gender="MF"[i % 2], date_of_birth=born,
+                phone="0822222222",
+            )
+
+        with self.assertNumQueries(1):
+            result = summary(today)
+
+        bands = {row["band"]: row["total"] for row in result["age_bands"]}
+        self.assertEqual(bands, {"0-12": 1, "13-17": 1, "18-34": 1, "35-49": 0, "50-64": 1, "65+": 1})
+        self.assertEqual(result["gender"], {"M": 3, "F": 2})
+        self.assertEqual(result["total"], 5)
+
+
+class VersionedFormTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222", email="malee@example.com",
+        )
+        PatientClinicalRecord.objects.create(patient=self.patient, address="Ubon")
+
+    def _data(self, **changes):
+        data = {
+            "name": "Malee", "gender": "F", "date_of_birth": "1990-05-01",
+            "phone": "0822222222", "email": "malee@example.com", "address": "Ubon", "version": "1",
+        }
+        data.update(changes)
+        return data
+
+    def test_stale_version_reports_diff_and_resubmit_overwrites(self):
+        Patient.objects.filter(pk=self.patient.pk).update(phone="0899999999", version=2)
+        form = PatientForm(self._data(address="Khon Kaen"), instance=Patient.objects.get(pk=self.patient.pk))
+
+        self.assertFalse(form.is_valid())
+        self.assertTrue(any("0899999999" in error for error in form.non_field_errors()))
+        self.assertEqual(form["version"].value(), 2)
+
+        form = PatientForm(form.data, instance=Patient.objects.get(pk=self.patient.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.patient.refresh_from_db()
+        self.assertEqual((self.patient.clinical.address, self.patient.version), ("Khon Kaen", 3))
+
+    def test_concurrent_save_writes_only_changed_fields_or_conflicts(self):
+        first = PatientForm(self._data(address="Khon Kaen"), instance=Patient.objects.get(pk=self.patient.pk))
+        second = PatientForm(self._data(phone="0811111111"), instance=Patient.objects.get(pk=self.patient.pk))
+        self.assertTrue(first.is_valid() and second.is_valid())
+
+        first.save()
+        with self.assertRaises(VersionConflict):
+            second.save()
+
+        self.patient.refresh_from_db()
+        self.assertEqual(
+            (self.patient.clinical.address, self.patient.phone, self.patient.version), ("Khon Kaen", "0822222222", 2)
+        )
+        self.assertTrue(second.non_field_errors())
+
+
+class StatusTransitionTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        self.dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        self.service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        self.patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222",
+        )
+
+    def _appointment(self, status="scheduled", hour=9):
+        return Appointment.objects.create(
+            patient=self.patient, dentist=self.dentist, service=self.service,
+            appointment_date=date(2026, 10, 5), start_time=time(hour, 0), status=status,
+        )
+
+    def test_transition_table(self):
+        self.assertEqual(allowed_targets(None), ("scheduled", "confirmed"))
+        self.assertEqual(set(allowed_targets("scheduled")), {"scheduled", "confirmed", "completed", "cancelled", "no_show"})
+        self.assertEqual(allowed_targets("cancelled"), ("cancelled",))
+        self.assertEqual(allowed_targets("no_show"), ("no_show", "completed"))
+
+    def test_transition_applies_only_from_allowed_status(self):
+        appt = self._appointment("cancelled")
+        self.assertFalse(transition(appt.pk, "completed"))
+        appt.refresh_from_db()
+        self.assertEqual((appt.status, appt.version), ("cancelled", 1))
+
+        appt = self._appointment("scheduled", hour=10)
+        self.assertTrue(transition(appt.pk, "confirmed"))
+        self.assertFalse(transition(appt.pk, "confirmed"))
+        appt.refresh_from_db()
+        self.assertEqual((appt.status, appt.version), ("confirmed", 2))
+
+    def test_bulk_set_status_reports_outcome_per_id(self):
+        scheduled, cancelled, completed = (
+            self._appointment("scheduled", 9), self._appointment("cancelled", 10), self._appointment("completed", 11)
+        )
+        outcomes = bulk_set_status([scheduled.pk, cancelled.pk, completed.pk, 999999], "completed")
+        self.assertEqual(outcomes, {
+            scheduled.pk: "updated", cancelled.pk: "not_allowed", completed.pk: "unchanged", 999999: "not_found",
+        })
+
+    def test_audit_records_real_previous_status(self):
+        confirmed = self._appointment("confirmed", 9)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(transition(confirmed.pk, "completed"))
+        event = AppointmentEvent.objects.get(appointment_id=confirmed.pk)
+        self.assertEqual((event.old_status, event.new_status), ("confirmed", "completed"))
+
+    def test_no_show_sweep_audits_only_changed_rows(self):
+        scheduled, confirmed, cancelled = (
+            self._appointment("scheduled", 9), self._appointment("confirmed", 10), self._appointment("cancelled", 11)
+        )
+        cutoff = timezone.make_aware(datetime(2026, 10, 5, 12, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(mark_past_due_no_show(cutoff), 2)
+        events = dict(AppointmentEvent.objects.values_list("appointment_id", "old_status"))
+        self.assertEqual(events, {scheduled.pk: "scheduled", confirmed.pk: "confirmed"})
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, "cancelled")
+
+    def test_rolled_back_work_leaves_no_audit_event(self):
+        appt = self._appointment("scheduled")
+        with self.captureOnCommitCallbacks(execute=True), audit.buffered():
+            try:
+                with transaction.atomic():
+                    transition(appt.pk, "cancelled")
+                    raise RuntimeError("view failed after the update")
+            except RuntimeError:
+                pass
+        appt.refresh_from_db()
+        self.assertEqual(appt.status, "scheduled")
+        self.assertFalse(AppointmentEvent.objects.exists())
+
+    def test_bulk_status_endpoint_validates_json_body(self):
+        appt = self._appointment("scheduled")
+        self.client.force_login(self.admin)
+        url = reverse("appointment_bulk_status")
+
+        for body in ([1, 2], {"ids": "1", "status": "completed"}, {"ids": [True], "status": "completed"},
+                     {"ids": [appt.pk], "status": "done"}):
+            response = self.client.post(url, body, content_type="application/json")
+            self.assertEqual(response.status_code, 400, body)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"ids": [appt.pk], "status": "completed"}, content_type="application/json")
+        self.assertEqual(response.json(), {"success": True, "results": {str(appt.pk): "updated"}})
+        event = AppointmentEvent.objects.get(appointment_id=appt.pk, action="status")
+        self.assertEqual((event.old_status, event.new_status), ("scheduled", "completed"))
+
+    def test_edit_form_rejects_illegal_status_change(self):
+        appt = self._appointment("cancelled")
+        self.client.force_login(self.admin)
+        data = {
+            "patient": self.patient.pk, "dentist": self.dentist.pk, "service": self.service.pk,
+            "appointment_date": "2026-10-05", "start_time": "09:00", "status": "completed",
+            "created_by": self.admin.pk, "version": appt.version, "notes": "",
+        }
+
+        response = self.client.post(reverse("appointment_edit", args=[appt.pk]), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["form"].errors), ["status"])
+        appt.refresh_from_db()
+        self.assertEqual(appt.status, "cancelled")
+
+        appt = self._appointment("scheduled", hour=10)
+        form = AppointmentForm({**data, "start_time": "10:00", "status": "confirmed", "version": 1}, instance=appt)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        appt.refresh_from_db()
+        self.assertEqual(appt.status, "confirmed")
+
+    def test_status_endpoints_are_admin_only(self):
+        appt = self._appointment("confirmed")
+        other = User.objects.create_user("somsri", "somsri@example.com", "pw", role="patient")
+        self.client.force_login(other)
+
+        response = self.client.post(reverse("appointment_complete", args=[appt.pk]))
+        self.assertRedirects(response, reverse("patient_dashboard"), fetch_redirect_response=False)
+        response = self.client.post(reverse("appointment_update_status", args=[appt.pk]), {"status": "cancelled"})
+        self.assertRedirects(response, reverse("patient_dashboard"), fetch_redirect_response=False)
+        appt.refresh_from_db()
+        self.assertEqual(appt.status, "confirmed")
+        self.assertFalse(AppointmentEvent.objects.exists())
+
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("appointment_complete", args=[appt.pk]))
+        self.assertEqual(response.json(), {"success": True})
+        appt.refresh_from_db()
+        self.assertEqual(appt.status, "completed")
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("malee", "malee@example.com", "pw", role="patient")
+        Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222", email="malee@example.com",
+        )
+        self.dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        self.service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        self.client.force_login(self.user)
+
+    def test_repeated_booking_post_replays_first_response(self):
+        data = {
+            "dentist": self.dentist.pk, "service": self.service.pk, "start_time": "10:00", "notes": "",
+            "appointment_date": (timezone.localdate() + timedelta(days=3)).isoformat(),
+            "idempotency_key": new_key(),
+        }
+        url = reverse("appointments_patient")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(url, data)
+            second = self.client.post(url, data)
+
+        self.assertEqual((first.status_code, second.status_code), (302, 302))
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(AppointmentEvent.objects.filter(action="created").count(), 1)
+
+        data["start_time"] = "11:00"
+        self.assertEqual(self.client.post(url, data).status_code, 422)
+
+    @override_settings(CLINIC_IDEMPOTENCY_WAIT=0.2)
+    def test_request_gives_up_while_first_request_is_in_flight(self):
+        url = reverse("appointments_patient")
+        data = {
+            "dentist": self.dentist.pk, "service": self.service.pk, "start_time": "10:00", "notes": "",
+            "appointment_date": (timezone.localdate() + timedelta(days=3)).isoformat(),
+            "idempotency_key": new_key(),
+        }
+        # คำขอแรกจองแถวไว้แล้วและยังทำไม่เสร็จ (status ว่าง)
+        first = RequestFactory().post(url, data)
+        first.user = self.user
+        IdempotencyKey.objects.create(slot=_slot(first, data["idempotency_key"]), fingerprint=_fingerprint(first))
+
+        response = self.client.post(url, data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(Appointment.objects.count(), 0)
+
+
+class BookingRaceTests(TestCase):
+    """ช่วงเวลาถูกจองไปหลังฟอร์มตรวจผ่านแล้ว: unique_active_dentist_slot ต้องไม่กลายเป็น 500"""
+
+    def setUp(self):
+        self.dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        self.service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        self.day = timezone.localdate() + timedelta(days=3)
+        other = Patient.objects.create(name="Somsri", gender="F", date_of_birth=date(1985, 1, 1), phone="0833333333")
+        Appointment.objects.create(
+            patient=other, dentist=self.dentist, service=self.service, appointment_date=self.day, start_time=time(10, 0),
+        )
+        self.data = {
+            "dentist": self.dentist.pk, "service": self.service.pk, "start_time": "10:00", "notes": "",
+            "appointment_date": self.day.isoformat(),
+        }
+
+    def _checks_pass(self, form_class):
+        # จำลองว่าอีกคำขอ insert เข้ามาหลังฟอร์มตรวจเสร็จ
+        stack = ExitStack()
+        stack.enter_context(mock.patch.object(form_class, "clean", lambda form: form.cleaned_data))
+        stack.enter_context(mock.patch.object(Appointment, "validate_constraints"))
+        return stack
+
+    def test_patient_booking_reports_taken_slot(self):
+        user = User.objects.create_user("malee", "malee@example.com", "pw", role="patient")
+        Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222", email="malee@example.com",
+        )
+        self.client.force_login(user)
+        with self._checks_pass(PatientAppointmentForm):
+            response = self.client.post(reverse("appointments_patient"), self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([str(m) for m in response.context["messages"]], [SLOT_TAKEN])
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertFalse(AppointmentEvent.objects.exists())
+
+    def test_admin_booking_reports_taken_slot(self):
+        admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        self.client.force_login(admin)
+        patient = Patient.objects.create(name="Malee", gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222")
+        with self._checks_pass(AppointmentForm):
+            response = self.client.post(
+                reverse("appointment_add"), {**self.data, "patient": patient.pk, "status": "scheduled", "created_by": admin.pk},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["form"].non_field_errors(), [SLOT_TAKEN])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class OccupancyTests(TestCase):
+    def test_bins_intervals_into_hour_of_week(self):
+        dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222",
+        )
+        monday = date(2026, 10, 5)
+        for start, end, status in [
+            (time(9, 0), None, "scheduled"),  # ไม่มีเวลาจบ ใช้ระยะบริการ 30 นาที
+            (time(9, 15), time(10, 15), "confirmed"),
+            (time(9, 0), time(12, 0), "cancelled"),
+        ]:
+            Appointment.objects.create(
+                patient=patient, dentist=dentist, service=service,
+                appointment_date=monday, start_time=start, end_time=end, status=status,
+            )
+
+        result = occupancy(date(2026, 10, 1), date(2026, 10, 31))
+
+        self.assertEqual(result["dentists"], [{"id": dentist.pk, "name": "Somchai"}])
+        self.assertEqual(result["available"][9], 4 * 60)  # วันจันทร์ในเดือนนี้มี 4 วัน
+        self.assertEqual(result["booked"][0, 9], 75)
+        self.assertEqual(result["booked"][0, 10], 15)
+        self.assertEqual(result["overlap"][0, 9], 15)
+        self.assertEqual(result["booked"].sum(), 90)
+
+
+class AnyDentistBookingTests(TestCase):
+    def test_picks_free_dentist_with_lowest_load(self):
+        busy, loaded, idle = [
+            Dentist.objects.create(
+                name=name, specialization="General", phone="0811111111",
+                email=f"{name}@example.com", license_number=name,
+            )
+            for name in ("Anan", "Boon", "Chai")
+        ]
+        Dentist.objects.create(
+            name="Daeng", specialization="General", phone="0811111111",
+            email="daeng@example.com", license_number="Daeng", is_active=False,
+        )
+        service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222",
+        )
+        day = date(2026, 10, 5)
+        # Anan ติดนัด 09:45-10:15 ซึ่งทับ 10:00, Boon มีนัดอื่นในวันเดียวกัน
+        Appointment.objects.create(patient=patient, dentist=busy, service=service, appointment_date=day, start_time=time(9, 45))
+        Appointment.objects.create(patient=patient, dentist=loaded, service=service, appointment_date=day, start_time=time(13, 0))
+
+        first = book_any_dentist(patient, service, day, time(10, 0))
+        second = book_any_dentist(patient, service, day, time(10, 0))
+        third = book_any_dentist(patient, service, day, time(10, 0))
+
+        self.assertEqual((first.dentist, second.dentist, third), (idle, loaded, None))
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222", email="malee@example.com",
+        )
+        self.patient.photo.save("malee.png", ContentFile(b"0123456789" * 10))
+        self.owner = User.objects.create_user("malee", "malee@example.com", "pw", role="patient")
+        self.other = User.objects.create_user("somsri", "somsri@example.com", "pw", role="patient")
+
+    def test_only_owner_or_admin_can_fetch_photo(self):
+        url = self.patient.photo.url
+        admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        for user, expected in ((admin, 200), (self.owner, 200), (self.other, 404)):
+            self.client.force_login(user)
+            self.assertEqual(self.client.get(url).status_code, expected, user.username)
+
+    def test_range_request_and_offload(self):
+        self.client.force_login(self.owner)
+        url = self.patient.photo.url
+
+        response = self.client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+        with override_settings(CLINIC_MEDIA_SENDFILE="nginx"):
+            response = self.client.get(url)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + self.patient.photo.name)
+        self.assertEqual(response.content, b"")
+
+
+class DuplicatePatientTests(TestCase):
+    def test_finds_and_merges_duplicate(self):
+        original = Patient.objects.create(
+            name="นางสาว สมศรี ใจดี", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222", email="somsri@example.com",
+        )
+        duplicate = Patient.objects.create(
+            name="สมศรี ใจดี", gender="F", date_of_birth=date(1990, 5, 1), phone="+66822222222",
+        )
+        PatientClinicalRecord.objects.create(patient=duplicate, address="Bangkok", allergy="penicillin")
+        # ชื่อเดียวกันแต่เบอร์และวันเกิดต่างกัน ไม่นับเป็นคู่ซ้ำ
+        Patient.objects.create(name="สมศรี ใจดี", gender="F", date_of_birth=date(1961, 2, 3), phone="0899999999")
+        dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        appt = Appointment.objects.create(
+            patient=duplicate, dentist=dentist, service=service,
+            appointment_date=date(2026, 10, 5), start_time=time(9, 0),
+        )
+
+        self.assertEqual(find_duplicates()["candidates"], 1)
+        candidate = DuplicateCandidate.objects.get()
+        self.assertEqual((candidate.patient_a, candidate.patient_b), (original, duplicate))
+
+        keep, moved = merge_candidate(candidate)
+
+        self.assertEqual((keep, moved), (original, 1))
+        self.assertFalse(Patient.objects.filter(pk=duplicate.pk).exists())
+        appt.refresh_from_db()
+        self.assertEqual(appt.patient, original)
+        self.assertEqual(original.clinical.allergy, "penicillin")
+        self.assertFalse(DuplicateCandidate.objects.exists())
+
+    def test_refuses_to_merge_rows_linked_to_different_accounts(self):
+        first = Patient.objects.create(
+            name="สมศรี ใจดี", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222", email="somsri@example.com",
+        )
+        second = Patient.objects.create(
+            name="สมศรี ใจดี", gender="F", date_of_birth=date(1990, 5, 1),
+            phone="0822222222", email="somsri.j@example.com",
+        )
+        # ชื่อ เบอร์ วันเกิดตรงกันหมด คะแนนยังถึงเกณฑ์แม้อีเมลต่างกัน
+        find_duplicates()
+        candidate = DuplicateCandidate.objects.get()
+        self.assertEqual(candidate.evidence["email"], False)
+
+        with self.assertRaises(MergeRefused):
+            merge_candidate(candidate)
+
+        self.assertEqual(Patient.objects.filter(pk__in=[first.pk, second.pk]).count(), 2)
+        self.assertTrue(DuplicateCandidate.objects.filter(pk=candidate.pk, status="pending").exists())
+
+
+class WaitlistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        self.dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        self.service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        self.owner, self.waiting, self.next = (
+            Patient.objects.create(
+                name=name, gender="F", date_of_birth=date(1990, 5, 1), phone=f"08{i:08d}", email=f"{name}@example.com",
+            )
+            for i, name in enumerate(("malee", "suda", "nida"))
+        )
+
+    def _appointment(self, day=date(2040, 3, 5), hour=10, status="scheduled", patient=None):
+        return Appointment.objects.create(
+            patient=patient or self.owner, dentist=self.dentist, service=self.service,
+            appointment_date=day, start_time=time(hour, 0), status=status,
+        )
+
+    def _wait(self, patient):
+        return WaitlistEntry.objects.create(
+            patient=patient, service=self.service, earliest_date=date(2040, 3, 1), latest_date=date(2040, 3, 31),
+        )
+
+    def test_cancel_queues_slot_for_backfill_job(self):
+        entry = self._wait(self.waiting)
+        appt = self._appointment()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(transition(appt.pk, "cancelled"))
+        # การยกเลิกแค่เข้าคิว ไม่จับคู่หรือส่งอีเมลใน request
+        self.assertEqual(list(FreedSlot.objects.values_list("appointment_id", flat=True)), [appt.pk])
+        self.assertFalse(WaitlistOffer.objects.exists())
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(waitlist_backfill(), {"expired": 0, "offered": 1})
+        self.assertFalse(FreedSlot.objects.exists())
+        offer = WaitlistOffer.objects.get()
+        self.assertEqual((offer.appointment_id, offer.entry_id, offer.status), (appt.pk, entry.pk, "held"))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, "offered")
+        self.assertEqual(mail.outbox[0].to, ["suda@example.com"])
+
+    def test_skips_started_slots_and_caps_hold_at_start(self):
+        self._wait(self.waiting)
+        self._wait(self.next)
+        started = self._appointment(day=date(2040, 3, 1), hour=8, status="cancelled")
+        soon = self._appointment(day=date(2040, 3, 1), hour=10, status="cancelled")
+        now = timezone.make_aware(datetime(2040, 3, 1, 9, 30))
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            self.assertEqual(offer_freed_slots(), 1)
+
+        offer = WaitlistOffer.objects.get()
+        self.assertEqual(offer.appointment_id, soon.pk)
+        self.assertNotEqual(offer.appointment_id, started.pk)
+        self.assertEqual(offer.expires_at, timezone.make_aware(datetime(2040, 3, 1, 10, 0)))
+
+    def test_matching_uses_fixed_number_of_queries(self):
+        for hour in range(8, 13):
+            self._appointment(hour=hour, status="cancelled")
+        # ช่องว่าง + คนไข้ที่รอ (ไม่มีใครรอ จึงไม่อ่านข้อเสนอเดิม)
+        with self.assertNumQueries(2):
+            self.assertEqual(offer_freed_slots(), 0)
+
+    def test_accept_refuses_when_patient_already_booked(self):
+        self._wait(self.waiting)
+        self._wait(self.next)
+        other = Dentist.objects.create(
+            name="Wichai", specialization="General", phone="0833333333",
+            email="other@example.com", license_number="D-002",
+        )
+        Appointment.objects.create(
+            patient=self.waiting, dentist=other, service=self.service,
+            appointment_date=date(2040, 3, 5), start_time=time(10, 15),
+        )
+        appt = self._appointment()
+        transition(appt.pk, "cancelled")
+        waitlist_backfill()
+        offer = WaitlistOffer.objects.get(entry__patient=self.waiting)
+
+        with self.assertRaises(PatientBusy):
+            accept_offer(offer, self.admin)
+
+        offer.refresh_from_db()
+        self.assertEqual(offer.status, "declined")
+        self.assertEqual(Appointment.objects.filter(patient=self.waiting).count(), 1)
+        # ช่องนี้กลับเข้าคิว และรอบถัดไปเสนอให้คนถัดไป
+        self.assertTrue(FreedSlot.objects.filter(appointment_id=appt.pk).exists())
+        waitlist_backfill()
+        self.assertEqual(WaitlistOffer.objects.get(status="held").entry.patient, self.next)
+
+
+class SchedulerLeaderTests(TestCase):
+    def test_stops_running_jobs_once_leadership_is_lost(self):
+        ran = []
+        checks = iter([True, False])
+        jobs = {name: Job(name, lambda name=name: ran.append(name), 60) for name in ("first", "second")}
+        with mock.patch.dict(JOBS, jobs, clear=True):
+            results = run_due_jobs(still_leader=lambda: next(checks))
+        self.assertEqual(ran, ["first"])
+        self.assertEqual(list(results), ["first"])
+
+    @skipUnless(connection.vendor == "postgresql", "advisory lock ใช้ได้เฉพาะ PostgreSQL")
+    def test_only_one_session_leads(self):
+        other = connections.create_connection("default")
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", [LEADER_LOCK_KEY])
+                self.assertTrue(cursor.fetchone()[0])
+            with leader_lock() as leadership:
+                self.assertFalse(leadership)
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [LEADER_LOCK_KEY])
+
+            with leader_lock() as leadership:
+                self.assertTrue(leadership)
+                self.assertTrue(leadership.still_leader())
+                # session ของ leader หลุด (lock หาย) แล้ว host อื่นชิงไปก่อน
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [LEADER_LOCK_KEY])
+                with other.cursor() as cursor:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", [LEADER_LOCK_KEY])
+                    self.assertTrue(cursor.fetchone()[0])
+                with self.assertLogs("clinic.scheduler", "WARNING"):
+                    self.assertFalse(leadership.still_leader())
+
+            # lock ว่าง: leader เดิมที่ต่อใหม่ชิงคืนได้ โดยไม่ถือซ้อนหลายชั้น
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [LEADER_LOCK_KEY])
+            with leader_lock() as leadership:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [LEADER_LOCK_KEY])
+                self.assertTrue(leadership.still_leader())
+                self.assertTrue(leadership.still_leader())
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", [LEADER_LOCK_KEY])
+                self.assertTrue(cursor.fetchone()[0])
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [LEADER_LOCK_KEY])
+        finally:
+            other.close()
+
+
+class LoadBookingCommandTests(TestCase):
+    @override_settings(DEBUG=False, CLINIC_SCRATCH_DATABASES=["clinic_scratch"])
+    def test_refuses_shared_database(self):
+        with mock.patch.dict(connection.settings_dict, {"NAME": "dental_clinic"}):
+            with self.assertRaisesMessage(CommandError, "Refusing"):
+                call_command("load_booking", patients=2, slots=1)
+        self.assertFalse(Dentist.objects.exists())
+
+    def test_cleanup_keeps_audit_history(self):
+        command = LoadBookingCommand()
+        fixture = command._create_fixture("loadtest-unit", patients=2, slots=1)
+        patient = Patient.objects.get(name="loadtest-unit-0")
+        appt = Appointment.objects.create(
+            patient=patient, dentist=fixture["dentists"][0], service=fixture["service"],
+            appointment_date=fixture["day"], start_time=fixture["times"][0],
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            audit.record(appt.pk, "created", new_status=appt.status)
+
+        command._cleanup(fixture)
+        self.assertFalse(Appointment.objects.filter(pk=appt.pk).exists())
+        self.assertFalse(Patient.objects.filter(name__startswith="loadtest-unit-").exists())
+        self.assertTrue(AppointmentEvent.objects.filter(appointment_id=appt.pk).exists())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ReportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        self.somchai, self.wichai = (
+            Dentist.objects.create(
+                name=name, specialization="General", phone="0811111111",
+                email=f"{name}@example.com", license_number=f"D-{name}",
+            )
+            for name in ("Somchai", "Wichai")
+        )
+        self.scaling = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        self.filling = Service.objects.create(name="Filling", price=1200, duration_minutes=60)
+        self.patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222",
+        )
+        rows = [
+            (self.somchai, self.scaling, date(2026, 10, 5), "completed"),
+            (self.somchai, self.scaling, date(2026, 10, 6), "completed"),
+            (self.somchai, self.scaling, date(2026, 10, 7), "cancelled"),
+            (self.somchai, self.filling, date(2026, 10, 8), "no_show"),
+            (self.wichai, self.filling, date(2026, 11, 2), "completed"),
+        ]
+        for dentist, service, day, status in rows:
+            Appointment.objects.create(
+                patient=self.patient, dentist=dentist, service=service,
+                appointment_date=day, start_time=time(9, 0), status=status,
+            )
+        self.start, self.end = date(2026, 10, 5), date(2026, 11, 7)
+
+    def test_dentist_report(self):
+        somchai, wichai = reports.dentist_report(self.start, self.end)
+        self.assertEqual((somchai["dentist"], somchai["visits"], somchai["revenue"]), ("Somchai", 2, 1600))
+        self.assertEqual(somchai["revenue_share"], Decimal("0.5714"))
+        # ยกเลิกไม่นับเวลาเก้าอี้: 30 + 30 + 60 นาที, 30 วันทำการ (จันทร์-เสาร์) x 480
+        self.assertEqual((somchai["booked_minutes"], somchai["available_minutes"]), (120, 30 * 480))
+        self.assertEqual((somchai["cancellation_rate"], somchai["no_show_rate"]), (0.25, 0.25))
+        self.assertEqual((wichai["dentist"], wichai["revenue"], wichai["appointments"]), ("Wichai", 1200, 1))
+
+    def test_service_and_period_reports(self):
+        services = reports.service_report(self.start, self.end)
+        self.assertEqual(
+            [(row["service"], row["visits"], row["revenue"]) for row in services],
+            [("Scaling", 2, 1600), ("Filling", 1, 1200)],
+        )
+        periods = reports.period_report(self.start, self.end, "month")
+        self.assertEqual([row["appointments"] for row in periods], [4, 1])
+        self.assertEqual([row["cumulative_revenue"] for row in periods], [1600, 2800])
+
+    def test_cached_report_follows_changes(self):
+        self.assertEqual(reports.get_report("services", self.start, self.end)[0]["visits"], 2)
+        Appointment.objects.filter(status="cancelled").update(status="completed")
+        self.assertEqual(reports.get_report("services", self.start, self.end)[0]["visits"], 2)
+        reports.invalidate()
+        self.assertEqual(reports.get_report("services", self.start, self.end)[0]["visits"], 3)
+
+    def test_csv_export_always_has_header(self):
+        self.client.force_login(self.admin)
+        url = reverse("reports_export", args=["services"])
+        response = self.client.get(url, {"start": "2026-10-01", "end": "2026-10-31"})
+        header, row = response.content.decode().splitlines()
+        self.assertEqual(header, "\ufeffservice_id,service,visits,revenue,revenue_share")
+        service_id, name, visits, revenue, share = row.split(",")
+        self.assertEqual((service_id, name, visits), (str(self.scaling.pk), "Scaling", "2"))
+        self.assertEqual((Decimal(revenue), Decimal(share)), (1600, 1))
+        for kind, columns in reports.COLUMNS.items():
+            response = self.client.get(
+                reverse("reports_export", args=[kind]), {"start": "2030-01-01", "end": "2030-01-31"},
+            )
+            self.assertEqual(response.content.decode(), "\ufeff" + ",".join(columns) + "\r\n")
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        self.appt = Appointment.objects.create(
+            patient=Patient.objects.create(
+                name="Malee", gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222",
+            ),
+            dentist=dentist, service=Service.objects.create(name="Scaling", price=800, duration_minutes=30),
+            appointment_date=date(2026, 10, 5), start_time=time(9, 0),
+        )
+
+    def test_router_sends_marked_reads_to_replica(self):
+        router = ReplicaRouter()
+        cache_entry = type("CacheEntry", (), {"_meta": mock.Mock(app_label="django_cache")})
+        with mock.patch.dict(settings.DATABASES, {REPLICA_ALIAS: settings.DATABASES["default"]}):
+            self.assertIsNone(router.db_for_read(Appointment))
+            with read_from_replica():
+                self.assertEqual(router.db_for_read(Appointment), REPLICA_ALIAS)
+                self.assertIsNone(router.db_for_read(cache_entry))
+                self.assertEqual(router.db_for_write(Appointment), "default")
+        with read_from_replica():
+            self.assertIsNone(router.db_for_read(Appointment))
+
+    def test_login_and_logout_do_not_pin(self):
+        response = self.client.post(reverse("login"), {"username": "admin", "password": "pw"})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        response = self.client.post(reverse("logout"))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_only_requests_that_write_pin(self):
+        self.client.force_login(self.admin)
+        url = reverse("appointment_update_status", args=[self.appt.pk])
+        response = self.client.post(url, {"status": "bogus"})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        response = self.client.post(url, {"status": "confirmed"})
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+
+class AppointmentSeriesTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        self.dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        self.other_dentist = Dentist.objects.create(
+            name="Wichai", specialization="General", phone="0833333333",
+            email="other@example.com", license_number="D-002",
+        )
+        self.service = Service.objects.create(name="Braces", price=1500, duration_minutes=30)
+        self.patient, self.other_patient = (
+            Patient.objects.create(name=name, gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222")
+            for name in ("Malee", "Suda")
+        )
+        self.template = Appointment(
+            patient=self.patient, dentist=self.dentist, service=self.service,
+            appointment_date=date(2026, 11, 2), start_time=time(9, 0), notes="",
+        )
+        self.dates = occurrences(date(2026, 11, 2), "weekly", count=3)
+
+    def test_occurrences(self):
+        self.assertEqual(self.dates, [date(2026, 11, 2), date(2026, 11, 9), date(2026, 11, 16)])
+        self.assertEqual(
+            occurrences(date(2026, 1, 31), "monthly", count=3),
+            [date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31)],
+        )
+        self.assertEqual(
+            occurrences(date(2026, 1, 1), "daily", interval=2, until=date(2026, 1, 6)),
+            [date(2026, 1, 1), date(2026, 1, 3), date(2026, 1, 5)],
+        )
+        self.assertEqual(len(occurrences(date(2026, 1, 1), "daily", until=date(2026, 12, 31))), MAX_OCCURRENCES)
+
+    def test_form_rejects_until_beyond_cap(self):
+        data = {
+            "patient": self.patient.pk, "dentist": self.dentist.pk, "service": self.service.pk,
+            "appointment_date": "2026-01-01", "start_time": "09:00", "frequency": "daily", "interval": 1,
+            "until": "2026-12-31",
+        }
+        form = AppointmentSeriesForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn(str(MAX_OCCURRENCES), form.non_field_errors()[0])
+        self.assertTrue(AppointmentSeriesForm({**data, "until": "2026-02-21"}).is_valid())
+
+    def test_find_conflicts_checks_dentist_and_patient(self):
+        # ทันตแพทย์คนเดิมคาบเกี่ยว, คนไข้คนเดิมกับทันตแพทย์อื่น, ยกเลิกแล้วไม่นับ, ต่อท้ายพอดีไม่ชน
+        Appointment.objects.create(
+            patient=self.other_patient, dentist=self.dentist, service=self.service,
+            appointment_date=date(2026, 11, 2), start_time=time(9, 15),
+        )
+        Appointment.objects.create(
+            patient=self.patient, dentist=self.other_dentist, service=self.service,
+            appointment_date=date(2026, 11, 9), start_time=time(8, 45),
+        )
+        Appointment.objects.create(
+            patient=self.other_patient, dentist=self.dentist, service=self.service,
+            appointment_date=date(2026, 11, 16), start_time=time(9, 0), status="cancelled",
+        )
+        Appointment.objects.create(
+            patient=self.other_patient, dentist=self.dentist, service=self.service,
+            appointment_date=date(2026, 11, 16), start_time=time(9, 30),
+        )
+        with self.assertNumQueries(1):
+            conflicts = find_conflicts(self.template, self.dates)
+        self.assertEqual(
+            conflicts, {date(2026, 11, 2): "ทันตแพทย์มีนัดแล้ว", date(2026, 11, 9): "คนไข้มีนัดแล้ว"},
+        )
+
+    def test_book_series_skips_conflicts(self):
+        Appointment.objects.create(
+            patient=self.other_patient, dentist=self.dentist, service=self.service,
+            appointment_date=date(2026, 11, 9), start_time=time(9, 0),
+        )
+        created, conflicts = book_series(self.template, self.dates, created_by=self.admin)
+        self.assertEqual([appt.appointment_date for appt in created], [date(2026, 11, 2), date(2026, 11, 16)])
+        self.assertEqual(list(conflicts), [date(2026, 11, 9)])
+        self.assertEqual(len({appt.series_id for appt in created}), 1)
+
+    def test_book_series_rolls_back_and_reports_only_clashing_dates(self):
+        # มีคนจองแทรกหลังตรวจ: ตรวจรอบแรกไม่เห็น (จำลองด้วยผลว่าง) แล้ว bulk_create ชน unique constraint
+        Appointment.objects.create(
+            patient=self.other_patient, dentist=self.dentist, service=self.service,
+            appointment_date=date(2026, 11, 9), start_time=time(9, 0),
+        )
+        calls = []
+
+        def stale_first_check(template, dates):
+            calls.append(dates)
+            return {} if len(calls) == 1 else find_conflicts(template, dates)
+
+        with mock.patch("clinic.series.find_conflicts", side_effect=stale_first_check):
+            created, conflicts = book_series(self.template, self.dates, created_by=self.admin)
+        self.assertEqual((created, len(calls)), ([], 2))
+        self.assertEqual(list(conflicts), [date(2026, 11, 9)])
+        self.assertFalse(Appointment.objects.filter(patient=self.patient).exists())
+
+
+class ObjectDetailTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        self.malee_user = User.objects.create_user("malee", "malee@example.com", "pw", role="patient")
+        self.dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        self.service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        self.malee, self.suda = (
+            Patient.objects.create(
+                name=name, gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222",
+                email=f"{name.lower()}@example.com",
+            )
+            for name in ("Malee", "Suda")
+        )
+        PatientClinicalRecord.objects.create(patient=self.suda, address="Bangkok", allergy="Penicillin")
+        self.appointments = {
+            patient: Appointment.objects.create(
+                patient=patient, dentist=self.dentist, service=self.service, created_by=self.admin,
+                appointment_date=date(2026, 10, 5), start_time=time(hour, 0),
+            )
+            for hour, patient in ((9, self.malee), (10, self.suda))
+        }
+
+    def test_query_count_per_schema(self):
+        request = RequestFactory().get("/")
+        request.user = self.admin
+        objects = {
+            "patient": self.suda, "dentist": self.dentist, "service": self.service,
+            "appointment": self.appointments[self.suda],
+        }
+        for name, obj in objects.items():
+            # object พร้อม FK/ตาราง one-to-one ใน query เดียว นัดหมายมีประวัติอีกหนึ่ง query
+            with self.subTest(name), self.assertNumQueries(2 if name == "appointment" else 1):
+                response = object_detail(request, name, obj.pk)
+            self.assertEqual(response.status_code, 200)
+
+    def test_patient_sees_only_own_records(self):
+        self.client.force_login(self.malee_user)
+        allowed = [
+            ("patient", self.malee.pk), ("appointment", self.appointments[self.malee].pk),
+            ("dentist", self.dentist.pk), ("service", self.service.pk),
+        ]
+        for name, pk in allowed:
+            self.assertEqual(self.client.get(reverse("object_detail", args=[name, pk])).status_code, 200)
+        for name, pk in (("patient", self.suda.pk), ("appointment", self.appointments[self.suda].pk)):
+            response = self.client.get(reverse("object_detail", args=[name, pk]))
+            self.assertEqual(response.status_code, 404)
+            self.assertNotContains(response, "Penicillin", status_code=404)
+
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get(reverse("object_detail", args=["patient", self.suda.pk])), "Penicillin")
+
+
+class FormStylingTests(TestCase):
+    def test_every_field_gets_tailwind_class(self):
+        for form_class in (AppointmentForm, AppointmentSeriesForm, DentistForm, PatientAppointmentForm, PatientForm,
+                           WaitlistEntryForm):
+            form = form_class()
+            for name, field in form.fields.items():
+                with self.subTest(form=form_class.__name__, field=name):
+                    self.assertEqual(field.widget.attrs["class"], TW_INPUT_CLASS)
+        # widget ที่ใช้ร่วมกันยังคงชนิด input เดิม
+        html = str(AppointmentForm()["appointment_date"])
+        self.assertIn('type="date"', html)
+        self.assertIn(f'class="{TW_INPUT_CLASS}"', html)
+
+
+@override_settings(CLINIC_METRICS_TOKEN="scrape-token", CLINIC_SLOW_QUERY_MS=None)
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+        self.patient = User.objects.create_user("malee", "malee@example.com", "pw", role="patient")
+        self.url = reverse("metrics")
+
+    def _sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requires_admin_or_token(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        self.client.force_login(self.patient)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer scrape-token").status_code, 200)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_exposition_format(self):
+        self.client.force_login(self.admin)
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = response.content.decode()
+        self.assertIn("# TYPE clinic_http_requests_total counter", body)
+        self.assertIn('clinic_http_requests_total{method="GET",status="200",view="metrics"}', body)
+        self.assertIn("# TYPE clinic_http_request_duration_seconds histogram", body)
+        self.assertIn("clinic_email_queue_depth 0.0", body)
+
+    def test_unknown_methods_share_one_label(self):
+        self.client.force_login(self.admin)
+        before = self._sample("clinic_http_requests_total", view="metrics", method="other", status="200")
+        self.client.generic("BREW", self.url)
+        self.client.generic("X-ANYTHING", self.url)
+        after = self._sample("clinic_http_requests_total", view="metrics", method="other", status="200")
+        self.assertEqual(after - before, 2)
+        self.assertEqual(self._sample("clinic_http_requests_total", view="metrics", method="BREW", status="200"), 0)
+
+    def test_slow_query_logging_is_not_counted(self):
+        self.client.force_login(self.admin)
+
+        def queries_for_one_request():
+            before = self._sample("clinic_http_db_queries_sum", view="metrics")
+            self.client.get(self.url)
+            return self._sample("clinic_http_db_queries_sum", view="metrics") - before
+
+        plain = queries_for_one_request()
+        with override_settings(CLINIC_SLOW_QUERY_MS=0), self.assertLogs("clinic.slowlog", "WARNING"):
+            logged = queries_for_one_request()
+        self.assertTrue(SlowQuery.objects.exists())
+        self.assertEqual(logged, plain)
+
+
+class CalendarTests(TestCase):
+    def setUp(self):
+        self.somchai = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="somchai@example.com", license_number="D-001",
+        )
+        self.arunee = Dentist.objects.create(
+            name="Arunee", specialization="Ortho", phone="0811111112",
+            email="arunee@example.com", license_number="D-002",
+        )
+        self.service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        self.patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222",
+        )
+        self.monday = date(2030, 6, 3)
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+
+    def _book(self, dentist, day, start, end=None, status="scheduled"):
+        return Appointment.objects.create(
+            patient=self.patient, dentist=dentist, service=self.service, appointment_date=day,
+            start_time=start, end_time=end, status=status,
+        )
+
+    def test_groups_slots_per_dentist_and_day(self):
+        wednesday = self.monday + timedelta(days=2)
+        a = self._book(self.somchai, self.monday, time(9, 0), time(10, 15))
+        b = self._book(self.somchai, wednesday, time(13, 0))
+        c = self._book(self.arunee, wednesday, time(9, 0))
+        self._book(self.arunee, wednesday, time(11, 0), status="cancelled")
+        self._book(self.arunee, self.monday + timedelta(days=7), time(9, 0))
+
+        with self.assertNumQueries(1):
+            data = build_calendar(self.monday)
+
+        self.assertEqual(data["days"][0], "2030-06-03")
+        self.assertEqual(len(data["days"]), 7)
+        self.assertEqual([d["name"] for d in data["dentists"]], [str(self.arunee), str(self.somchai)])
+        arunee, somchai = data["dentists"]
+        self.assertEqual(arunee["slots"], [[2, 540, 570, c.pk, "Malee", "Scaling", "scheduled"]])
+        self.assertEqual(somchai["slots"], [
+            [0, 540, 615, a.pk, "Malee", "Scaling", "scheduled"],
+            [2, 780, 810, b.pk, "Malee", "Scaling", "scheduled"],
+        ])
+        only = build_calendar(self.monday, dentist_id=self.somchai.pk)
+        self.assertEqual([d["id"] for d in only["dentists"]], [self.somchai.pk])
+
+    @override_settings(CLINIC_CALENDAR_HOURS=(9, 17))
+    def test_hours_come_from_settings_and_widen_for_outliers(self):
+        self._book(self.somchai, self.monday, time(10, 0))
+        data = build_calendar(self.monday)
+        self.assertEqual((data["day_start"], data["day_end"]), (540, 1020))
+
+        self._book(self.somchai, self.monday, time(7, 30))
+        self._book(self.arunee, self.monday, time(18, 0), time(18, 40))
+        data = build_calendar(self.monday)
+        self.assertEqual((data["day_start"], data["day_end"]), (420, 1140))
+
+    def test_json_endpoint_is_admin_only(self):
+        url = reverse("appointment_calendar_json")
+        page = reverse("appointment_calendar")
+        self._book(self.somchai, self.monday, time(9, 0))
+
+        self.assertRedirects(
+            self.client.get(url), f"{settings.LOGIN_URL}?next={url}", fetch_redirect_response=False,
+        )
+        User.objects.create_user("malee", "malee@example.com", "pw", role="patient")
+        self.client.login(username="malee", password="pw")
+        for path in (url, page):
+            self.assertRedirects(self.client.get(path), reverse("patient_dashboard"), fetch_redirect_response=False)
+
+        self.client.force_login(self.admin)
+        # วันไหนในสัปดาห์ก็ได้ปฏิทินที่เริ่มวันจันทร์
+        response = self.client.get(url, {"start": "2030-06-06", "dentist": self.somchai.pk})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["start"], "2030-06-03")
+        self.assertEqual([d["id"] for d in data["dentists"]], [self.somchai.pk])
+        self.assertEqual(self.client.get(page).status_code, 200)
+
+
+class WarmupTests(TestCase):
+    def test_ready_warms_up_only_when_enabled(self):
+        config = django_apps.get_app_config("clinic")
+        with mock.patch("clinic.warmup.warm_up") as warm_up:
+            with override_settings(CLINIC_WARMUP=False):
+                config.ready()
+            warm_up.assert_not_called()
+            with override_settings(CLINIC_WARMUP=True):
+                config.ready()
+            warm_up.assert_called_once_with()
+
+    def test_warm_up_loads_refdata_and_closes_connections(self):
+        with mock.patch("clinic.warmup.connections") as conns, \
+                mock.patch("clinic.warmup.refdata.warm") as warm, \
+                mock.patch("clinic.warmup.WARMUP_TEMPLATES", ("login.html", "missing.html")), \
+                self.assertLogs("clinic.warmup", "WARNING") as logs:
+            warmup.warm_up()
+        warm.assert_called_once_with()
+        conns.close_all.assert_called_once_with()
+        self.assertEqual(logs.output, ["WARNING:clinic.warmup:Warm-up template missing.html not found"])
+
+    def test_database_not_ready_does_not_stop_startup(self):
+        with mock.patch("clinic.warmup.connections") as conns, \
+                mock.patch("clinic.warmup.refdata.warm", side_effect=DatabaseError("no such table")), \
+                self.assertLogs("clinic.warmup", "WARNING") as logs:
+            warmup.warm_up()
+        conns.close_all.assert_called_once_with()
+        self.assertIn("database not ready", logs.output[0])
+
+
+class ImportProfileCommandTests(TestCase):
+    IMPORTTIME = "\n".join((
+        "import time: self [us] | cumulative | imported package",
+        "import time:       300 |        300 |   clinic.models",
+        "import time:       200 |        500 | clinic",
+        "import time:      1800 |       2500 | django",
+    ))
+
+    def _run(self, *args, returncode=0):
+        completed = subprocess.CompletedProcess([], returncode, stdout="", stderr=self.IMPORTTIME)
+        out = StringIO()
+        with mock.patch("clinic.management.commands.import_profile.subprocess.run", return_value=completed):
+            call_command("import_profile", *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_sorts_and_totals_top_level_modules(self):
+        lines = self._run()
+        self.assertEqual([line.split()[0] for line in lines[1:4]], ["django", "clinic", "clinic.models"])
+        self.assertEqual(lines[-1], "Total import time: 3.0 ms (3 modules listed)")
+        self.assertEqual(self._run("--sort", "self", "--top", "1")[1].split()[0], "django")
+
+    def test_package_filter_keeps_total(self):
+        lines = self._run("--package", "clinic")
+        self.assertEqual([line.split()[0] for line in lines[1:-1]], ["clinic", "clinic.models"])
+        self.assertEqual(lines[-1], "Total import time: 3.0 ms (2 modules listed)")
+
+    def test_failed_startup_raises(self):
+        with self.assertRaises(CommandError):
+            self._run(returncode=1)
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("admin", "admin@example.com", "pw", role="admin")
+
+    def _entry(self, sql, ms=250.0):
+        return {"alias": "default", "sql": sql, "params": (1,), "ms": ms, "frame": "clinic/views.py:1 in x"}
+
+    def test_fingerprint_ignores_literals_and_in_list_length(self):
+        self.assertEqual(
+            slowlog.fingerprint("SELECT * FROM t WHERE id = 1 AND name = 'a'"),
+            slowlog.fingerprint("SELECT *  FROM t\nWHERE id = 42 AND name = 'it''s'"),
+        )
+        self.assertEqual(
+            slowlog.fingerprint("SELECT * FROM t WHERE id IN (%s)"),
+            slowlog.fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s)"),
+        )
+        self.assertNotEqual(
+            slowlog.fingerprint("SELECT * FROM t WHERE id = 1"),
+            slowlog.fingerprint("SELECT * FROM u WHERE id = 1"),
+        )
+
+    def test_queries_over_threshold_are_saved_per_fingerprint(self):
+        self.client.force_login(self.admin)
+        with override_settings(CLINIC_SLOW_QUERY_MS=0), self.assertLogs("clinic.slowlog", "WARNING"):
+            self.client.get(reverse("metrics"))
+        first = {row.fingerprint: row.count for row in SlowQuery.objects.all()}
+        self.assertTrue(first)
+        self.assertEqual(set(SlowQuery.objects.values_list("view", flat=True)), {"metrics"})
+
+        with override_settings(CLINIC_SLOW_QUERY_MS=0), self.assertLogs("clinic.slowlog", "WARNING"):
+            self.client.get(reverse("metrics"))
+        again = {row.fingerprint: row.count for row in SlowQuery.objects.all()}
+        self.assertEqual(set(again), set(first))
+        self.assertTrue(all(again[fp] > first[fp] for fp in first))
+
+    def test_fast_queries_are_not_saved(self):
+        self.client.force_login(self.admin)
+        with override_settings(CLINIC_SLOW_QUERY_MS=60_000):
+            self.client.get(reverse("metrics"))
+        self.assertFalse(SlowQuery.objects.exists())
+
+    @override_settings(CLINIC_SLOW_QUERY_MAX_ROWS=2)
+    def test_prunes_least_recently_seen_rows(self):
+        old = timezone.now() - timedelta(days=1)
+        for n in range(2):
+            SlowQuery.objects.create(
+                fingerprint=f"old{n}", sql="SELECT 1", first_seen=old, last_seen=old + timedelta(minutes=n),
+            )
+        with self.assertLogs("clinic.slowlog", "WARNING"):
+            slowlog.save([self._entry("SELECT * FROM clinic_patient")], view="patients")
+        self.assertEqual(
+            set(SlowQuery.objects.values_list("fingerprint", flat=True)),
+            {"old1", slowlog.fingerprint("SELECT * FROM clinic_patient")},
+        )
+
+    def test_concurrent_insert_is_counted_into_existing_row(self):
+        sql = "SELECT * FROM clinic_appointment WHERE id = 1"
+        SlowQuery.objects.create(fingerprint=slowlog.fingerprint(sql), sql=sql, total_ms=300, max_ms=300)
+        real_bump = slowlog._bump
+        calls = []
+
+        def racing_bump(*args):
+            # ครั้งแรกทำเหมือนยังไม่มีแถว (อีก worker เพิ่งสร้างหลังเรา update)
+            calls.append(args)
+            return 0 if len(calls) == 1 else real_bump(*args)
+
+        with mock.patch("clinic.slowlog._bump", racing_bump), self.assertLogs("clinic.slowlog", "WARNING"):
+            slowlog.save([self._entry(sql, ms=500.0)], view="patients")
+
+        row = SlowQuery.objects.get()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(row.count, 2)
+        self.assertEqual(row.total_ms, 800)
+        self.assertEqual(row.max_ms, 500)
+
+
+@skipUnless(connection.vendor == "postgresql", "partition ใช้ได้เฉพาะ PostgreSQL")
+class AppointmentPartitionTests(TestCase):
+    def test_creates_new_month_and_moves_rows_from_default(self):
+        dentist = Dentist.objects.create(
+            name="Somchai", specialization="General", phone="0811111111",
+            email="dentist@example.com", license_number="D-001",
+        )
+        service = Service.objects.create(name="Scaling", price=800, duration_minutes=30)
+        patient = Patient.objects.create(
+            name="Malee", gender="F", date_of_birth=date(1990, 5, 1), phone="0822222222",
+        )
+        month = date(2040, 3, 1)
+        # ยังไม่มี partition ของเดือนนี้ แถวจึงอยู่ใน default
+        appt = Appointment.objects.create(
+            patient=patient, dentist=dentist, service=service,
+            appointment_date=date(2040, 3, 15), start_time=time(9, 0),
+        )
+
+        created = ensure_partitions(ahead=0, today=month)
+
+        self.assertEqual(created, [partition_name(month)])
+        self.assertIn((month, partition_name(month)), monthly_partitions())
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {partition_name(month)}")
+            self.assertEqual(cursor.fetchall(), [(appt.pk,)])
+        self.assertEqual(ensure_partitions(ahead=0, today=month), [])
@@ -7,6 +7,11 @@ urlpatterns = [
     path('register/', views.register_page, name='register'),
 
     path('dashboard/', views.dashboard_page, name='dashboard'),
+    path('dashboard/demographics.json', views.demographics_json, name='demographics_json'),
+    path('dashboard/occupancy.csv', views.occupancy_export, name='occupancy_export'),
+    path('metrics/', views.metrics_page, name='metrics'),
+    path('reports/', views.reports_page, name='reports'),
+    path('reports/export/<str:kind>/', views.reports_export, name='reports_export'),
 
     path('patients/', views.patients_page, name='patients'),
     path('patients/add/', views.patient_add, name='patient_add'),
@@ -15,6 +20,10 @@ urlpatterns = [
 
     path('appointments/', views.appointments_page, name='appointments'),
     path('appointments/add/', views.appointment_add, name='appointment_add'),
+    path('appointments/series/add/', views.appointment_series_add, name='appointment_series_add'),
+    path('appointments/bulk-status/', views.appointment_bulk_status, name='appointment_bulk_status'),
+    path('appointments/calendar/', views.calendar_page, name='appointment_calendar'),
+    path('appointments/calendar.json', views.calendar_json, name='appointment_calendar_json'),
     path('appointments/<int:pk>/edit/', views.appointment_edit, name='appointment_edit'),
     path('appointments/<int:pk>/delete/', views.appointment_delete, name='appointment_delete'),
 
@@ -45,6 +54,8 @@ urlpatterns = [
     path("patient/profile/edit/", views.patient_edit_profile, name="patient_edit_profile"),
 
     path("patient/appointments/", views.patient_appointments, name="appointments_patient"),
+    path("patient/waitlist/join/", views.waitlist_join, name="waitlist_join"),
+    path("patient/waitlist/offers/<int:pk>/<str:action>/", views.waitlist_offer_respond, name="waitlist_offer_respond"),
 
     path("appointments/<int:pk>/complete/", views.complete_appointment, name="appointment_complete"),
 
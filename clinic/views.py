@@ -6,20 +6,59 @@ from django.contrib.auth.decorators import login_required
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
-from django.views.decorators.csrf import csrf_protect
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.cache import never_cache
-from django.db.models import Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+from django.http import Http404, HttpResponse, JsonResponse
 
 import calendar
+import csv
+import json
 from datetime import date
 
+from .db_routers import use_replica
 from .decorators import role_required
-from .models import Patient, Dentist, Service, Appointment, EmailOTP
-from .forms import PatientProfileForm, UserRegisterForm, PatientForm, DentistForm, ServiceForm, AppointmentForm
-from clinic import models
+from .assignment import book_any_dentist
+from .idempotency import idempotent
+from .models import Patient, Dentist, Service, Appointment, EmailOTP, WaitlistOffer
+from .forms import PatientProfileForm, UserRegisterForm, PatientForm, DentistForm, ServiceForm, AppointmentForm, AppointmentSeriesForm, PatientAppointmentForm, WaitlistEntryForm, VersionConflict
+from .schedule import build_calendar, week_start
+from .series import book_series, occurrences
+from .status import STATUS_VALUES, bulk_set_status, transition
+from . import audit, demographics, media, metrics, occupancy, refdata, reports, waitlist
+from .detail import can_view, get_schema
 
 User = get_user_model()
 
+SLOT_TAKEN = "ทันตแพทย์ท่านนี้มีนัดในเวลานี้แล้ว กรุณาเลือกเวลาอื่น"
+
+
+def _save_booking(appt):
+    """
+    บันทึกนัดใหม่ คืน False ถ้ามีคนจองช่วงเดียวกันไปหลังฟอร์มตรวจแล้ว (unique_active_dentist_slot)
+    แยก savepoint ไว้ transaction ของคำขอจึงใช้ต่อได้
+    """
+    try:
+        with transaction.atomic():
+            appt.save()
+    except IntegrityError:
+        return False
+    return True
+
+
+def _patient_for(user, full=False):
+    """
+    ผู้ป่วยของบัญชีที่ login (จับคู่ด้วยอีเมล) ปกติโหลดแค่คอลัมน์สรุป
+    full=True โหลดทั้งแถวพร้อม PatientClinicalRecord สำหรับหน้าที่แสดง/แก้ไขข้อมูลทั้งหมด
+    """
+    if full:
+        queryset = Patient.objects.select_related("clinical")
+    else:
+        queryset = Patient.objects.only(*Patient.SUMMARY_FIELDS)
+    return queryset.filter(email=user.email).first()
+
 # ---------------------------
 # 🔐 Authentication
 # ---------------------------
@@ -42,8 +81,6 @@ def login_page(request):
     return render(request, "login.html")
 
 
-
-
 def register_page(request):
     if request.method == "POST":
         form = UserRegisterForm(request.POST)
@@ -66,12 +103,10 @@ def logout_view(request):
 # ---------------------------
 # 📊 Dashboard
 # ---------------------------
-# views.py
-from django.db.models import Count, Sum
-from .models import Patient, Appointment, Dentist
 
 @login_required
 @role_required(["admin"])
+@use_replica
 def dashboard_page(request):
     today = date.today()
     current_year = today.year
@@ -95,10 +130,9 @@ def dashboard_page(request):
         for d in days
     ]
 
-    # เพศ
-    male_count = Patient.objects.filter(gender="M").count()
-    female_count = Patient.objects.filter(gender="F").count()
-    patients_gender = [male_count, female_count]
+    # เพศ / ช่วงอายุ (GROUP BY query เดียว)
+    patient_stats = demographics.summary(today)
+    patients_gender = [patient_stats["gender"].get("M", 0), patient_stats["gender"].get("F", 0)]
 
     # นัดหมายตามสถานะในเดือน ✅ ใช้ appointment_date
     status_stats = (
@@ -111,6 +145,14 @@ def dashboard_page(request):
     status_labels = ["scheduled", "confirmed", "completed", "cancelled", "no_show"]
     status_counts = [status_data.get(s, 0) for s in status_labels]
 
+    # ความหนาแน่นของตารางราย วัน x ชั่วโมง ในเดือนที่เลือก
+    occupancy_start, occupancy_end = occupancy.month_range(current_year, selected_month)
+    occupancy_result = occupancy.occupancy(occupancy_start, occupancy_end)
+    try:
+        occupancy_dentist = int(request.GET.get("dentist") or 0)
+    except ValueError:
+        occupancy_dentist = 0
+
     # dropdown เดือน
     all_months = [{"value": i, "label": calendar.month_name[i]} for i in range(1, 13)]
 
@@ -121,15 +163,109 @@ def dashboard_page(request):
         "patients_daily": patients_daily,
         "days": days,
         "patients_gender": patients_gender,
+        "age_band_labels": [row["band"] for row in patient_stats["age_bands"]],
+        "age_band_male": [row["M"] for row in patient_stats["age_bands"]],
+        "age_band_female": [row["F"] for row in patient_stats["age_bands"]],
         "all_months": all_months,
         "selected_month": selected_month,
         "selected_month_label": selected_month_label,
         "status_labels": status_labels,
         "status_counts": status_counts,
+        "occupancy_rows": occupancy.heatmap_rows(
+            occupancy_result, occupancy_dentist, getattr(settings, "CLINIC_CALENDAR_HOURS", (8, 20))
+        ),
+        "occupancy_dentists": occupancy_result["dentists"],
+        "occupancy_dentist": occupancy_dentist,
+        "occupancy_start": occupancy_start,
+        "occupancy_end": occupancy_end,
     }
     return render(request, "dental_clinic/dashboard.html", context)
 
 
+@login_required
+@role_required(["admin"])
+@use_replica
+def demographics_json(request):
+    cohort = request.GET.get("cohort", "year")
+    if cohort not in demographics.COHORTS:
+        return JsonResponse({"error": f"cohort must be one of {', '.join(demographics.COHORTS)}"}, status=400)
+    return JsonResponse(demographics.summary(cohort=cohort))
+
+
+@login_required
+@role_required(["admin"])
+@use_replica
+def occupancy_export(request):
+    """ตาราง occupancy ชั่วโมงของสัปดาห์ x ทันตแพทย์ เป็น CSV (ช่วงวันที่เหมือนหน้ารายงาน)"""
+    start, end, _ = _report_params(request)
+    response = HttpResponse(content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="occupancy-{start}-{end}.csv"'
+    response.write("\ufeff")  # BOM ให้ Excel อ่านภาษาไทยถูก
+    csv.writer(response).writerows(occupancy.csv_rows(occupancy.occupancy(start, end)))
+    return response
+
+
+def metrics_page(request):
+    """Prometheus text format: ผู้ดูแลที่ login อยู่ หรือ scraper ที่ส่ง Bearer token"""
+    token = getattr(settings, "CLINIC_METRICS_TOKEN", "")
+    has_token = bool(token) and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+    is_admin = request.user.is_authenticated and request.user.role == "admin"
+    if not (has_token or is_admin):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ---------------------------
+# 💰 Reports
+# ---------------------------
+def _report_params(request):
+    """อ่านช่วงวันที่/รอบจาก query string (ค่าเริ่มต้น: ต้นปีนี้ถึงวันนี้)"""
+    today = date.today()
+    try:
+        start = date.fromisoformat(request.GET.get("start") or "")
+    except ValueError:
+        start = today.replace(month=1, day=1)
+    try:
+        end = date.fromisoformat(request.GET.get("end") or "")
+    except ValueError:
+        end = today
+    period = request.GET.get("period") if request.GET.get("period") in reports.PERIODS else "month"
+    return start, end, period
+
+
+@login_required
+@role_required(["admin"])
+@use_replica
+def reports_page(request):
+    start, end, period = _report_params(request)
+    context = {
+        "start": start,
+        "end": end,
+        "period": period,
+        "dentist_rows": reports.get_report("dentists", start, end),
+        "service_rows": reports.get_report("services", start, end),
+        "period_rows": reports.get_report("periods", start, end, period),
+    }
+    return render(request, "dental_clinic/reports.html", context)
+
+
+@login_required
+@role_required(["admin"])
+@use_replica
+def reports_export(request, kind):
+    if kind not in reports.REPORT_KINDS:
+        raise Http404("Unknown report")
+    start, end, period = _report_params(request)
+    rows = reports.get_report(kind, start, end, period)
+
+    response = HttpResponse(content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="report-{kind}-{start}-{end}.csv"'
+    response.write("\ufeff")  # BOM ให้ Excel อ่านภาษาไทยถูก
+    writer = csv.DictWriter(response, fieldnames=reports.COLUMNS[kind])
+    writer.writeheader()
+    writer.writerows(rows)
+    return response
+
 
 # ---------------------------
 # 📄 Pages
@@ -137,12 +273,9 @@ def dashboard_page(request):
 @login_required
 @role_required(["admin", "patient"])
 def patients_page(request):
-    patients = Patient.objects.all().order_by("-created_at")
+    patients = Patient.objects.only(*Patient.SUMMARY_FIELDS).order_by("-created_at")
     return render(request, "dental_clinic/patients.html", {"patients": patients})
 
-from django.shortcuts import render
-from django.contrib.auth.decorators import login_required
-from .models import Appointment
 
 @login_required
 @role_required(["admin", "patient"])
@@ -159,6 +292,33 @@ def appointments_page(request):
         "status": status,    
         })
 
+def _calendar_params(request):
+    try:
+        start = date.fromisoformat(request.GET.get("start") or "")
+    except ValueError:
+        start = date.today()
+    dentist_id = request.GET.get("dentist")
+    return week_start(start), int(dentist_id) if (dentist_id or "").isdigit() else None
+
+
+@login_required
+@role_required(["admin"])
+def calendar_page(request):
+    start, dentist_id = _calendar_params(request)
+    return render(request, "dental_clinic/calendar.html", {
+        "calendar": build_calendar(start, dentist_id=dentist_id),
+        "dentists": refdata.active_dentists(),
+        "dentist_id": dentist_id,
+    })
+
+
+@login_required
+@role_required(["admin"])
+def calendar_json(request):
+    start, dentist_id = _calendar_params(request)
+    return JsonResponse(build_calendar(start, dentist_id=dentist_id))
+
+
 @login_required
 @role_required(["admin"])
 def dentists_page(request):
@@ -191,11 +351,14 @@ def patient_add(request):
 
 @login_required
 def patient_edit(request, pk):
-    patient = get_object_or_404(Patient, pk=pk)
+    patient = get_object_or_404(Patient.objects.select_related("clinical"), pk=pk)
     if request.method == "POST":
         form = PatientForm(request.POST, instance=patient)
         if form.is_valid():
-            form.save()
+            try:
+                form.save()
+            except VersionConflict:
+                return render(request, "dental_clinic/patient_form.html", {"form": form})
             messages.success(request, "แก้ไขข้อมูลคนไข้สำเร็จ")
             return redirect("patients")
     else:
@@ -297,27 +460,66 @@ def service_delete(request, pk):
 # ✍️ CRUD: Appointment
 # ---------------------------
 @login_required
+@idempotent
 def appointment_add(request):
     if request.method == "POST":
         form = AppointmentForm(request.POST)
         if form.is_valid():
             appointment = form.save(commit=False)
             appointment.created_by = request.user
-            appointment.save()
-            messages.success(request, "เพิ่มนัดหมายสำเร็จ")
-            return redirect("appointments")
+            if _save_booking(appointment):
+                audit.record(appointment.pk, "created", new_status=appointment.status)
+                metrics.booking("admin", "success")
+                messages.success(request, "เพิ่มนัดหมายสำเร็จ")
+                return redirect("appointments")
+            form.add_error(None, SLOT_TAKEN)
+        if form.non_field_errors():
+            metrics.booking("admin", "conflict")
     else:
         form = AppointmentForm()
     return render(request, "dental_clinic/appointment_form.html", {"form": form})
 
 
+@login_required
+@role_required(["admin"])
+def appointment_series_add(request):
+    if request.method == "POST":
+        form = AppointmentSeriesForm(request.POST)
+        if form.is_valid():
+            dates = occurrences(
+                form.cleaned_data["appointment_date"],
+                form.cleaned_data["frequency"],
+                form.cleaned_data["interval"],
+                form.cleaned_data["count"],
+                form.cleaned_data["until"],
+            )
+            created, conflicts = book_series(form.save(commit=False), dates, created_by=request.user)
+            metrics.booking("series", "success", len(created))
+            metrics.booking("series", "conflict", len(conflicts))
+            if created:
+                messages.success(request, f"สร้างนัดหมายเป็นชุด {len(created)} จาก {len(dates)} รายการ")
+            for day, reason in sorted(conflicts.items()):
+                messages.warning(request, f"{day:%d/%m/%Y}: {reason}")
+            return redirect("appointments")
+    else:
+        form = AppointmentSeriesForm()
+    return render(request, "dental_clinic/appointment_series_form.html", {"form": form})
+
+
 @login_required
 def appointment_edit(request, pk):
     appointment = get_object_or_404(Appointment, pk=pk)
     if request.method == "POST":
+        old_status = appointment.status
         form = AppointmentForm(request.POST, instance=appointment)
         if form.is_valid():
-            form.save()
+            try:
+                form.save()
+            except VersionConflict:
+                return render(request, "dental_clinic/appointment_form.html", {"form": form})
+            audit.record_form_changes(form, old_status)
+            if appointment.status == "cancelled" and old_status != "cancelled":
+                waitlist.enqueue([appointment.pk])
             messages.success(request, "แก้ไขนัดหมายสำเร็จ")
             return redirect("appointments")
     else:
@@ -329,6 +531,7 @@ def appointment_edit(request, pk):
 def appointment_delete(request, pk):
     appointment = get_object_or_404(Appointment, pk=pk)
     if request.method == "POST":
+        audit.record(appointment.pk, "deleted", old_status=appointment.status)
         appointment.delete()
         messages.success(request, "ลบนัดหมายสำเร็จ")
         return redirect("appointments")
@@ -348,6 +551,7 @@ def _send_otp_email(to_email: str, first_name: str, code: str):
     )
     from_email = getattr(settings, "DEFAULT_FROM_EMAIL", settings.EMAIL_HOST_USER)
     send_mail(subject, body, from_email, [to_email], fail_silently=False)
+    metrics.OTP_SENT.inc()
 
 
 @csrf_protect
@@ -455,20 +659,11 @@ def reset_password_custom(request):
     return render(request, "otp/reset_password_custom.html")
 
 
-
-
-from django.shortcuts import render, get_object_or_404
-from django.contrib.auth.decorators import login_required
-from django.utils import timezone
-
-from .models import Patient, Appointment
-
-
 @login_required
 @role_required(["patient"])
 def patient_dashboard(request):
     user = request.user  
-    patient = Patient.objects.filter(email=user.email).first()
+    patient = _patient_for(user)
     appointments = Appointment.objects.filter(patient=patient) if patient else []
     context = {
         "user": user,
@@ -478,96 +673,134 @@ def patient_dashboard(request):
     return render(request, "patient/patient_dashboard.html", context)
 
 
+@login_required
+def media_file(request, path):
+    """ไฟล์อัปโหลด: ผู้ดูแล หรือผู้ป่วยเจ้าของรูป (คนอื่นเห็นเป็น 404 ไม่บอกว่าไฟล์มีอยู่)"""
+    if not media.can_view(request.user, path):
+        raise Http404("Not found")
+    return media.serve(request, path)
 
-# clinic/views.py
-# views.py
-from django.apps import apps
-from django.shortcuts import get_object_or_404, render
-from django.contrib.auth.decorators import login_required
 
 @login_required
 def object_detail(request, model_name, pk):
-    model = apps.get_model("clinic", model_name.capitalize())
-    obj = get_object_or_404(model, pk=pk)
-
-    # 🔹 เก็บคู่ (verbose_name, value) เป็น list
-    field_values = []
-    for field in model._meta.fields:
-        value = getattr(obj, field.name)
-        field_values.append({
-            "label": field.verbose_name,
-            "value": value,
-        })
+    # 🔹 schema คำนวณไว้ตอนเริ่มระบบ: โหลด object พร้อม FK ทั้งหมดใน query เดียว
+    # (นัดหมายมีอีกหนึ่ง query สำหรับประวัติการเปลี่ยนแปลง)
+    schema = get_schema(model_name)
+    if schema is None:
+        raise Http404("Unknown model")
+    obj = schema.get_object(pk)
+    # ไม่มีสิทธิ์เห็นเป็น 404 เหมือนไม่มีรายการ (ไม่บอกว่า id นี้มีอยู่)
+    if obj is None or not can_view(request.user, obj):
+        raise Http404("Not found")
+
+    # ประวัติการเปลี่ยนแปลง (เฉพาะนัดหมาย)
+    events = obj.events.select_related("actor")[:50] if schema.model is Appointment else None
 
     return render(request, "dental_clinic/object_detail.html", {
         "object": obj,
-        "type": model._meta.verbose_name,
-        "field_values": field_values,
+        "type": schema.verbose_name,
+        "field_values": schema.field_values(obj),
+        "events": events,
     })
 
 
-
-
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth.decorators import login_required
-from .models import Appointment
-
 @login_required
+@role_required(["admin"])
 @csrf_exempt
+@idempotent
 def complete_appointment(request, pk):
     """เปลี่ยนสถานะนัดหมายเป็น completed"""
     if request.method == "POST":
-        try:
-            appt = Appointment.objects.get(pk=pk)
-            appt.status = "completed"
-            appt.save()
+        if transition(pk, "completed"):
             return JsonResponse({"success": True})
-        except Appointment.DoesNotExist:
-            return JsonResponse({"success": False, "error": "Not found"}, status=404)
+        if Appointment.objects.filter(pk=pk).exists():
+            return JsonResponse({"success": False, "error": "Invalid status transition"}, status=409)
+        return JsonResponse({"success": False, "error": "Not found"}, status=404)
     return JsonResponse({"success": False, "error": "Invalid request"}, status=400)
 
 
+@login_required
+@role_required(["admin"])
+def appointment_bulk_status(request):
+    """เปลี่ยนสถานะนัดหมายหลายรายการในคำขอเดียว (ฟอร์มหรือ JSON)"""
+    if request.method != "POST":
+        return JsonResponse({"success": False, "error": "Invalid request"}, status=400)
 
+    wants_json = request.content_type == "application/json"
+    if wants_json:
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"success": False, "error": "Invalid JSON"}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({"success": False, "error": "JSON body must be an object"}, status=400)
+        ids = payload.get("ids", [])
+        new_status = payload.get("status")
+        # bool เป็น int ใน Python แต่ไม่ใช่ id
+        if not isinstance(ids, list) or not all(type(pk) is int for pk in ids):
+            return JsonResponse({"success": False, "error": "ids must be a list of integers"}, status=400)
+    else:
+        new_status = request.POST.get("status")
+        try:
+            ids = [int(pk) for pk in request.POST.getlist("ids")]
+        except ValueError:
+            ids = None
 
+    try:
+        if ids is None:
+            raise ValueError("Invalid ids")
+        outcomes = bulk_set_status(ids, new_status)
+    except ValueError:
+        if wants_json:
+            return JsonResponse({"success": False, "error": "Invalid ids or status"}, status=400)
+        messages.error(request, "กรุณาเลือกนัดหมายและสถานะให้ถูกต้อง")
+        return redirect("appointments")
 
+    if wants_json:
+        return JsonResponse({"success": True, "results": outcomes})
 
+    updated = sum(1 for result in outcomes.values() if result == "updated")
+    messages.success(request, f"อัปเดตสถานะ {updated} จาก {len(outcomes)} รายการ")
+    return redirect("appointments")
 
 
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib import messages
-from django.contrib.auth.decorators import login_required
-from django.utils import timezone
-from .models import Appointment, Dentist, Service
-
-
-
-
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
-from django.contrib import messages
-
-from .models import Appointment, Patient, Dentist, Service
-from .forms import PatientAppointmentForm
-
 @login_required
+@idempotent
 def patient_appointments(request):
-    patient = Patient.objects.filter(email=request.user.email).first()
+    patient = _patient_for(request.user)
     if not patient:
         messages.error(request, "ไม่พบข้อมูลผู้ป่วยของคุณ กรุณาติดต่อคลินิก")
         return redirect("patient_dashboard")
 
     if request.method == "POST":
         form = PatientAppointmentForm(request.POST, patient=patient)
-        if form.is_valid():
+        if form.is_valid() and not form.cleaned_data["dentist"]:
+            data = form.cleaned_data
+            appt = book_any_dentist(
+                patient, data["service"], data["appointment_date"], data["start_time"],
+                end_time=data.get("end_time"), notes=data.get("notes", ""), created_by=request.user,
+            )
+            if appt:
+                metrics.booking("patient_any", "success")
+                messages.success(request, f"เพิ่มนัดหมายเรียบร้อย ({appt.dentist})")
+                return redirect("appointments_patient")
+            metrics.booking("patient_any", "conflict")
+            messages.error(request, "ไม่มีทันตแพทย์ว่างในเวลานี้ กรุณาเลือกเวลาอื่น")
+        elif form.is_valid():
             appt = form.save(commit=False)
             appt.patient = patient
             appt.status = "scheduled"
             appt.created_by = request.user
-            appt.save()
-            messages.success(request, "เพิ่มนัดหมายเรียบร้อย")
-            return redirect("appointments_patient")
+            if _save_booking(appt):
+                audit.record(appt.pk, "created", new_status=appt.status)
+                metrics.booking("patient", "success")
+                messages.success(request, "เพิ่มนัดหมายเรียบร้อย")
+                return redirect("appointments_patient")
+            metrics.booking("patient", "conflict")
+            messages.error(request, SLOT_TAKEN)
         else:
+            if form.non_field_errors():
+                metrics.booking("patient", "conflict")
             for err in form.non_field_errors():
                 messages.error(request, err)
     else:
@@ -577,98 +810,154 @@ def patient_appointments(request):
         patient=patient
     ).select_related("dentist", "service").order_by("-appointment_date", "-start_time")
 
+    offers = WaitlistOffer.objects.filter(
+        entry__patient=patient, status="held", expires_at__gte=timezone.now()
+    ).select_related("appointment__dentist", "appointment__service")
+
     return render(request, "patient/appointments_patient.html", {
         "appointments": appointments,
         "form": form,
         "patient": patient,
+        "offers": offers,
+        "waitlist_form": WaitlistEntryForm(),
     })
 
 
+@login_required
+@role_required(["patient"])
+def waitlist_join(request):
+    patient = _patient_for(request.user)
+    if not patient:
+        messages.error(request, "ไม่พบข้อมูลผู้ป่วยของคุณ กรุณาติดต่อคลินิก")
+        return redirect("patient_dashboard")
+
+    if request.method == "POST":
+        form = WaitlistEntryForm(request.POST)
+        if form.is_valid():
+            entry = form.save(commit=False)
+            entry.patient = patient
+            entry.save()
+            # ช่องว่างที่มีอยู่แล้วในช่วงวันที่ลงชื่อ เข้าคิวให้ waitlist_backfill รอบถัดไป ไม่ต้องรอ waitlist_sweep
+            waitlist.enqueue(
+                waitlist.freed_slots()
+                .filter(service_id=entry.service_id, appointment_date__range=(entry.earliest_date, entry.latest_date))
+                .values_list("pk", flat=True)
+            )
+            messages.success(request, "ลงชื่อรอคิวเรียบร้อย ระบบจะแจ้งเมื่อมีคิวว่าง")
+        else:
+            for err in form.non_field_errors():
+                messages.error(request, err)
+    return redirect("appointments_patient")
+
 
 @login_required
+@role_required(["patient"])
+def waitlist_offer_respond(request, pk, action):
+    patient = _patient_for(request.user)
+    offer = get_object_or_404(
+        WaitlistOffer.objects.select_related("appointment", "entry"), pk=pk, entry__patient=patient
+    )
+    if action not in ("accept", "decline"):
+        raise Http404("Unknown action")
+    if request.method != "POST":
+        return redirect("appointments_patient")
+
+    if action == "accept":
+        try:
+            appt = waitlist.accept_offer(offer, request.user)
+        except waitlist.PatientBusy:
+            metrics.booking("waitlist", "conflict")
+            messages.error(request, "คุณมีนัดอื่นในช่วงเวลานี้แล้ว ระบบจะเสนอคิวว่างครั้งถัดไปให้")
+            return redirect("appointments_patient")
+        if appt:
+            metrics.booking("waitlist", "success")
+            messages.success(request, "จองคิวว่างเรียบร้อยแล้ว")
+        else:
+            metrics.booking("waitlist", "conflict")
+            messages.error(request, "ข้อเสนอนี้หมดอายุหรือคิวถูกจองไปแล้ว")
+    elif waitlist.decline_offer(offer):
+        messages.success(request, "ปฏิเสธข้อเสนอแล้ว คุณยังอยู่ในคิวรอ")
+    return redirect("appointments_patient")
+
+
+@login_required
+@role_required(["admin"])
 def appointment_update_status(request, pk):
-    appt = get_object_or_404(Appointment, pk=pk)
     if request.method == "POST":
         new_status = request.POST.get("status")
-        if new_status in dict(Appointment.STATUS_CHOICES):
-            appt.status = new_status
-            appt.save()
+        if new_status not in STATUS_VALUES:
+            messages.error(request, "สถานะไม่ถูกต้อง")
+        elif transition(pk, new_status):
             messages.success(request, "อัปเดตสถานะสำเร็จ")
         else:
-            messages.error(request, "สถานะไม่ถูกต้อง")
-    return redirect("appointments_patient")
+            get_object_or_404(Appointment, pk=pk)
+            messages.error(request, "ไม่สามารถเปลี่ยนเป็นสถานะนี้จากสถานะปัจจุบันได้")
+    return redirect("appointments")
 
 
 @login_required
 def confirm_appointment(request, pk):
     # หา patient จาก email user ที่ login
-    patient = Patient.objects.filter(email=request.user.email).first()
+    patient = _patient_for(request.user)
     if not patient:
         messages.error(request, "ไม่พบข้อมูลผู้ป่วยของคุณ")
         return redirect("appointments_patient")
 
-    # หา appointment ของ patient
-    appt = get_object_or_404(Appointment, pk=pk, patient=patient)
+    # ✅ ยืนยันได้ ก็ต่อเมื่อเป็นนัดของ patient และไม่ได้สร้างเอง
+    if transition(pk, "confirmed", Q(patient=patient) & ~Q(created_by=request.user)):
+        messages.success(request, "คุณได้ยืนยันการนัดหมายแล้ว")
+        return redirect("appointments_patient")
 
-    # ถ้าคนที่สร้างนัดนี้เป็น user คนเดียวกับผู้ที่ล็อกอิน
-    if appt.created_by == request.user:
+    # ไม่สำเร็จ -> อ่านแถวเพื่อบอกเหตุผล
+    appt = get_object_or_404(Appointment, pk=pk, patient=patient)
+    if appt.created_by_id == request.user.pk:
         messages.error(
             request,
             "คุณไม่สามารถยืนยันการจองที่คุณสร้างเองได้ ต้องรอแอดมินคลินิกยืนยันการจองแทน"
         )
-        return redirect("appointments_patient")
-
-    # ✅ ยืนยันได้ ก็ต่อเมื่อสร้างโดย Admin
-    appt.status = "confirmed"
-    appt.save()
-
-    messages.success(request, "คุณได้ยืนยันการนัดหมายแล้ว")
+    else:
+        messages.error(request, "ไม่สามารถยืนยันนัดหมายนี้ได้ในสถานะปัจจุบัน")
     return redirect("appointments_patient")
 
 
-
-
-from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404, redirect
-from django.contrib import messages
-from .models import Appointment
-
 @login_required
 def confirm_appointment_admin(request, pk):
-    appt = get_object_or_404(Appointment, pk=pk)
-
-    # ❌ ถ้าแอดมินเป็นคนสร้างเอง ห้ามยืนยัน
-    if appt.created_by == request.user:
-        messages.error(request, "ไม่สามารถยืนยันการจองที่คุณสร้างเองได้")
+    # ✅ เปลี่ยนสถานะเป็น confirmed (ถ้าแอดมินเป็นคนสร้างเอง ห้ามยืนยัน)
+    if transition(pk, "confirmed", ~Q(created_by=request.user)):
+        messages.success(request, "ยืนยันการจองเรียบร้อยแล้ว")
         return redirect("appointments")
 
-    # ✅ เปลี่ยนสถานะเป็น confirmed
-    appt.status = "confirmed"
-    appt.save()
-    messages.success(request, f"ยืนยันการจองของ {appt.patient.name} เรียบร้อยแล้ว")
-
+    appt = get_object_or_404(Appointment, pk=pk)
+    if appt.created_by_id == request.user.pk:
+        messages.error(request, "ไม่สามารถยืนยันการจองที่คุณสร้างเองได้")
+    else:
+        messages.error(request, "ไม่สามารถยืนยันนัดหมายนี้ได้ในสถานะปัจจุบัน")
     return redirect("appointments")
 
 @login_required
 def cancel_appointment(request, pk):
-    patient = Patient.objects.filter(email=request.user.email).first()
-    appt = get_object_or_404(Appointment, pk=pk, patient=patient)
-
-    appt.status = "cancelled"
-    appt.save()
-    messages.success(request, "คุณได้ยกเลิกการนัดหมายแล้ว")
+    patient = _patient_for(request.user)
+    if transition(pk, "cancelled", Q(patient=patient)):
+        messages.success(request, "คุณได้ยกเลิกการนัดหมายแล้ว")
+    else:
+        get_object_or_404(Appointment, pk=pk, patient=patient)
+        messages.error(request, "ไม่สามารถยกเลิกนัดหมายนี้ได้ในสถานะปัจจุบัน")
     return redirect("appointments_patient")
 
 
 @login_required
 def edit_appointment(request, pk):
-    patient = Patient.objects.filter(email=request.user.email).first()
+    patient = _patient_for(request.user)
     appt = get_object_or_404(Appointment, pk=pk, patient=patient, created_by=request.user)
 
     if request.method == "POST":
         form = PatientAppointmentForm(request.POST, patient=patient, instance=appt)
         if form.is_valid():
-            form.save()
+            try:
+                form.save()
+            except VersionConflict:
+                return render(request, "patient/appointment_edit.html", {"form": form, "appt": appt})
+            audit.record_form_changes(form)
             messages.success(request, "แก้ไขนัดหมายเรียบร้อย")
             return redirect("appointments_patient")   
     else:
@@ -677,15 +966,9 @@ def edit_appointment(request, pk):
     return render(request, "patient/appointment_edit.html", {"form": form, "appt": appt})
 
 
-from django.shortcuts import render, redirect
-from django.contrib.auth.decorators import login_required
-from django.contrib import messages
-from .models import Patient
-from .forms import PatientForm
-
 @login_required
 def patient_profile(request):
-    patient = Patient.objects.filter(email=request.user.email).first()
+    patient = _patient_for(request.user, full=True)
     if not patient:
         messages.error(request, "ไม่พบข้อมูลผู้ป่วย")
         return redirect("patient_dashboard")
@@ -697,10 +980,9 @@ def patient_profile(request):
     })
 
 
-
 @login_required
 def patient_edit_profile(request):
-    patient = Patient.objects.filter(email=request.user.email).first()
+    patient = _patient_for(request.user, full=True)
     if not patient:
         messages.error(request, "ไม่พบข้อมูลผู้ป่วย")
         return redirect("patient_dashboard")
@@ -708,8 +990,15 @@ def patient_edit_profile(request):
     if request.method == "POST":
         form = PatientProfileForm(request.POST, request.FILES, instance=patient)
         if form.is_valid():
-            form.save()
-            messages.success(request, "แก้ไขโปรไฟล์เรียบร้อย")
+            try:
+                form.save()
+                messages.success(request, "แก้ไขโปรไฟล์เรียบร้อย")
+            except VersionConflict:
+                for error in form.non_field_errors():
+                    messages.error(request, error)
+        elif form.non_field_errors():
+            for error in form.non_field_errors():
+                messages.error(request, error)
         else:
             messages.error(request, "ข้อมูลไม่ถูกต้อง กรุณาลองอีกครั้ง")
 
@@ -0,0 +1,220 @@
+# clinic/waitlist.py
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import audit
+from .assignment import minute_span, overlapping
+from .models import Appointment, FreedSlot, WaitlistEntry, WaitlistOffer
+from .signals import appointments_changed
+
+ACTIVE_OFFER_STATUSES = ("held", "accepted")
+
+
+def freed_slots(now=None):
+    """
+    นัดที่ถูกยกเลิกและยังไม่ถึงเวลาเริ่ม ยังไม่มีใครจองช่วงนั้นใหม่ และยังไม่มีข้อเสนอที่ค้างอยู่
+    """
+    local = timezone.localtime(now)
+    rebooked = Appointment.objects.filter(
+        dentist_id=OuterRef("dentist_id"),
+        appointment_date=OuterRef("appointment_date"),
+        start_time=OuterRef("start_time"),
+    ).exclude(status="cancelled")
+    offered = WaitlistOffer.objects.filter(appointment_id=OuterRef("pk"), status__in=ACTIVE_OFFER_STATUSES)
+    return (
+        Appointment.objects.filter(status="cancelled")
+        .filter(
+            Q(appointment_date__gt=local.date())
+            | Q(appointment_date=local.date(), start_time__gt=local.time())
+        )
+        .exclude(Exists(rebooked))
+        .exclude(Exists(offered))
+        .select_related("dentist", "service")
+        .order_by("appointment_date", "start_time")
+    )
+
+
+def slot_start(slot):
+    return timezone.make_aware(datetime.combine(slot.appointment_date, slot.start_time))
+
+
+def candidates(slots):
+    """
+    คนไข้ที่รอทุกคนที่อาจเข้ากับช่องว่างชุดนี้ ด้วย query เดียว (ใช้ waitlist_match_idx)
+    คืนค่า (รายการ, {(นัด, รายการ) ที่เคยเสนอแล้ว}) เรียงคนที่ระบุทันตแพทย์ก่อน แล้วตามเวลาที่ลงชื่อ
+    """
+    entries = list(
+        WaitlistEntry.objects.filter(
+            status="waiting",
+            service_id__in={slot.service_id for slot in slots},
+            earliest_date__lte=max(slot.appointment_date for slot in slots),
+            latest_date__gte=min(slot.appointment_date for slot in slots),
+        )
+        .select_related("patient")
+        .order_by(F("dentist_id").asc(nulls_last=True), "created_at")
+    )
+    if not entries:
+        return [], set()
+    offered = set(
+        WaitlistOffer.objects.filter(appointment_id__in=[slot.pk for slot in slots])
+        .values_list("appointment_id", "entry_id")
+    )
+    return entries, offered
+
+
+def best_candidate(slot, entries, offered):
+    """
+    คนไข้ที่เหมาะที่สุดสำหรับช่องว่าง: บริการตรง วันอยู่ในช่วงที่สะดวก ทันตแพทย์ตรงหรือไม่ระบุ
+    ไม่ใช่เจ้าของนัดเดิม และยังไม่เคยได้รับข้อเสนอช่องนี้
+    """
+    for entry in entries:
+        if (
+            entry.status == "waiting"
+            and entry.service_id == slot.service_id
+            and entry.earliest_date <= slot.appointment_date <= entry.latest_date
+            and entry.dentist_id in (None, slot.dentist_id)
+            and entry.patient_id != slot.patient_id
+            and (slot.pk, entry.pk) not in offered
+        ):
+            return entry
+    return None
+
+
+def _offer_message(offer, slot):
+    patient = offer.entry.patient
+    body = (
+        f"สวัสดี คุณ{patient.name}\n\n"
+        f"มีคิวว่างสำหรับ {slot.service.name} กับ {slot.dentist}\n"
+        f"วันที่ {slot.appointment_date:%d/%m/%Y} เวลา {slot.start_time:%H:%M} น.\n"
+        f"กรุณายืนยันในระบบภายใน {timezone.localtime(offer.expires_at):%d/%m/%Y %H:%M} น."
+    )
+    from_email = getattr(settings, "DEFAULT_FROM_EMAIL", settings.EMAIL_HOST_USER)
+    return EmailMessage("มีคิวว่างตามที่คุณรอไว้", body, from_email, [patient.email])
+
+
+def expire_offers():
+    """ข้อเสนอที่หมดเวลา -> expired และคืนคนไข้กลับเข้าคิว คืนค่า id ของนัดที่ว่างกลับมา"""
+    now = timezone.now()
+    with transaction.atomic():
+        expired = list(
+            WaitlistOffer.objects.filter(status="held", expires_at__lt=now).values_list("entry_id", "appointment_id")
+        )
+        WaitlistOffer.objects.filter(status="held", expires_at__lt=now).update(status="expired")
+        WaitlistEntry.objects.filter(pk__in=[entry_id for entry_id, _ in expired], status="offered").update(
+            status="waiting"
+        )
+    return sorted({slot_id for _, slot_id in expired})
+
+
+def offer_freed_slots(**filters):
+    """
+    จับคู่ช่องว่างกับ waitlist แล้วส่งอีเมลเสนอ (ทำงานนอก request ผ่าน run_jobs)
+    จำกัดด้วย filters เช่น pk__in=[...] จากคิว FreedSlot
+    ไม่มี filters = ตรวจทุกช่องที่ยังไม่ถึงเวลา (waitlist_sweep)
+    ข้อเสนอหมดอายุไม่เกินเวลาเริ่มนัด
+    """
+    now = timezone.now()
+    hold = timedelta(minutes=getattr(settings, "CLINIC_WAITLIST_HOLD_MINUTES", 120))
+    slots = list(freed_slots(now).filter(**filters))
+    if not slots:
+        return 0
+    entries, offered = candidates(slots)
+
+    messages = []
+    for slot in slots:
+        entry = best_candidate(slot, entries, offered)
+        if entry is None:
+            continue
+        expires_at = min(now + hold, slot_start(slot))
+        with transaction.atomic():
+            # ล็อกนัดต้นทาง กัน waitlist_backfill กับ waitlist_sweep เสนอช่องเดียวกันซ้อนกัน
+            Appointment.objects.select_for_update().filter(pk=slot.pk).first()
+            if WaitlistOffer.objects.filter(appointment_id=slot.pk, status__in=ACTIVE_OFFER_STATUSES).exists():
+                continue
+            # จองคนไข้ไว้แบบมีเงื่อนไข กันสองช่องว่างเสนอให้คนเดียวกันพร้อมกัน
+            entry.status = "offered"
+            if not WaitlistEntry.objects.filter(pk=entry.pk, status="waiting").update(status="offered"):
+                continue
+            offer = WaitlistOffer.objects.create(entry=entry, appointment=slot, expires_at=expires_at)
+        if entry.patient.email:
+            messages.append(_offer_message(offer, slot))
+
+    if messages:
+        with get_connection(fail_silently=True) as connection:
+            connection.send_messages(messages)
+    return len(messages)
+
+
+def enqueue(slot_ids):
+    """
+    บันทึกนัดที่ว่างลงในคิว FreedSlot (INSERT เดียว ไม่จับคู่และไม่ส่งอีเมลใน request)
+    อยู่ใน transaction เดียวกับการยกเลิก ถ้า rollback คิวก็หายไปด้วย
+    """
+    FreedSlot.objects.bulk_create(
+        [FreedSlot(appointment_id=pk) for pk in slot_ids], ignore_conflicts=True
+    )
+
+
+def take_queued():
+    """ดึง id ของนัดทั้งหมดในคิวออกมา (ลบทิ้งทันที ช่องที่ยังไม่มีคนรอจะถูกตรวจใหม่ใน waitlist_sweep)"""
+    with transaction.atomic():
+        ids = list(FreedSlot.objects.values_list("appointment_id", flat=True))
+        FreedSlot.objects.filter(appointment_id__in=ids).delete()
+    return ids
+
+
+class PatientBusy(Exception):
+    """คนไข้มีนัดอื่นที่ทับช่วงเวลาของช่องว่างอยู่แล้ว"""
+
+
+def accept_offer(offer, user):
+    """
+    รับข้อเสนอ: สร้างนัดใหม่ในช่องเดิม ถ้ามีคนจองตัดหน้า (unique constraint) ถือว่าหมดอายุ
+    คืนค่านัดที่สร้าง หรือ None
+    ถ้าคนไข้มีนัดอื่นทับช่วงนั้น ข้อเสนอถือว่าถูกปฏิเสธ (เสนอคนถัดไป) แล้วยก PatientBusy
+    """
+    slot = offer.appointment
+    begin, finish = minute_span(slot.start_time, slot.end_time, slot.service.duration_minutes)
+    try:
+        with transaction.atomic():
+            if not WaitlistOffer.objects.filter(
+                pk=offer.pk, status="held", expires_at__gte=timezone.now()
+            ).update(status="accepted"):
+                return None
+            if overlapping(slot.appointment_date, begin, finish).filter(patient_id=offer.entry.patient_id).exists():
+                raise PatientBusy()
+            appt = Appointment.objects.create(
+                patient_id=offer.entry.patient_id,
+                dentist_id=slot.dentist_id,
+                service_id=offer.entry.service_id,
+                appointment_date=slot.appointment_date,
+                start_time=slot.start_time,
+                end_time=slot.end_time,
+                status="scheduled",
+                created_by=user,
+            )
+            WaitlistEntry.objects.filter(pk=offer.entry_id).update(status="booked")
+    except IntegrityError:
+        WaitlistOffer.objects.filter(pk=offer.pk, status="held").update(status="expired")
+        return None
+    except PatientBusy:
+        decline_offer(offer)
+        raise
+    audit.record(appt.pk, "created", new_status=appt.status)
+    appointments_changed.send(sender=Appointment)
+    return appt
+
+
+def decline_offer(offer):
+    """ปฏิเสธข้อเสนอ: กลับเข้าคิว และเข้าคิวเสนอช่องนี้ให้คนถัดไปในรอบ waitlist_backfill ถัดไป"""
+    with transaction.atomic():
+        if WaitlistOffer.objects.filter(pk=offer.pk, status="held").update(status="declined"):
+            WaitlistEntry.objects.filter(pk=offer.entry_id, status="offered").update(status="waiting")
+            enqueue([offer.appointment_id])
+            return True
+    return False
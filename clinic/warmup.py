@@ -0,0 +1,70 @@
+# clinic/warmup.py
+"""
+เตรียมของที่ Django สร้างแบบ lazy ให้เสร็จก่อน worker รับคำขอแรก
+เปิดด้วย CLINIC_WARMUP = True (gunicorn --preload จะทำครั้งเดียวใน master ก่อน fork)
+"""
+import logging
+import time
+import warnings
+
+from django.db import DatabaseError, connections
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+from . import refdata
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEMPLATES = (
+    "login.html",
+    "dental_clinic/base.html",
+    "dental_clinic/dashboard.html",
+    "dental_clinic/appointments.html",
+    "dental_clinic/appointment_form.html",
+    "dental_clinic/patients.html",
+    "patient/base_patient.html",
+    "patient/patient_dashboard.html",
+    "patient/appointments_patient.html",
+)
+
+
+def _prime_urls():
+    resolver = get_resolver()
+    resolver.reverse_dict  # noqa: B018 สร้างตาราง reverse ของทุก URL
+    resolver.resolve("/")
+
+
+def _compile_templates():
+    for name in WARMUP_TEMPLATES:
+        try:
+            get_template(name)
+        except TemplateDoesNotExist:
+            logger.warning("Warm-up template %s not found", name)
+
+
+def _load_providers():
+    from allauth.socialaccount import providers
+
+    providers.registry.load()
+
+
+def _load_refdata():
+    try:
+        with warnings.catch_warnings():
+            # ตั้งใจ query ใน ready() (Django เตือนเป็น RuntimeWarning)
+            warnings.simplefilter("ignore", RuntimeWarning)
+            refdata.warm()
+    except DatabaseError:
+        # เช่นรัน migrate ครั้งแรกที่ยังไม่มีตาราง
+        logger.warning("Warm-up skipped reference data (database not ready)")
+    finally:
+        # ห้ามส่ง connection ที่เปิดใน master ต่อให้ worker หลัง fork
+        connections.close_all()
+
+
+def warm_up():
+    started = time.perf_counter()
+    for step in (_prime_urls, _compile_templates, _load_providers, _load_refdata):
+        step()
+    logger.info("Warm-up finished in %.1f ms", (time.perf_counter() - started) * 1000)
@@ -54,11 +54,15 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'clinic.metrics.MetricsMiddleware',
+    'clinic.slowlog.SlowQueryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'allauth.account.middleware.AccountMiddleware',  # Add this line
+    'clinic.audit.AuditMiddleware',
+    'clinic.db_routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,6 +87,25 @@ TEMPLATES = [
     },
 ]
 
+# Cache: version ของรายงาน (clinic.reports) และข้อมูลอ้างอิง (clinic.refdata) อยู่ที่นี่
+# ค่าเริ่มต้นเป็นไฟล์ในเครื่อง ใช้ร่วมกันได้เฉพาะ worker บน host เดียวกัน ถ้ารันหลาย host
+# (เว็บหลายเครื่อง หรือ run_jobs แยกเครื่อง) ต้องตั้ง CACHE_BACKEND=db เพื่อให้การ invalidate ถึงทุก host
+# CACHE_BACKEND=db ใช้ตาราง clinic_cache ในฐานข้อมูลหลัก (สร้างด้วย python manage.py createcachetable)
+if os.getenv('CACHE_BACKEND') == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'clinic_cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / '.cache')),
+        }
+    }
+
 # Database
 DATABASES = {
     'default': {
@@ -95,6 +118,21 @@ DATABASES = {
     }
 }
 
+# Read replica (ไม่บังคับ): ตั้ง DB_REPLICA_HOST เพื่อให้หน้ารายงาน/export อ่านจาก replica
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['clinic.db_routers.ReplicaRouter']
+CLINIC_REPLICA_PIN_SECONDS = 10
+# การเขียนโมเดลของแอปเหล่านี้ทำให้ถูก pin ยกเว้นโมเดลใน CLINIC_REPLICA_PIN_IGNORE (ข้อมูลภายในระบบ)
+CLINIC_REPLICA_PIN_APPS = ('clinic',)
+CLINIC_REPLICA_PIN_IGNORE = ('clinic.idempotencykey', 'clinic.slowquery')
+
 
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -131,9 +169,47 @@ LOGOUT_REDIRECT_URL = '/login/'
 
 
 
-# Media files
+# Media files (เสิร์ฟผ่าน clinic.views.media_file ที่ตรวจสิทธิ์ก่อน)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# ให้ front server ส่งไฟล์แทน worker: "nginx" (X-Accel-Redirect), "apache" (X-Sendfile), "" = Django ส่งเอง
+CLINIC_MEDIA_SENDFILE = os.getenv('CLINIC_MEDIA_SENDFILE', '')
+CLINIC_MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# /metrics/ (Prometheus): ผู้ดูแลที่ login หรือส่ง Authorization: Bearer <token>
+CLINIC_METRICS_TOKEN = os.getenv('CLINIC_METRICS_TOKEN', '')
+
+# บันทึก query ที่ช้ากว่า (ms) ลงตาราง SlowQuery, None = ปิด
+CLINIC_SLOW_QUERY_MS = 200
+CLINIC_SLOW_QUERY_MAX_ROWS = 500
+
+# POST ที่มี Idempotency-Key: เก็บผลไว้ตอบคำขอซ้ำกี่วินาที / รอคำขอแรกที่ยังไม่เสร็จได้นานเท่าไร
+CLINIC_IDEMPOTENCY_TTL = 600
+CLINIC_IDEMPOTENCY_WAIT = 5
+
+# ฐานข้อมูลที่ load_booking สร้าง/ลบข้อมูลทดสอบได้แม้ DEBUG ปิด (นอกจากชื่อที่ขึ้นต้นด้วย test_)
+CLINIC_SCRATCH_DATABASES = []
+
+# Clinic periodic jobs (python manage.py run_jobs)
+CLINIC_NO_SHOW_GRACE_MINUTES = 60
+CLINIC_JOB_BATCH_SIZE = 500
+CLINIC_REMINDER_BATCH_SIZE = 100
+CLINIC_WAITLIST_HOLD_MINUTES = 120
+CLINIC_PARTITION_MONTHS_AHEAD = 3
+# หาผู้ป่วยซ้ำ (clinic/dedupe.py): คะแนนขั้นต่ำที่เก็บเป็นคู่ให้ตรวจ / ขนาดกลุ่ม blocking สูงสุดที่เทียบ
+CLINIC_DEDUPE_MIN_SCORE = 0.7
+CLINIC_DEDUPE_MAX_BLOCK = 50
+
+# เตรียม URL/template/ข้อมูลอ้างอิงตอนเริ่ม process (ดู clinic/warmup.py)
+CLINIC_WARMUP = os.getenv('CLINIC_WARMUP', '0') == '1'
+
+# Reports
+CLINIC_CHAIR_MINUTES_PER_DAY = 480
+CLINIC_WORKING_WEEKDAYS = (0, 1, 2, 3, 4, 5)  # จันทร์-เสาร์
+CLINIC_REPORT_CACHE_SECONDS = 600
+
+# Calendar (ชั่วโมงเปิด-ปิดที่แสดงในตาราง)
+CLINIC_CALENDAR_HOURS = (8, 20)
 
 # Internationalization
 LANGUAGE_CODE = 'th'
@@ -0,0 +1,40 @@
+# settings_production.py
+# ใช้บนเซิร์ฟเวอร์จริง: DJANGO_SETTINGS_MODULE=dental_clinic.settings_production
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import TEMPLATES
+
+DEBUG = False
+SECRET_KEY = os.environ['SECRET_KEY']
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host]
+
+# parse template ครั้งเดียวต่อ process (ระบุ loader เองจึงต้องปิด APP_DIRS)
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            **TEMPLATES[0]['OPTIONS'],
+            'context_processors': [
+                cp for cp in TEMPLATES[0]['OPTIONS']['context_processors']
+                if cp != 'django.template.context_processors.debug'
+            ],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    },
+]
+
+# ใช้คู่กับ gunicorn --preload: warm-up ครั้งเดียวใน master แล้ว fork
+CLINIC_WARMUP = os.getenv('CLINIC_WARMUP', '1') == '1'
+
+# nginx: location /protected-media/ { internal; alias <MEDIA_ROOT>/; } และไม่เปิด /media/ ตรง
+CLINIC_MEDIA_SENDFILE = os.getenv('CLINIC_MEDIA_SENDFILE', 'nginx')
+
+SESSION_COOKIE_SECURE = True
+CSRF_COOKIE_SECURE = True
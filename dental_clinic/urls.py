@@ -15,15 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from clinic.views import media_file
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('clinic.urls')),  
     path('accounts/', include('allauth.urls')),
-
+    # ไฟล์อัปโหลดผ่านการตรวจสิทธิ์ทุก environment (ดู clinic/media.py)
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', media_file, name='media'),
 ]
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file